@@ -1,5 +1,5 @@
-import multiprocessing
 import os
+import queue
 from logging.config import dictConfig
 
 from dotenv import load_dotenv, find_dotenv
@@ -7,16 +7,30 @@ from flasgger import Swagger
 from flask import request, Response, abort, jsonify
 from flask_api import FlaskAPI
 
-from common.authentication import AuthError, get_token, requires_auth, requires_account
+from common.authentication import AuthError, get_token, requires_auth, requires_account, requires_scope
 from common import authentication
-from common.vault_api import Vault
+from common.async_shell import shell_engine
+from common.aws_clients import aws_clients
+from common.http_client import http_client
+from common.job_api import list_jobs, cancel_job, get_job, get_job_status
+from common.job_scheduler import QueueFullError, scheduler, JOB_RETRY_AFTER_SEC
+from common.job_store import get_job_store
+from common.kube_client import kube_clients
+from common.kubeconfig_cache import kubeconfig_cache
+from common.log_api import log_bus
+from common.vault_api import Vault, secret_cache
+from common.vault_pool import client_pool
 from helm import helm_bp
-from helm.helm_bp import helm_bp_instance
+from helm.chart_cache import get_chart_cache
+from helm.helm_bp import helm_bp_instance, HELM_ADMIN_SCOPE
 from helm.helm_processor import HelmProcessor
 from helm.helm_service import HelmService
 from infra import infrastructure_bp
-from infra.infrastructure_bp import infra_bp_instance, infra_bp_instance_deprecated
+from infra.infrastructure_bp import infra_bp_instance, infra_bp_instance_deprecated, RESOURCE_ADMIN_SCOPE
 from infra.infrastructure_service import InfrastructureService
+from infra.network_allocator import network_allocator
+from infra.resource_inventory import resource_inventory
+from infra.terraform_cache import get_terraform_cache, get_plan_cache
 
 dictConfig({
     'version': 1,
@@ -51,6 +65,12 @@ app.config["VAULT_SECRETS_PATH"] = os.getenv("VAULT_SECRETS_PATH")
 
 infrastructure_service = None
 
+# Scope required to cancel job of given kind (name of job function), other kinds require RESOURCE_ADMIN_SCOPE
+JOB_ADMIN_SCOPES = {"create_resource": RESOURCE_ADMIN_SCOPE,
+                    "destroy_resource": RESOURCE_ADMIN_SCOPE,
+                    "helm_deploy": HELM_ADMIN_SCOPE,
+                    "helm_destroy": HELM_ADMIN_SCOPE}
+
 
 @app.errorhandler(AuthError)
 def handle_auth_error(ex):
@@ -59,6 +79,14 @@ def handle_auth_error(ex):
     return response
 
 
+@app.errorhandler(QueueFullError)
+def handle_queue_full_error(ex):
+    response = jsonify({"error": str(ex)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(JOB_RETRY_AFTER_SEC)
+    return response
+
+
 @app.route("/accounts", methods=['POST'], strict_slashes=False)
 @requires_auth
 def create_account():
@@ -77,6 +105,65 @@ def get_token_api():
     return get_token(request.get_json())
 
 
+@app.route("/jobs", methods=['GET'], strict_slashes=False)
+@requires_auth
+def get_jobs_api():
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return abort(400, Response("limit must be integer"))
+    result, err = list_jobs(request.args.get("state"), request.args.get("name"), limit,
+                            request.args.get("page_token"))
+    if err != 0:
+        return abort(400, Response(result))
+    return jsonify(result)
+
+
+@app.route("/jobs/<job_id>/cancel", methods=['POST'], strict_slashes=False)
+@requires_auth
+def cancel_job_api(job_id):
+    status, err = get_job_status(job_id)
+    if err != 0:
+        return abort(404, Response(status))
+    # cancelling requires the same permissions as starting the job
+    scope = JOB_ADMIN_SCOPES.get(status["name"], RESOURCE_ADMIN_SCOPE)
+    if not requires_scope(scope):
+        raise AuthError({"code": "no_scope",
+                         "description": f"Cancelling {status['name']} job requires '{scope}' permission"}, 403)
+    job = get_job(job_id)
+    if job is not None and isinstance(job.data, dict) and job.data.get("account"):
+        requires_account(job.data["account"])
+    cancelled = cancel_job(job_id)
+    status, _ = get_job_status(job_id)
+    if not cancelled:
+        return abort(409, Response(f"Job {job_id} is complete already: {status['state']}"))
+    return jsonify(status)
+
+
+@app.route("/stats", methods=['GET'], strict_slashes=False)
+def get_stats_api():
+    stats = {
+        "vault_cache": secret_cache.stats(),
+        "vault_clients": client_pool.stats(),
+        "chart_cache": get_chart_cache().stats(),
+        "terraform_cache": get_terraform_cache().stats(),
+        "terraform_plans": get_plan_cache().stats(),
+        "kubeconfig_cache": kubeconfig_cache.stats(),
+        "kube_api": kube_clients.stats(),
+        "log_bus": log_bus.stats(),
+        "jobs": get_job_store().stats(),
+        "job_scheduler": scheduler.stats(),
+        "shell_engine": shell_engine.stats(),
+        "aws_clients": aws_clients.stats(),
+        "resource_inventory": resource_inventory.stats(),
+        "network_allocator": network_allocator.stats(),
+        "http": http_client.stats()
+    }
+    if helm_bp.helm_service is not None:
+        stats["helm_processor"] = helm_bp.helm_service.helm_processor.stats()
+    return jsonify(stats)
+
+
 if __name__ == '__main__':
     vault = Vault(app.logger)
     vault_conf = vault.read(f"{vault.base_path}/common")["data"]
@@ -89,12 +176,10 @@ if __name__ == '__main__':
     authentication.auth_config = auth_conf
 
     # initialize helm service
-    manager = multiprocessing.Manager()
-    helm_results = manager.dict()
-    helm_processor = HelmProcessor(manager.Queue(), helm_results, app.logger)
+    helm_processor = HelmProcessor(queue.Queue(), app.logger)
     helm_processor.start()
 
-    helm_bp.helm_service = HelmService(helm_results, helm_processor)
+    helm_bp.helm_service = HelmService(helm_processor)
     infrastructure_service = InfrastructureService(app.logger)
     infrastructure_bp.service = infrastructure_service
 
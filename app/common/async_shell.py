@@ -0,0 +1,143 @@
+import asyncio
+import os
+import shlex
+import subprocess
+import threading
+
+from common.shell import start_process, terminate_process_group
+
+# Max number of commands running at once, the rest wait for their turn
+SHELL_ENGINE_MAX_CONCURRENCY = int(os.getenv("SHELL_ENGINE_MAX_CONCURRENCY", 64))
+
+
+class ShellEngine:
+    """
+    Runs commands on asyncio event loop in a dedicated thread, so any number of waiting commands
+    don't take a thread each. stdout and stderr are read concurrently while the command runs, so a command with
+    large output never blocks on full pipe.
+    run() and run_many() are blocking facade for synchronous callers.
+    """
+
+    def __init__(self, max_concurrency=SHELL_ENGINE_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.loop = None
+        self.semaphore = None
+        self.lock = threading.Lock()
+        self.running = 0
+        self.completed = 0
+
+    def run(self, cmd, env=None, cwd=None, timeout=300, cancel_token=None):
+        """
+        Execute a command and wait for its completion
+        :param cmd: command to execute, string is split with shlex
+        :param env: custom environment variables params to pass to command execution
+        :param cwd: current working directory (optional)
+        :param timeout: max duration of the command
+        :param cancel_token: CancellationToken, command is terminated when it's cancelled
+        :raise subprocess.TimeoutExpired: if command didn't complete in time, it's killed
+        :raise CancelledError: if command was cancelled
+        :return: (exit code, output lines: stdout, then stderr)
+        """
+        return asyncio.run_coroutine_threadsafe(self.__run(cmd, env, cwd, timeout, cancel_token),
+                                                self.__get_loop()).result()
+
+    def run_many(self, commands, env=None, cwd=None, timeout=300, cancel_token=None):
+        """
+        Execute independent commands concurrently and wait for all of them
+        :param commands: commands to execute (see run)
+        :raise subprocess.TimeoutExpired, CancelledError: if any of commands timed out or was cancelled
+        :return: [(exit code, output lines)] in order of commands
+        """
+
+        async def run_all():
+            return await asyncio.gather(*(self.__run(cmd, env, cwd, timeout, cancel_token) for cmd in commands))
+
+        return asyncio.run_coroutine_threadsafe(run_all(), self.__get_loop()).result()
+
+    def stats(self):
+        return {"max_concurrency": self.max_concurrency, "running": self.running, "completed": self.completed}
+
+    async def __run(self, cmd, env, cwd, timeout, cancel_token):
+        async with self.semaphore:
+            self.running += 1
+            try:
+                # spawned without asyncio's child watcher, that would take a thread per process
+                p, unregister = start_process(shlex.split(cmd) if isinstance(cmd, str) else cmd, env, cwd,
+                                              cancel_token, merge_stderr=False)
+                try:
+                    stdout, stderr = await asyncio.wait_for(self.__communicate(p), timeout)
+                except asyncio.TimeoutError:
+                    terminate_process_group(p, grace_sec=0)
+                    p.wait()
+                    raise subprocess.TimeoutExpired(p.args, timeout)
+                finally:
+                    unregister()
+                    p.stdout.close()
+                    p.stderr.close()
+            finally:
+                self.running -= 1
+                self.completed += 1
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        lines = stdout.decode("utf-8", errors="replace").splitlines()
+        lines.extend(stderr.decode("utf-8", errors="replace").splitlines())
+        return p.returncode, lines
+
+    async def __communicate(self, p):
+        """Read stdout and stderr until both are closed, then await for process exit"""
+        loop = asyncio.get_event_loop()
+        readers = [self.__drain(loop, pipe) for pipe in (p.stdout, p.stderr)]
+        try:
+            stdout, stderr = await asyncio.gather(*(future for (_, future) in readers))
+        finally:
+            for (fd, _) in readers:
+                loop.remove_reader(fd)
+        # output is closed, process is exiting
+        delay = 0.001
+        while p.poll() is None:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        return stdout, stderr
+
+    @staticmethod
+    def __drain(loop, pipe):
+        """:return: (fd, future with all bytes read from pipe)"""
+        fd = pipe.fileno()
+        os.set_blocking(fd, False)
+        chunks = []
+        future = loop.create_future()
+
+        def on_readable():
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                return
+            if chunk:
+                chunks.append(chunk)
+                return
+            loop.remove_reader(fd)
+            if not future.done():
+                future.set_result(b"".join(chunks))
+
+        loop.add_reader(fd, on_readable)
+        return fd, future
+
+    def __get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                ready = threading.Event()
+                thread = threading.Thread(target=self.__run_loop, args=(ready,), name="shell-engine", daemon=True)
+                thread.start()
+                ready.wait()
+            return self.loop
+
+    def __run_loop(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.loop = loop
+        ready.set()
+        loop.run_forever()
+
+
+shell_engine = ShellEngine()
@@ -1,17 +1,25 @@
 """Python Flask API Auth0 integration
 """
 
-import json
+import os
+import threading
+import time
 from functools import wraps
 
-import requests
 from flask import request, _request_ctx_stack
-from jose import jwt
-from six.moves.urllib.request import urlopen
+from jose import jwt, jwk
+
+from common.http_client import http_client
 
 auth_config = {}
 ALGORITHMS = ["RS256"]
 
+# How long fetched signing keys are considered fresh. Stale keys are still served while refreshing in background
+JWKS_TTL_SEC = int(os.getenv("JWKS_TTL_SEC", 3600))
+# Minimal interval between forced refreshes caused by unknown 'kid' (protects Auth0 from garbage tokens)
+JWKS_MIN_REFRESH_INTERVAL_SEC = int(os.getenv("JWKS_MIN_REFRESH_INTERVAL_SEC", 30))
+JWKS_FETCH_TIMEOUT_SEC = int(os.getenv("JWKS_FETCH_TIMEOUT_SEC", 5))
+
 
 # Format error response and append status code.
 class AuthError(Exception):
@@ -49,6 +57,94 @@ def get_token_auth_header():
     return token
 
 
+def jwks_url():
+    return auth_config.get("jwks_url", "https://" + auth_config["auth0_domain"] + "/.well-known/jwks.json")
+
+
+def fetch_jwks():
+    response = http_client.get(jwks_url(), timeout=JWKS_FETCH_TIMEOUT_SEC)
+    response.raise_for_status()
+    return response.json()
+
+
+class JwksCache:
+    """
+    Process-wide cache of Auth0 signing keys (JWKS), keyed by 'kid'.
+    Keeps already constructed RSA key objects, so token validation doesn't parse JWK on every request.
+    Expired keys are refreshed in background thread and served meanwhile. Unknown 'kid' triggers
+    single forced refresh (not more often than min_refresh_interval).
+    """
+
+    def __init__(self, fetch=fetch_jwks, ttl=JWKS_TTL_SEC, min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL_SEC):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.rsa_keys = {}
+        self.fetched_at = 0.
+        self.last_attempt = 0.
+        self.refresh_lock = threading.Lock()
+        self.thread_lock = threading.Lock()
+        self.refresh_thread = None
+
+    def get_key(self, kid):
+        """
+        Get RSA key object for given key id
+        :param kid: key id from JWT header
+        :return: key object or None if Auth0 doesn't know such key
+        """
+        if not self.rsa_keys:
+            self.refresh()
+        elif time.time() - self.fetched_at > self.ttl:
+            self.__refresh_in_background()
+        key = self.rsa_keys.get(kid)
+        if key is None and time.time() - self.last_attempt > self.min_refresh_interval:
+            self.refresh()
+            key = self.rsa_keys.get(kid)
+        return key
+
+    def refresh(self):
+        """
+        Fetch JWKS and replace cached keys. On failure previously fetched keys stay in use
+        :return: True if keys were refreshed
+        """
+        with self.refresh_lock:
+            self.last_attempt = time.time()
+            try:
+                jwks = self.fetch()
+                rsa_keys = {}
+                for key in jwks["keys"]:
+                    rsa_key = {
+                        "kty": key["kty"],
+                        "kid": key["kid"],
+                        "use": key["use"],
+                        "n": key["n"],
+                        "e": key["e"]
+                    }
+                    rsa_keys[key["kid"]] = jwk.construct(rsa_key, ALGORITHMS[0])
+            except Exception as ex:
+                print(f"Failed to refresh JWKS: {ex}")
+                return False
+            self.rsa_keys = rsa_keys
+            self.fetched_at = time.time()
+            return True
+
+    def clear(self):
+        with self.refresh_lock:
+            self.rsa_keys = {}
+            self.fetched_at = 0.
+            self.last_attempt = 0.
+
+    def __refresh_in_background(self):
+        with self.thread_lock:
+            if self.refresh_thread is not None and self.refresh_thread.is_alive():
+                return
+            self.refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+            self.refresh_thread.start()
+
+
+jwks_cache = JwksCache()
+
+
 def requires_scope(required_scope):
     """Determines if the required scope is present in the access token
     Args:
@@ -71,8 +167,6 @@ def requires_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         token = get_token_auth_header()
-        jsonurl = urlopen("https://" + auth_config["auth0_domain"] + "/.well-known/jwks.json")
-        jwks = json.loads(jsonurl.read())
         try:
             unverified_header = jwt.get_unverified_header(token)
         except jwt.JWTError:
@@ -85,16 +179,7 @@ def requires_auth(f):
                              "description":
                                  "Invalid header. "
                                  "Use an RS256 signed JWT Access Token"}, 401)
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
+        rsa_key = jwks_cache.get_key(unverified_header.get("kid"))
         if rsa_key:
             try:
                 payload = jwt.decode(
@@ -152,7 +237,7 @@ def get_token(user_creds):
     }
     payload = {**app_creds, **user_creds}
     url = f"https://{auth_config['auth0_domain']}/oauth/token"
-    response = requests.post(url, payload)
+    response = http_client.post(url, payload)
     if response.status_code != 200:
         raise AuthError(response.text, response.status_code)
     return response.text
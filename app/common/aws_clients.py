@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import boto3
+import botocore.session
+from botocore.credentials import DeferredRefreshableCredentials
+
+# Lifetime of assumed role credentials. They are refreshed before expiry, so it doesn't limit operation duration
+AWS_ROLE_SESSION_SEC = int(os.getenv("AWS_ROLE_SESSION_SEC", 3600))
+AWS_ROLE_SESSION_NAME = os.getenv("AWS_ROLE_SESSION_NAME", "spinless")
+# Max number of accounts (credentials) with pooled sessions, least recently used are dropped
+AWS_CLIENT_POOL_MAX_ACCOUNTS = int(os.getenv("AWS_CLIENT_POOL_MAX_ACCOUNTS", 32))
+
+
+class AccountClients:
+    """Session of one account (credentials, optionally assumed role) and its clients"""
+
+    def __init__(self, session):
+        self.session = session
+        # (service, region) -> client
+        self.clients = {}
+
+
+class AwsClientPool:
+    """
+    boto3 clients shared by all threads (clients are thread-safe, sessions are not - they are only used under lock).
+    Credentials of assumed roles are cached per account and refreshed before they expire
+    """
+
+    def __init__(self, max_accounts=AWS_CLIENT_POOL_MAX_ACCOUNTS):
+        self.max_accounts = max_accounts
+        self.accounts = OrderedDict()
+        self.lock = threading.RLock()
+        self.clients_created = 0
+        self.assume_role_calls = 0
+
+    def client(self, service, aws_access_key, aws_secret_key, role_arn=None, region=None):
+        """
+        :param service: e.g. "s3", "eks", "iam", "sts"
+        :param aws_access_key: account's access key
+        :param aws_secret_key: account's secret key
+        :param role_arn: role to assume with account's credentials (optional)
+        :param region: client's region (optional)
+        :return: pooled client
+        """
+        with self.lock:
+            account = self.__account(aws_access_key, aws_secret_key, role_arn)
+            client = account.clients.get((service, region))
+            if client is None:
+                client = account.session.client(service, region_name=region)
+                account.clients[(service, region)] = client
+                self.clients_created += 1
+            return client
+
+    def session(self, aws_access_key, aws_secret_key, role_arn=None):
+        """
+        :return: pooled session. It must not be used concurrently, use client(...) in threads
+        """
+        with self.lock:
+            return self.__account(aws_access_key, aws_secret_key, role_arn).session
+
+    def clear(self):
+        with self.lock:
+            self.accounts.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"accounts": len(self.accounts),
+                    "clients": sum(len(account.clients) for account in self.accounts.values()),
+                    "clients_created": self.clients_created,
+                    "assume_role_calls": self.assume_role_calls}
+
+    def __account(self, aws_access_key, aws_secret_key, role_arn):
+        """Must be called under self.lock"""
+        key = hashlib.sha256(f"{aws_access_key}|{aws_secret_key}|{role_arn}".encode("utf-8")).hexdigest()
+        account = self.accounts.get(key)
+        if account is None:
+            if role_arn:
+                session = self.__role_session(aws_access_key, aws_secret_key, role_arn)
+            else:
+                session = boto3.Session(aws_access_key_id=aws_access_key, aws_secret_access_key=aws_secret_key)
+            account = AccountClients(session)
+            self.accounts[key] = account
+            while len(self.accounts) > self.max_accounts:
+                self.accounts.popitem(last=False)
+        self.accounts.move_to_end(key)
+        return account
+
+    def __role_session(self, aws_access_key, aws_secret_key, role_arn):
+        sts = self.client("sts", aws_access_key, aws_secret_key)
+
+        def assume_role():
+            with self.lock:
+                self.assume_role_calls += 1
+            credentials = sts.assume_role(RoleArn=role_arn, RoleSessionName=AWS_ROLE_SESSION_NAME,
+                                          DurationSeconds=AWS_ROLE_SESSION_SEC)["Credentials"]
+            return {"access_key": credentials["AccessKeyId"],
+                    "secret_key": credentials["SecretAccessKey"],
+                    "token": credentials["SessionToken"],
+                    "expiry_time": credentials["Expiration"].isoformat()}
+
+        # role is assumed on first use (not under the pool lock) and again when credentials are about to expire
+        credentials = DeferredRefreshableCredentials(refresh_using=assume_role, method="sts-assume-role")
+        core_session = botocore.session.get_session()
+        core_session._credentials = credentials
+        return boto3.Session(botocore_session=core_session)
+
+
+aws_clients = AwsClientPool()
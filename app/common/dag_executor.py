@@ -0,0 +1,104 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Step:
+    def __init__(self, name, func, depends_on=(), fatal=True):
+        """
+        :param name: unique name of the step
+        :param func: callable returning (err code, message), err code 0 means success
+        :param depends_on: names of steps that have to complete before this one starts
+        :param fatal: whether failure of the step fails the whole run. Steps depending on failed fatal step
+        are skipped, steps depending on failed non-fatal step are run anyway
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.fatal = fatal
+
+
+class DagExecutor:
+    """
+    Runs steps as soon as their dependencies complete, independent steps run concurrently
+    """
+
+    def __init__(self, steps, max_workers=8):
+        """
+        :raise ValueError: if steps have unknown dependencies or dependency cycle
+        """
+        self.steps = {step.name: step for step in steps}
+        self.max_workers = max_workers
+        # name -> (err code, message, elapsed sec)
+        self.results = {}
+        for step in steps:
+            unknown = [dep for dep in step.depends_on if dep not in self.steps]
+            if unknown:
+                raise ValueError(f"Step {step.name} depends on unknown steps {unknown}")
+        self.__check_cycles()
+
+    def run(self):
+        """
+        Run all steps. Start and completion (with duration) of every step is yielded as soon as it happens
+        :return: generator of (message, None) and, at the end, ("FAILED: ...", err code) if any fatal step failed
+        """
+        pending = dict(self.steps)
+        running = {}
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dag-step") as executor:
+            while pending or running:
+                for step in self.__ready(pending):
+                    pending.pop(step.name)
+                    failed_deps = [dep for dep in step.depends_on
+                                   if self.results[dep][0] != 0 and self.steps[dep].fatal]
+                    if failed_deps:
+                        self.results[step.name] = (1, f"skipped: {', '.join(failed_deps)} failed", 0.)
+                        yield f"Skipped {step.name}: {', '.join(failed_deps)} failed", None
+                        continue
+                    yield f"RUNNING: {step.name}...", None
+                    running[executor.submit(self.__run_step, step)] = step
+                if not running:
+                    # steps were skipped, more steps may be ready now
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    code, msg, elapsed = future.result()
+                    self.results[step.name] = (code, msg, elapsed)
+                    status = "OK" if code == 0 else ("FAILED" if step.fatal else "FAILED, resuming anyway")
+                    yield f"{step.name}: {status} in {elapsed:.1f}s. {msg}", None
+        total = time.monotonic() - started
+        sequential = sum(elapsed for (_, _, elapsed) in self.results.values())
+        yield f"Completed {len(self.steps)} steps in {total:.1f}s (sum of step durations {sequential:.1f}s)", None
+        failed = [name for (name, (code, _, _)) in self.results.items() if code != 0 and self.steps[name].fatal]
+        if failed:
+            yield f"FAILED: Failed steps: {', '.join(failed)}. {self.results[failed[0]][1]}", \
+                  self.results[failed[0]][0]
+
+    def __ready(self, pending):
+        return [step for step in list(pending.values()) if all(dep in self.results for dep in step.depends_on)]
+
+    @staticmethod
+    def __run_step(step):
+        started = time.monotonic()
+        try:
+            code, msg = step.func()
+        except Exception as ex:
+            code, msg = 1, str(ex)
+        return code, msg, time.monotonic() - started
+
+    def __check_cycles(self):
+        visited, in_path = set(), set()
+
+        def visit(name):
+            if name in in_path:
+                raise ValueError(f"Steps have dependency cycle through {name}")
+            if name in visited:
+                return
+            in_path.add(name)
+            for dep in self.steps[name].depends_on:
+                visit(dep)
+            in_path.discard(name)
+            visited.add(name)
+
+        for name in self.steps:
+            visit(name)
@@ -0,0 +1,92 @@
+import os
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_CONNECT_TIMEOUT_SEC = float(os.getenv("HTTP_CONNECT_TIMEOUT_SEC", 5))
+HTTP_READ_TIMEOUT_SEC = float(os.getenv("HTTP_READ_TIMEOUT_SEC", 60))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 20))
+# urllib3 1.26 renamed 'method_whitelist' of Retry to 'allowed_methods', 2.x doesn't accept the old name
+if hasattr(Retry, "DEFAULT_ALLOWED_METHODS"):
+    RETRY_METHODS = {"allowed_methods": Retry.DEFAULT_ALLOWED_METHODS}
+else:
+    RETRY_METHODS = {"method_whitelist": Retry.DEFAULT_METHOD_WHITELIST}
+
+
+class HttpClient:
+    """
+    Shared HTTP session for outgoing calls (helm registry, Auth0, Vault).
+    Keeps per-host pools of keep-alive connections, retries idempotent requests with backoff
+    on connection errors and 502/503/504, and applies default timeouts.
+    Collects per-host latency and connection reuse metrics.
+    """
+
+    def __init__(self, retries=HTTP_RETRIES, pool_size=HTTP_POOL_SIZE,
+                 timeout=(HTTP_CONNECT_TIMEOUT_SEC, HTTP_READ_TIMEOUT_SEC)):
+        self.timeout = timeout
+        self.session = requests.Session()
+        # only idempotent methods are retried (POST is not in default allowed methods)
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(502, 503, 504), raise_on_status=False,
+                      **RETRY_METHODS)
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.hooks["response"].append(self.__record_response)
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            with self.lock:
+                self.__host_metrics(urlparse(url).hostname)["errors"] += 1
+            raise
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request("POST", url, data=data, **kwargs)
+
+    def stats(self):
+        """
+        :return: per host: number of responses, errors, avg/max latency (till response headers),
+        connections opened and ratio of requests served by reused connections
+        """
+        connections = {}
+        for pool_key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(pool_key)
+            if pool is not None:
+                opened, served = connections.get(pool.host, (0, 0))
+                connections[pool.host] = (opened + pool.num_connections, served + pool.num_requests)
+        result = {}
+        with self.lock:
+            for (host, m) in self.metrics.items():
+                opened, served = connections.get(host, (0, 0))
+                result[host] = {"responses": m["responses"],
+                                "errors": m["errors"],
+                                "avg_latency_ms": round(m["total_sec"] * 1000 / max(m["responses"], 1), 3),
+                                "max_latency_ms": round(m["max_sec"] * 1000, 3),
+                                "connections_opened": opened,
+                                "connection_reuse": round(1 - opened / served, 3) if served else 0.}
+        return result
+
+    def __record_response(self, response, *args, **kwargs):
+        elapsed = response.elapsed.total_seconds()
+        with self.lock:
+            m = self.__host_metrics(urlparse(response.url).hostname)
+            m["responses"] += 1
+            m["total_sec"] += elapsed
+            m["max_sec"] = max(m["max_sec"], elapsed)
+
+    def __host_metrics(self, host):
+        return self.metrics.setdefault(host, {"responses": 0, "errors": 0, "total_sec": 0., "max_sec": 0.})
+
+
+http_client = HttpClient()
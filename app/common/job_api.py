@@ -1,13 +1,20 @@
 import json
+import os
+import threading
 import time
 import uuid
 from enum import Enum
-from multiprocessing import Value
 from threading import Thread
 
-from common.log_api import JobLogger
+from common.job_scheduler import scheduler, DEFAULT_PRIORITY, QueueFullError
+from common.shell import CancellationToken
+from common.job_store import get_job_store, JOB_COMPACTION_INTERVAL_SEC
+from common.log_api import JobLogger, log_path
 
-jobs_dict = dict()
+# Jobs that are running in this process. Statuses of all jobs are in job store
+running_jobs = dict()
+running_jobs_lock = threading.Lock()
+compaction_thread = None
 
 
 class JobState(Enum):
@@ -19,110 +26,224 @@ class JobState(Enum):
 
 
 class Status:
-    """Job state. Shared between processes"""
+    """Job state. Persisted in job store"""
 
     def __init__(self, job_id, name="Noname"):
         self.id = job_id
         self.name = name
-        self.state = Value('b', JobState.CREATED.value)
+        self.state = JobState.CREATED.value
         self.start = time.time()
-        self.end = Value("d", 0.0)
-        self.elapsed = Value("d", 0.0)
+        self.end = 0.0
+        self.elapsed = 0.0
+        get_job_store().create(job_id, name, JobState.CREATED.name, self.start)
 
     def update(self, state_code):
-        self.state.value = state_code
+        self.state = state_code
+        get_job_store().update(self.id, JobState(state_code).name)
 
     def finish(self, state_code):
-        self.state.value = state_code
+        self.state = state_code
         curr = time.time()
-        self.end.value = curr
-        self.elapsed.value = curr - self.start
+        self.end = curr
+        self.elapsed = curr - self.start
+        get_job_store().update(self.id, JobState(state_code).name, self.end, self.elapsed)
 
     def not_done(self):
         """Whether job is started or running"""
-        return self.state.value <= JobState.SUCCESS.value
+        return self.state <= JobState.SUCCESS.value
 
     def serialize(self):
-        return json.dumps({
-            "job_id": self.id,
-            "name": self.name,
-            "state": JobState(self.state.value).name,
-            "start": int(self.start),
-            "end": int(self.end.value),
-            "elapsed": int(self.elapsed.value)
-        })
+        return json.dumps(serialize_status(get_job_store().get(self.id)))
+
+
+def serialize_status(record):
+    return {
+        "job_id": record["job_id"],
+        "name": record["name"],
+        "state": record["state"],
+        "start": int(record["start"]),
+        "end": int(record["end"]),
+        "elapsed": int(record["elapsed"])
+    }
 
 
 class Job:
-    def __init__(self, func, logger, data):
+    def __init__(self, func, logger, data, priority=DEFAULT_PRIORITY):
         self.job_id = str(uuid.uuid1())
         self.data = data
+        self.func = func
+        self.app_logger = logger
+        self.priority = priority
+        # job functions pass it to shell commands (see shell_run), cancel() terminates them
+        self.cancel_token = CancellationToken()
+        # guards state changes, reentrant: cancel() completes the job under it
+        self.lock = threading.RLock()
         self.logger = JobLogger(self.job_id)
-        self.thread = Thread(target=func, args=(self, logger))
-        self.status = Status(self.job_id)
+        self.status = Status(self.job_id, getattr(func, "__name__", "Noname"))
 
     def emit(self, _status, message):
-        if not self.logger.handlers():
+        if not self.logger.handlers() and not self.logger.closed:
             self.logger = JobLogger(self.job_id)
         self.logger.emit(_status, message)
 
     def emit_all(self, _status, messages):
-        if not self.logger.handlers():
+        if not self.logger.handlers() and not self.logger.closed:
             self.logger = JobLogger(self.job_id)
         for msg in messages:
             self.logger.emit(_status, msg)
 
     def complete_err(self, msg):
+        if self.cancel_token.cancelled:
+            # job failed because its commands were terminated
+            return self.complete_cancelled(msg)
         self.emit("ERROR", msg)
         self.__upd_state(JobState.FAILED)
 
+    def complete_cancelled(self, msg):
+        self.emit("CANCELLED", msg)
+        self.__upd_state(JobState.CANCELLED)
+
+    def cancel(self):
+        """
+        Cancel the job: queued job is removed from queue, running job's commands are terminated
+        and the job completes as CANCELLED once its function returns
+        :return: True if job is being cancelled, False if it's complete already
+        """
+        with self.lock:
+            # job can't complete (and close its log) until the lock is released
+            if self.status.state > JobState.RUNNING.value:
+                return False
+            self.cancel_token.cancel()
+            if scheduler.cancel(self, self.status.name):
+                self.complete_cancelled("Job cancelled before start")
+            elif not self.logger.closed:
+                self.emit("RUNNING", "Cancelling job...")
+            return True
+
     def complete_succ(self, msg):
         self.emit("SUCCESS", msg)
         self.__upd_state(JobState.SUCCESS)
 
     def start(self):
+        """
+        Queue the job to be run by scheduler's pool of its kind (job kind is the name of its function)
+        :raise QueueFullError: if too many jobs of this kind are waiting already
+        """
         try:
-            self.__upd_state(JobState.RUNNING)
-            self.thread.start()
+            scheduler.submit(self, self.status.name, self.priority)
+        except QueueFullError as ex:
+            self.complete_err(f"Job is rejected: {ex}")
+            raise
         except Exception as ex:
-            self.__upd_state(JobState.FAILED)
+            self.complete_err(f"Failed to start job: {ex}")
         return self
 
-    def __upd_state(self, _state):
-        # Job complete
-        if _state.value > JobState.RUNNING.value:
-            self.status.finish(_state.value)
-            self.logger.write_eof()
-        else:
-            self.status.update(_state.value)
-
+    def run(self):
+        """Called by scheduler's worker"""
+        if self.cancel_token.cancelled:
+            return self.complete_cancelled("Job cancelled before start")
+        self.__upd_state(JobState.RUNNING)
+        try:
+            self.func(self, self.app_logger)
+        except Exception as ex:
+            if self.status.state <= JobState.RUNNING.value:
+                self.complete_err(f"Unexpected error: {ex}")
+        if self.status.state <= JobState.RUNNING.value:
+            # otherwise log followers would wait for EOF forever
+            self.complete_err("Job finished without reporting result")
 
-def create_job(func, app_logger, data):
-    job = Job(func, app_logger, data)
-    jobs_dict[job.job_id] = job
+    def __upd_state(self, _state):
+        with self.lock:
+            if self.status.state > JobState.RUNNING.value:
+                # job is complete already (e.g. cancelled while it was reporting result)
+                return
+            # Job complete
+            if _state.value > JobState.RUNNING.value:
+                self.status.finish(_state.value)
+                self.logger.write_eof()
+                self.logger.close()
+                with running_jobs_lock:
+                    running_jobs.pop(self.job_id, None)
+            else:
+                self.status.update(_state.value)
+
+
+def create_job(func, app_logger, data, priority=DEFAULT_PRIORITY):
+    start_compaction()
+    job = Job(func, app_logger, data, priority)
+    with running_jobs_lock:
+        running_jobs[job.job_id] = job
     return job
 
 
 def get_job(job_id):
-    return jobs_dict.get(job_id)
+    return running_jobs.get(job_id)
 
 
 def cancel_job(job_id):
-    job = jobs_dict.get(job_id)
+    job = running_jobs.get(job_id)
     if not job:
         return False
     return job.cancel()
 
 
 def get_job_log(job_id):
-    job = jobs_dict.get(job_id)
+    job = running_jobs.get(job_id)
     if not job:
         return "no such job {}".format(job_id)
     return job.get_log()
 
 
 def get_job_status(job_id):
-    job = jobs_dict.get(job_id)
-    if not job:
-        return "no such job {}".format(job_id)
-    return job.status.serialize()
+    """
+    :return: (status, 0) if job exists, (error message, 1) otherwise
+    """
+    record = get_job_store().get(job_id)
+    if not record:
+        return "no such job {}".format(job_id), 1
+    return serialize_status(record), 0
+
+
+def list_jobs(state=None, name=None, limit=50, page_token=None):
+    """
+    Jobs' statuses, newest first (see JobStore.list)
+    :return: ({"jobs": [...], "next_page_token": ...}, 0) or (error message, 1)
+    """
+    if state and state not in JobState.__members__:
+        return f"Unknown state {state}. Supported: {', '.join(JobState.__members__)}", 1
+    page, err = get_job_store().list(state, name, limit, page_token)
+    if err != 0:
+        return page, err
+    page["jobs"] = [serialize_status(record) for record in page["jobs"]]
+    return page, 0
+
+
+def compact_jobs():
+    """Remove jobs (and their logs) older than retention period"""
+    for job_id in get_job_store().purge():
+        try:
+            os.remove(log_path(job_id))
+        except OSError:
+            pass
+
+
+def start_compaction():
+    """
+    Jobs left unfinished by previous process are marked as failed, then finished jobs are compacted periodically
+    """
+    global compaction_thread
+    with running_jobs_lock:
+        if compaction_thread is not None:
+            return
+        get_job_store().fail_unfinished(JobState.FAILED.name)
+
+        def compact():
+            while True:
+                try:
+                    compact_jobs()
+                except Exception as ex:
+                    print(f"Failed to compact jobs: {ex}")
+                time.sleep(JOB_COMPACTION_INTERVAL_SEC)
+
+        compaction_thread = Thread(target=compact, name="job-compaction", daemon=True)
+        compaction_thread.start()
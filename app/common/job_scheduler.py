@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import os
+import threading
+
+# Job kind (job function name) -> (number of workers, max number of queued jobs)
+JOB_POOLS = {
+    "helm_deploy": (int(os.getenv("JOB_HELM_DEPLOY_WORKERS", 4)), int(os.getenv("JOB_HELM_DEPLOY_QUEUE", 50))),
+    "helm_destroy": (int(os.getenv("JOB_HELM_DESTROY_WORKERS", 2)), int(os.getenv("JOB_HELM_DESTROY_QUEUE", 20))),
+    "create_resource": (int(os.getenv("JOB_CREATE_RESOURCE_WORKERS", 2)),
+                        int(os.getenv("JOB_CREATE_RESOURCE_QUEUE", 10))),
+    "destroy_resource": (int(os.getenv("JOB_DESTROY_RESOURCE_WORKERS", 1)),
+                         int(os.getenv("JOB_DESTROY_RESOURCE_QUEUE", 10))),
+}
+DEFAULT_POOL = (int(os.getenv("JOB_DEFAULT_WORKERS", 2)), int(os.getenv("JOB_DEFAULT_QUEUE", 20)))
+DEFAULT_PRIORITY = 10
+# Sent to clients of rejected requests (HTTP 429)
+JOB_RETRY_AFTER_SEC = int(os.getenv("JOB_RETRY_AFTER_SEC", 30))
+
+
+class QueueFullError(Exception):
+    def __init__(self, kind, max_queued):
+        super().__init__(f"Too many {kind} jobs are waiting ({max_queued}), try again later")
+        self.kind = kind
+        self.max_queued = max_queued
+
+
+class JobPool:
+    """
+    Fixed number of workers running jobs of one kind. Waiting jobs are ordered by priority (lower first),
+    then by submission order
+    """
+
+    def __init__(self, kind, workers, max_queued):
+        self.kind = kind
+        self.workers = workers
+        self.max_queued = max_queued
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, job, priority=DEFAULT_PRIORITY):
+        """
+        :raise QueueFullError: if there are max_queued jobs waiting already
+        """
+        with self.condition:
+            if len(self.queue) >= self.max_queued:
+                self.rejected += 1
+                raise QueueFullError(self.kind, self.max_queued)
+            heapq.heappush(self.queue, (priority, next(self.sequence), job))
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.__work, name=f"job-{self.kind}-{len(self.threads)}",
+                                          daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.condition.notify()
+
+    def remove(self, job):
+        """
+        :return: True if job was waiting and is removed from queue, False if it's running or complete
+        """
+        with self.condition:
+            for (i, (_, _, queued)) in enumerate(self.queue):
+                if queued is job:
+                    self.queue.pop(i)
+                    heapq.heapify(self.queue)
+                    return True
+            return False
+
+    def stats(self):
+        with self.condition:
+            return {"workers": self.workers, "queued": len(self.queue), "max_queued": self.max_queued,
+                    "running": self.running, "completed": self.completed, "rejected": self.rejected}
+
+    def __work(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue)
+                (_, _, job) = heapq.heappop(self.queue)
+                self.running += 1
+            try:
+                job.run()
+            except Exception as ex:
+                print(f"Job {getattr(job, 'job_id', job)} failed: {ex}")
+            finally:
+                with self.condition:
+                    self.running -= 1
+                    self.completed += 1
+
+
+class JobScheduler:
+    """
+    Runs jobs on bounded pools, one pool per job kind (see JOB_POOLS), so a burst of requests of one kind
+    neither starts unbounded number of threads nor delays jobs of other kinds
+    """
+
+    def __init__(self, pools=None, default_pool=DEFAULT_POOL):
+        self.pool_sizes = JOB_POOLS if pools is None else pools
+        self.default_pool = default_pool
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def submit(self, job, kind, priority=DEFAULT_PRIORITY):
+        """
+        Queue job to be run by pool of its kind
+        :param job: object with run() method
+        :param kind: job kind, e.g. "helm_deploy"
+        :param priority: lower is run earlier, jobs with the same priority are run in order of submission
+        :raise QueueFullError: if the pool has too many waiting jobs
+        """
+        with self.lock:
+            pool = self.pools.get(kind)
+            if pool is None:
+                workers, max_queued = self.pool_sizes.get(kind, self.default_pool)
+                pool = JobPool(kind, workers, max_queued)
+                self.pools[kind] = pool
+        pool.submit(job, priority)
+
+    def cancel(self, job, kind):
+        """
+        Remove job from queue of its kind
+        :return: True if job was waiting, False if it's running or complete
+        """
+        with self.lock:
+            pool = self.pools.get(kind)
+        return pool is not None and pool.remove(job)
+
+    def stats(self):
+        with self.lock:
+            pools = list(self.pools.values())
+        return {pool.kind: pool.stats() for pool in pools}
+
+
+scheduler = JobScheduler()
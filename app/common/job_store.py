@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import threading
+import time
+
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", f"{os.getcwd()}/state/jobs.db")
+# Finished jobs older than this are removed from the store
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", 30))
+JOB_COMPACTION_INTERVAL_SEC = int(os.getenv("JOB_COMPACTION_INTERVAL_SEC", 3600))
+JOB_LIST_MAX_LIMIT = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL DEFAULT 0,
+    elapsed REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, start);
+CREATE INDEX IF NOT EXISTS jobs_name ON jobs (name, start);
+CREATE INDEX IF NOT EXISTS jobs_start ON jobs (start, job_id);
+"""
+COLUMNS = ("job_id", "name", "state", "start", "end", "elapsed")
+
+
+class JobStore:
+    """
+    Durable store of job statuses (SQLite in WAL mode). Jobs are looked up by id with primary key index,
+    listed by state / name with pagination by (start, job_id). Finished jobs are removed after retention period.
+    """
+
+    def __init__(self, path=JOB_STORE_PATH, retention_sec=JOB_RETENTION_DAYS * 24 * 3600,
+                 unfinished_states=("CREATED", "RUNNING")):
+        self.path = path
+        self.retention_sec = retention_sec
+        self.unfinished_states = unfinished_states
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.write_lock, self.__connection() as conn:
+            # must be set before tables are created, allows to give space of removed jobs back to filesystem
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.executescript(SCHEMA)
+
+    def create(self, job_id, name, state, start):
+        with self.write_lock, self.__connection() as conn:
+            conn.execute("INSERT INTO jobs (job_id, name, state, start) VALUES (?, ?, ?, ?)",
+                         (job_id, name, state, start))
+
+    def update(self, job_id, state, end=None, elapsed=None):
+        with self.write_lock, self.__connection() as conn:
+            if end is None:
+                conn.execute("UPDATE jobs SET state = ? WHERE job_id = ?", (state, job_id))
+            else:
+                conn.execute("UPDATE jobs SET state = ?, end = ?, elapsed = ? WHERE job_id = ?",
+                             (state, end, elapsed, job_id))
+
+    def get(self, job_id):
+        row = self.__connection().execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE job_id = ?",
+                                          (job_id,)).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def list(self, state=None, name=None, limit=50, page_token=None):
+        """
+        Jobs, newest first
+        :param state: only jobs in this state (e.g. "RUNNING")
+        :param name: only jobs with this name (e.g. "helm_deploy")
+        :param limit: max number of jobs to return
+        :param page_token: next_page_token of previous page
+        :return: ({"jobs": [...], "next_page_token": token or None}, 0) or (error message, 1)
+        """
+        conditions, params = [], []
+        if state:
+            conditions.append("state = ?")
+            params.append(state)
+        if name:
+            conditions.append("name = ?")
+            params.append(name)
+        if page_token:
+            try:
+                start, job_id = page_token.split(":", 1)
+                conditions.append("(start < ? OR (start = ? AND job_id < ?))")
+                params.extend([float(start), float(start), job_id])
+            except ValueError:
+                return f"Invalid page token: {page_token}", 1
+        limit = max(1, min(int(limit), JOB_LIST_MAX_LIMIT))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.__connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM jobs {where} ORDER BY start DESC, job_id DESC LIMIT ?",
+            (*params, limit + 1)).fetchall()
+        jobs = [dict(zip(COLUMNS, row)) for row in rows[:limit]]
+        next_page_token = f"{jobs[-1]['start']!r}:{jobs[-1]['job_id']}" if len(rows) > limit else None
+        return {"jobs": jobs, "next_page_token": next_page_token}, 0
+
+    def purge(self, now=None):
+        """
+        Remove finished jobs older than retention period and compact the database
+        :return: ids of removed jobs
+        """
+        threshold = (now or time.time()) - self.retention_sec
+        placeholders = ", ".join("?" * len(self.unfinished_states))
+        with self.write_lock, self.__connection() as conn:
+            condition = f"start < ? AND state NOT IN ({placeholders})"
+            job_ids = [row[0] for row in conn.execute(f"SELECT job_id FROM jobs WHERE {condition}",
+                                                      (threshold, *self.unfinished_states))]
+            conn.execute(f"DELETE FROM jobs WHERE {condition}", (threshold, *self.unfinished_states))
+        if job_ids:
+            with self.write_lock:
+                self.__connection().execute("PRAGMA incremental_vacuum")
+        return job_ids
+
+    def fail_unfinished(self, state):
+        """
+        Mark jobs that were not finished by previous process (they can't be running any more)
+        :param state: state to set
+        :return: number of updated jobs
+        """
+        placeholders = ", ".join("?" * len(self.unfinished_states))
+        now = time.time()
+        with self.write_lock, self.__connection() as conn:
+            return conn.execute(f"UPDATE jobs SET state = ?, end = ?, elapsed = ? - start "
+                                f"WHERE state IN ({placeholders})", (state, now, now, *self.unfinished_states)
+                                ).rowcount
+
+    def stats(self):
+        rows = self.__connection().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for (state, count) in rows}
+
+    def __connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+
+job_store = None
+
+
+def get_job_store():
+    global job_store
+    if job_store is None:
+        job_store = JobStore()
+    return job_store
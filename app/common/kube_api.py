@@ -1,12 +1,16 @@
 import base64
 import os
 import shlex
-import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
-import boto3
 import yaml
 from jinja2 import Environment, FileSystemLoader
 
+from common.async_shell import shell_engine
+from common.aws_clients import aws_clients
+from common.kube_client import KubeApiError, kube_clients, use_kube_api
+from common.kubeconfig_cache import kubeconfig_cache
 from common.shell import shell_await, shell_run
 from common.vault_api import Vault
 
@@ -16,12 +20,17 @@ STATUS_OK_ = {"status": "OK"}
 DEFAULT_K8S_CTX_ID = "default"
 K8S_CTX_PATH = "kctx"
 HELM = os.getenv('HELM_CMD', "/usr/local/bin/helm")
+# Max number of concurrent 'helm get values' subprocesses (shared by all requests)
+HELM_VALUES_WORKERS = int(os.getenv("HELM_VALUES_WORKERS", 8))
+helm_values_executor = ThreadPoolExecutor(max_workers=HELM_VALUES_WORKERS, thread_name_prefix="helm-values")
 
 
 class KctxApi:
-    def __init__(self, logger):
+    def __init__(self, logger, cancel_token=None):
         self.vault = Vault(logger)
         self.logger = logger
+        # CancellationToken of the job setting up the cluster, its commands are terminated when it's cancelled
+        self.cancel_token = cancel_token
 
     def save_kubernetes_context(self, ctx_data):
         if not ctx_data:
@@ -36,6 +45,8 @@ class KctxApi:
             try:
                 self.logger.info("Saving kube ctx data into path: {}".format(kctx_path))
                 self.vault.write(kctx_path, **ctx_data)
+                kubeconfig_cache.invalidate(ctx_data["name"])
+                kube_clients.invalidate(ctx_data["name"])
                 return STATUS_OK_
             except Exception as e:
                 self.logger.info(f"Failed to write secret to path {kctx_path}, {e}; attempt = {attempts}")
@@ -76,6 +87,8 @@ class KctxApi:
         kctx_path = "{}/{}/{}".format(self.vault.base_path, K8S_CTX_PATH, cluster_name)
         try:
             self.vault.delete(kctx_path)
+            kubeconfig_cache.invalidate(cluster_name)
+            kube_clients.invalidate(cluster_name)
             return 0, "Deleted kcts successfully"
         except Exception as e:
             self.logger.error("Failed to delete secret from path {}, {}".format(kctx_path, e))
@@ -86,12 +99,7 @@ class KctxApi:
                                  aws_access_key, aws_secret_key, conf_path,
                                  templates_root=f"{os.getenv('APP_WORKING_DIR')}/infra/templates"):
         try:
-            # Set up the client
-            s = boto3.Session(region_name=aws_region,
-                              aws_access_key_id=aws_access_key,
-                              aws_secret_access_key=aws_secret_key
-                              )
-            eks = s.client("eks")
+            eks = aws_clients.client("eks", aws_access_key, aws_secret_key, region=aws_region)
 
             # get cluster details
             cluster = eks.describe_cluster(name=cluster_name)
@@ -124,7 +132,7 @@ class KctxApi:
             create_roles_cmd = ['kubectl', "create", "-f", sa_path]
             # set aws secrets and custom kubeconfig if all secrets are present, otherwise - default cloud will be used
 
-            res, outp = shell_await(create_roles_cmd, env=kube_env, with_output=True)
+            res, outp = shell_await(create_roles_cmd, env=kube_env, with_output=True, cancel_token=self.cancel_token)
             for s in outp:
                 self.logger.info(s)
             if res != 0:
@@ -140,7 +148,7 @@ class KctxApi:
     def __configure_kubernetes_mountpoint(self, env, cluster_name):
         # getting reviewer token
         tok_rew_cmd = shlex.split("kubectl -n default get secret vault-auth -o go-template='{{ .data.token }}'")
-        res, outp = shell_await(tok_rew_cmd, env=env, with_output=True)
+        res, outp = shell_await(tok_rew_cmd, env=env, with_output=True, cancel_token=self.cancel_token)
         if res != 0:
             for s in outp:
                 self.logger.info(s)
@@ -150,7 +158,7 @@ class KctxApi:
         # get kube CA
         kube_ca_cmd = shlex.split(
             "kubectl -n default config view --raw --minify --flatten -o jsonpath='{.clusters[].cluster.certificate-authority-data}'")
-        res, outp = shell_await(kube_ca_cmd, env=env, with_output=True)
+        res, outp = shell_await(kube_ca_cmd, env=env, with_output=True, cancel_token=self.cancel_token)
         if res != 0:
             for s in outp:
                 self.logger.info(s)
@@ -160,7 +168,7 @@ class KctxApi:
         # get kube server
         kube_server_cmd = shlex.split(
             "kubectl -n default config view --raw --minify --flatten -o jsonpath='{.clusters[].cluster.server}'")
-        res, outp = shell_await(kube_server_cmd, env=env, with_output=True)
+        res, outp = shell_await(kube_server_cmd, env=env, with_output=True, cancel_token=self.cancel_token)
         if res != 0:
             for s in outp:
                 self.logger.info(s)
@@ -183,22 +191,47 @@ class KctxApi:
         res, outp = KctxApi.__install_to_kube(
             "aws-storage",
             {"app": app_name},
-            kube_env, tmp_root_path, templates_root)
+            kube_env, tmp_root_path, templates_root, self.cancel_token)
         for out in outp:
             self.logger.info(out)
         return 0, "Volume creation complete. Result: {}".format(res)
 
     def execute_command(self, command, kube_env):
-        cmd = shlex.split(command)
-        res, logs = shell_await(cmd, env=kube_env, with_output=True)
+        res, logs = shell_engine.run(command, env=kube_env, cancel_token=self.cancel_token)
         for l in logs:
             self.logger.info(l)
         return res, logs
 
-    def setup_ca(self, kube_env, cluster_name, region):
-        command = "helm repo add stable https://charts.helm.sh/stable"
-        self.execute_command(command, kube_env)
+    def execute_commands(self, commands, kube_env):
+        """
+        Execute independent commands concurrently
+        :return: [(err code, output lines)] in order of commands
+        """
+        results = shell_engine.run_many(commands, env=kube_env, cancel_token=self.cancel_token)
+        for (command, (res, logs)) in zip(commands, results):
+            self.logger.info(f"{command}: exit code {res}")
+            for l in logs:
+                self.logger.info(l)
+        return results
+
+    def setup_helm_repos(self, kube_env):
+        """
+        Add chart repositories of cluster add-ons (see setup_ca, setup_traefik) and update them.
+        Commands run one by one: every one of them rewrites helm's repositories file
+
+        :param kube_env: env to use for kubernetes communication
+        :return: err code (0 if success), output of repo update
+        """
+        # adding a repository that is known already may fail, update tells whether the charts are available
+        for command in (f'{HELM} repo add stable https://charts.helm.sh/stable',
+                        f'{HELM} repo add traefik https://containous.github.io/traefik-helm-chart'):
+            self.execute_command(command, kube_env)
+
+        command = f'{HELM} repo update'
+        return self.execute_command(command, kube_env)
 
+    def setup_ca(self, kube_env, cluster_name, region):
+        """Chart repository is added by setup_helm_repos"""
         command = "kubectl create namespace cluster-autoscaler"
         self.execute_command(command, kube_env)
 
@@ -226,12 +259,7 @@ class KctxApi:
         :param tmp_root_path: tmp path to store tmp files
         :return: err code (0 if success), message
         """
-        command = f'{HELM} repo add traefik https://containous.github.io/traefik-helm-chart'
-        self.execute_command(command, kube_env)
-
-        command = f'{HELM} repo update'
-        self.execute_command(command, kube_env)
-
+        # chart repository is added by setup_helm_repos
         command = "kubectl create namespace traefik"
         self.execute_command(command, kube_env)
 
@@ -257,24 +285,24 @@ class KctxApi:
         :param tmp_root_path: tmp path to store tmp files
         :return: err code (0 if success), message
         """
-        command = "kubectl apply -f https://github.com/kubernetes-sigs/metrics-server/releases/download/v0.3.6/components.yaml --namespace=kube-system"
-        self.execute_command(command, kube_env)
+        # coredns patch is independent from metrics server installation
+        apply_metrics = "kubectl apply -f https://github.com/kubernetes-sigs/metrics-server/releases/download/v0.3.6/components.yaml --namespace=kube-system"
+        patch_coredns = """kubectl patch deployment coredns -n kube-system --type=json -p='[{"op":"add", "path":"/spec/template/spec/tolerations/-", "value":{"key":"type", "value":"kubsystem", "operator":"Equal", "effect":"NoSchedule"}}]'"""
+        _, coredns_result = self.execute_commands([apply_metrics, patch_coredns], kube_env)
 
         command = """kubectl patch deployment metrics-server -n kube-system --type=json -p='[{"op":"add", "path":"/spec/template/spec/tolerations", "value":[{"key":"type", "value":"kubsystem", "operator":"Equal", "effect":"NoSchedule"}]}]'"""
         self.execute_command(command, kube_env)
-
-        command = """kubectl patch deployment coredns -n kube-system --type=json -p='[{"op":"add", "path":"/spec/template/spec/tolerations/-", "value":{"key":"type", "value":"kubsystem", "operator":"Equal", "effect":"NoSchedule"}}]'"""
-        return self.execute_command(command, kube_env)
+        return coredns_result
 
     @classmethod
-    def __install_to_kube(cls, template_name, params, kube_env, root_path, templates_root):
+    def __install_to_kube(cls, template_name, params, kube_env, root_path, templates_root, cancel_token=None):
         """
         :param cls: class
         :param template_name: name without ".j2"
         :param params: data to pass to template
         :param kube_env:
         :param root_path:
-        :param logger:
+        :param cancel_token: CancellationToken, kubectl is terminated when it's cancelled
         :return:  errcode, msg
         """
         f_path = "{}/{}.yaml".format(root_path, template_name)
@@ -284,29 +312,36 @@ class KctxApi:
             gen_template = j2_env.get_template('{}.j2'.format(template_name)).render(**params)
             f.write(gen_template)
         cmd = shlex.split("kubectl apply -f {}".format(f_path))
-        return shell_await(cmd, env=kube_env, with_output=True)
+        return shell_await(cmd, env=kube_env, with_output=True, cancel_token=cancel_token)
 
-    def __write_and_get_kube_env(self, cluster_name):
+    @contextmanager
+    def __kube_env(self, kctx):
+        """
+        Env for kubectl/helm calls to the cluster, kubeconfig is shared with other calls (see kubeconfig_cache)
+        :param kctx: kube context of the cluster
+        :return: context manager yielding (kube env, 0) in case of success, (error message, 1) otherwise
+        """
         try:
-            kctx, err = self.get_kubernetes_context(cluster_name)
-            if err != 0:
-                return f"Can't get cluster {cluster_name}", 1
-            root_path = f"/tmp/{round(time.time() * 1000)}"
-            os.makedirs(root_path, exist_ok=True)
-            kube_config_file_path = f"{root_path}/kubeconf"
-
-            kube_conf_base64 = kctx["kube_config"]
-            with open(kube_config_file_path, "w") as kubeconf_file:
-                kubeconf_str = base64.standard_b64decode(kube_conf_base64.encode("utf-8")).decode("utf-8")
-                kubeconf_file.writelines(kubeconf_str)
-
-            kube_env = {"KUBECONFIG": kube_config_file_path,
-                        "AWS_DEFAULT_REGION": kctx["aws_region"],
-                        "AWS_ACCESS_KEY_ID": kctx["aws_access_key"],
-                        "AWS_SECRET_ACCESS_KEY": kctx["aws_secret_key"]}
-            return kube_env, 0
+            kube_env = kubeconfig_cache.acquire(kctx["cluster_name"], kctx)
         except Exception as e:
-            return f"Failed to get kube env: {e}", 1
+            yield f"Failed to get kube env: {e}", 1
+            return
+        try:
+            yield kube_env, 0
+        finally:
+            kubeconfig_cache.release(kube_env)
+
+    def __kube_client(self, kctx):
+        """
+        :return: in-process kube client if it's selected for the cluster (see use_kube_api), None otherwise
+        """
+        if not use_kube_api(kctx):
+            return None
+        try:
+            return kube_clients.get_client(kctx["cluster_name"], kctx)
+        except Exception as e:
+            self.logger.warning(f"Failed to create kube client for {kctx['cluster_name']}, using kubectl: {e}")
+            return None
 
     def get_ns(self, cluster_name):
         '''
@@ -314,16 +349,25 @@ class KctxApi:
         :param cluster_name:
         :return: list of namespaces iterable and error code (0 if success) or Error message and err code (if error)
         '''
-        kube_env, err = self.__write_and_get_kube_env(cluster_name)
+        kctx, err = self.get_kubernetes_context(cluster_name)
         if err != 0:
-            return kube_env, 1
-        cmd = shlex.split("kubectl get ns --output=name")
-        result, output = shell_await(cmd, env=kube_env, with_output=True)
-        if result != 0:
-            for l in output:
-                self.logger.error(l)
-            return "Failed to 'kubectl get ns' ", 1
-        return list(map(lambda ns: str.replace(ns, "namespace", cluster_name), output)), 0
+            return f"Can't get cluster {cluster_name}", 1
+        client = self.__kube_client(kctx)
+        if client:
+            try:
+                return [f"{cluster_name}/{ns}" for ns in client.list_namespaces()], 0
+            except Exception as e:
+                self.logger.warning(f"Failed to list namespaces with kube API, using kubectl: {e}")
+        with self.__kube_env(kctx) as (kube_env, err):
+            if err != 0:
+                return kube_env, 1
+            cmd = shlex.split("kubectl get ns --output=name")
+            result, output = shell_await(cmd, env=kube_env, with_output=True)
+            if result != 0:
+                for l in output:
+                    self.logger.error(l)
+                return "Failed to 'kubectl get ns' ", 1
+            return list(map(lambda ns: str.replace(ns, "namespace", cluster_name), output)), 0
 
     def delete_ns(self, cluster_name, ns):
         '''
@@ -331,36 +375,69 @@ class KctxApi:
         :param ns: name of namespace to be deleted
         :return: name of deleted namespace + 0 if success. Otherwise - error msg and error code
         '''
-        kube_env, err = self.__write_and_get_kube_env(cluster_name)
+        kctx, err = self.get_kubernetes_context(cluster_name)
         if err != 0:
-            return kube_env, 1
-        cmd = shlex.split(f"kubectl delete ns {ns}")
-        result, output = shell_await(cmd, env=kube_env, with_output=False)
-        if result != 0:
-            return f"Failed to 'kubectl delete ns {ns}' ", 1
-        return ns, 0
+            return f"Can't get cluster {cluster_name}", 1
+        client = self.__kube_client(kctx)
+        if client:
+            try:
+                client.delete_namespace(ns)
+                return ns, 0
+            except KubeApiError as e:
+                return f"Failed to delete ns {ns}: {e}", 1
+            except Exception as e:
+                self.logger.warning(f"Failed to delete namespace with kube API, using kubectl: {e}")
+        with self.__kube_env(kctx) as (kube_env, err):
+            if err != 0:
+                return kube_env, 1
+            cmd = shlex.split(f"kubectl delete ns {ns}")
+            result, output = shell_await(cmd, env=kube_env, with_output=False)
+            if result != 0:
+                return f"Failed to 'kubectl delete ns {ns}' ", 1
+            return ns, 0
 
     def get_services_by_namespace(self, cluster_name, ns):
-        kube_env, err = self.__write_and_get_kube_env(cluster_name)
+        kctx, err = self.get_kubernetes_context(cluster_name)
         if err != 0:
-            return kube_env, 1
-        # get existing charts in cluster
-        cmd = shlex.split(f"helm ls --short -n {ns}")
-        code, output = shell_await(cmd, env=kube_env, with_output=True)
-        charts = list(output)
-        if code != 0 or len(charts) == 0:
-            return f"Failed to get list of releases in namespace {ns} for cluster {cluster_name}", 1
-        service_versions = []
-        for chart in charts:
+            return f"Can't get cluster {cluster_name}", 1
+        client = self.__kube_client(kctx)
+        if client:
+            try:
+                releases = client.helm_releases(ns)
+                if len(releases) == 0:
+                    return f"Failed to get list of releases in namespace {ns} for cluster {cluster_name}", 1
+                return self.__service_versions(release.get("config") or {} for release in releases), 0
+            except Exception as e:
+                self.logger.warning(f"Failed to read helm releases with kube API, using helm: {e}")
+        with self.__kube_env(kctx) as (kube_env, err):
+            if err != 0:
+                return kube_env, 1
+            # get existing charts in cluster
+            cmd = shlex.split(f"helm ls --short -n {ns}")
+            code, output = shell_await(cmd, env=kube_env, with_output=True)
+            charts = list(output)
+            if code != 0 or len(charts) == 0:
+                return f"Failed to get list of releases in namespace {ns} for cluster {cluster_name}", 1
+            return self.__service_versions(self.__helm_values(kube_env, ns, charts)), 0
+
+    def __helm_values(self, kube_env, ns, charts):
+        def get_values(chart):
             try:
                 cmd = shlex.split(f"helm get values {chart} -n {ns} -o yaml")
                 code, stream_out = shell_await(cmd, env=kube_env, with_output=True, get_stream=True)
                 if code == 0:
-                    values = yaml.load(stream_out, Loader=yaml.FullLoader)
-                    service_name = values['repo']
-                    service_version = values['images']['service']['tag']
-                    service_versions.append({"repo": service_name, "version": service_version})
+                    return yaml.load(stream_out, Loader=yaml.FullLoader)
             except Exception as ex:
                 self.logger.error(ex)
+            return None
 
-        return service_versions, 0
+        return [values for values in helm_values_executor.map(get_values, charts) if values is not None]
+
+    def __service_versions(self, charts_values):
+        service_versions = []
+        for values in charts_values:
+            try:
+                service_versions.append({"repo": values['repo'], "version": values['images']['service']['tag']})
+            except Exception as ex:
+                self.logger.error(ex)
+        return service_versions
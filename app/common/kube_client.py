@@ -0,0 +1,233 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import boto3
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+# "cli" - kubectl/helm subprocesses, "api" - in-process client. Can be overridden per cluster by kctx "kube_backend"
+KUBE_BACKEND = os.getenv("KUBE_BACKEND", "cli")
+KUBE_API_TIMEOUT_SEC = float(os.getenv("KUBE_API_TIMEOUT_SEC", 30))
+KUBE_API_POOL_SIZE = int(os.getenv("KUBE_API_POOL_SIZE", 10))
+# EKS tokens are valid for 15 minutes, new one is generated a bit earlier
+EKS_TOKEN_TTL_SEC = int(os.getenv("EKS_TOKEN_TTL_SEC", 600))
+EKS_TOKEN_PREFIX = "k8s-aws-v1."
+HELM_RELEASE_SECRET_TYPE = "helm.sh/release.v1"
+
+
+def use_kube_api(kctx):
+    """
+    :param kctx: kube context of the cluster as it's stored in Vault
+    :return: True if the cluster should be queried with in-process kube client instead of kubectl/helm
+    """
+    return kctx.get("kube_backend", KUBE_BACKEND) == "api"
+
+
+def decode_helm_release(data):
+    """
+    Decode helm 3 release stored in secret: base64 (by kubernetes) of base64 (by helm) of gzipped json
+    :param data: value of "release" key in secret's data
+    :return: release dict
+    """
+    release = base64.b64decode(base64.b64decode(data))
+    if release[:2] == b"\x1f\x8b":
+        release = gzip.decompress(release)
+    return json.loads(release)
+
+
+class KubeApiError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+
+
+class KubeClient:
+    """
+    Client of kubernetes API of one cluster, configured from kubeconfig's current context.
+    Keeps its own pool of keep-alive connections. Supports token, client certificate and EKS (aws exec plugin) auth.
+    """
+
+    def __init__(self, cluster_name, kube_config, aws_region=None, aws_access_key=None, aws_secret_key=None):
+        self.cluster_name = cluster_name
+        self.aws = {"region_name": aws_region, "aws_access_key_id": aws_access_key,
+                    "aws_secret_access_key": aws_secret_key}
+        self.files_dir = tempfile.mkdtemp(prefix=f"{cluster_name}-api-")
+        self.lock = threading.Lock()
+        self.token = None
+        self.token_expires_at = 0.
+        self.eks_cluster_name = None
+        self.requests = 0
+        self.errors = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=KUBE_API_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.__configure(yaml.safe_load(kube_config))
+
+    def list_namespaces(self):
+        return [ns["metadata"]["name"] for ns in self.__request("GET", "/api/v1/namespaces")["items"]]
+
+    def delete_namespace(self, ns):
+        self.__request("DELETE", f"/api/v1/namespaces/{ns}")
+
+    def helm_releases(self, ns):
+        """
+        Latest revision of each helm release in namespace, read from release secrets with a single call
+        :param ns: namespace
+        :return: list of release dicts (with "name", "version", "info", "config" - user supplied values, ...)
+        """
+        secrets = self.__request("GET", f"/api/v1/namespaces/{ns}/secrets",
+                                 params={"labelSelector": "owner=helm",
+                                         "fieldSelector": f"type={HELM_RELEASE_SECRET_TYPE}"})["items"]
+        latest = {}
+        for secret in secrets:
+            labels = secret["metadata"].get("labels", {})
+            name, version = labels.get("name"), int(labels.get("version", 0))
+            if labels.get("status") == "uninstalled":
+                continue
+            if name not in latest or latest[name][0] < version:
+                latest[name] = (version, secret)
+        return [decode_helm_release(secret["data"]["release"]) for (_, secret) in latest.values()]
+
+    def close(self):
+        self.session.close()
+        shutil.rmtree(self.files_dir, ignore_errors=True)
+
+    def __request(self, method, path, params=None, retry_auth=True):
+        self.requests += 1
+        headers = {"Accept": "application/json"}
+        token = self.__get_token()
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        try:
+            r = self.session.request(method, f"{self.server}{path}", params=params, headers=headers,
+                                     timeout=KUBE_API_TIMEOUT_SEC)
+        except requests.RequestException:
+            self.errors += 1
+            raise
+        if r.status_code == 401 and retry_auth and self.eks_cluster_name:
+            # token could be rejected before its expiration (e.g. credentials rotated)
+            self.token_expires_at = 0.
+            return self.__request(method, path, params, retry_auth=False)
+        if r.status_code >= 400:
+            self.errors += 1
+            raise KubeApiError(r.status_code, r.text)
+        return r.json()
+
+    def __get_token(self):
+        if not self.eks_cluster_name:
+            return self.token
+        with self.lock:
+            if time.time() >= self.token_expires_at:
+                self.token = self.__eks_token()
+                self.token_expires_at = time.time() + EKS_TOKEN_TTL_SEC
+            return self.token
+
+    def __eks_token(self):
+        """
+        EKS token is presigned STS GetCallerIdentity url bound to cluster name (same as `aws eks get-token` does)
+        """
+        region = self.aws["region_name"]
+        sts = boto3.Session(**self.aws).client("sts", region_name=region,
+                                               endpoint_url=f"https://sts.{region}.amazonaws.com" if region else None)
+
+        def add_cluster_header(request, **kwargs):
+            request.headers["x-k8s-aws-id"] = self.eks_cluster_name
+
+        sts.meta.events.register("before-sign.sts.GetCallerIdentity", add_cluster_header)
+        url = sts.generate_presigned_url("get_caller_identity", Params={}, ExpiresIn=60, HttpMethod="GET")
+        return EKS_TOKEN_PREFIX + base64.urlsafe_b64encode(url.encode("utf-8")).decode("utf-8").rstrip("=")
+
+    def __configure(self, kube_config):
+        contexts = {c["name"]: c["context"] for c in kube_config.get("contexts", [])}
+        context = contexts.get(kube_config.get("current-context")) or next(iter(contexts.values()), {})
+        clusters = {c["name"]: c["cluster"] for c in kube_config.get("clusters", [])}
+        users = {u["name"]: u.get("user") or {} for u in kube_config.get("users", [])}
+        cluster = clusters.get(context.get("cluster")) or next(iter(clusters.values()))
+        user = users.get(context.get("user"), {})
+
+        self.server = cluster["server"].rstrip("/")
+        if cluster.get("insecure-skip-tls-verify"):
+            self.session.verify = False
+        elif cluster.get("certificate-authority-data"):
+            self.session.verify = self.__write_file("ca.crt", cluster["certificate-authority-data"])
+        elif cluster.get("certificate-authority"):
+            self.session.verify = cluster["certificate-authority"]
+
+        if user.get("client-certificate-data") and user.get("client-key-data"):
+            self.session.cert = (self.__write_file("client.crt", user["client-certificate-data"]),
+                                 self.__write_file("client.key", user["client-key-data"]))
+        if user.get("token"):
+            self.token = user["token"]
+        elif user.get("exec"):
+            self.eks_cluster_name = self.__exec_cluster_name(user["exec"]) or self.cluster_name
+
+    @staticmethod
+    def __exec_cluster_name(exec_conf):
+        # aws eks get-token --cluster-name <name> / aws-iam-authenticator token -i <name>
+        args = exec_conf.get("args") or []
+        for (i, arg) in enumerate(args[:-1]):
+            if arg in ("--cluster-name", "-i", "--cluster-id"):
+                return args[i + 1]
+        return None
+
+    def __write_file(self, name, data_base64):
+        path = f"{self.files_dir}/{name}"
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(base64.standard_b64decode(data_base64))
+        return path
+
+
+class KubeClientPool:
+    """
+    Process-wide kube clients, one per cluster. Client is recreated when cluster's kube context changes
+    """
+
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def get_client(self, cluster_name, kctx):
+        """
+        :param cluster_name: cluster name
+        :param kctx: kube context of the cluster as it's stored in Vault
+        :return: KubeClient
+        """
+        digest = hashlib.sha256(json.dumps({k: kctx.get(k) for k in ("kube_config", "aws_region", "aws_access_key",
+                                                                      "aws_secret_key")},
+                                           sort_keys=True).encode("utf-8")).hexdigest()
+        with self.lock:
+            current = self.clients.get(cluster_name)
+            if current is not None and current[0] == digest:
+                return current[1]
+            kube_config = base64.standard_b64decode(kctx["kube_config"].encode("utf-8")).decode("utf-8")
+            client = KubeClient(cluster_name, kube_config, kctx.get("aws_region"), kctx.get("aws_access_key"),
+                                kctx.get("aws_secret_key"))
+            self.clients[cluster_name] = (digest, client)
+        if current is not None:
+            current[1].close()
+        return client
+
+    def invalidate(self, cluster_name):
+        with self.lock:
+            current = self.clients.pop(cluster_name, None)
+        if current is not None:
+            current[1].close()
+
+    def stats(self):
+        with self.lock:
+            clients = [c for (_, c) in self.clients.values()]
+        return {"clients": len(clients), "requests": sum(c.requests for c in clients),
+                "errors": sum(c.errors for c in clients)}
+
+
+kube_clients = KubeClientPool()
@@ -0,0 +1,138 @@
+import atexit
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+KUBECONFIG_CACHE_MAX_ENTRIES = int(os.getenv("KUBECONFIG_CACHE_MAX_ENTRIES", 32))
+KUBECONFIG_CACHE_IDLE_TTL_SEC = int(os.getenv("KUBECONFIG_CACHE_IDLE_TTL_SEC", 3600))
+KUBECONFIG_FILE = "kubeconf"
+AWS_ENV = {"AWS_DEFAULT_REGION": "aws_region", "AWS_ACCESS_KEY_ID": "aws_access_key",
+           "AWS_SECRET_ACCESS_KEY": "aws_secret_key"}
+
+
+class KubeconfigEntry:
+    def __init__(self, cluster_name, digest, root_path, kube_env):
+        self.cluster_name = cluster_name
+        self.digest = digest
+        self.root_path = root_path
+        self.kube_env = kube_env
+        self.refs = 0
+        self.retired = False
+        self.last_used = time.time()
+
+
+class KubeconfigCache:
+    """
+    Materialized kubeconfig files, one per cluster, shared by all kubectl/helm calls to the cluster.
+    Files are readable by owner only. Entry is replaced when cluster's kube context changes.
+    Entries are reference counted: retired (changed or evicted) entry's files are removed once nobody uses them.
+    Idle entries are evicted after idle_ttl, least recently used ones - when there are more than max_entries.
+    """
+
+    def __init__(self, max_entries=KUBECONFIG_CACHE_MAX_ENTRIES, idle_ttl=KUBECONFIG_CACHE_IDLE_TTL_SEC):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.root = None
+        self.entries = {}
+        self.by_path = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def kube_env(self, cluster_name, kctx):
+        """
+        Context manager yielding env for kubectl/helm calls to the cluster (KUBECONFIG and AWS credentials)
+        :param cluster_name: cluster name
+        :param kctx: kube context of the cluster as it's stored in Vault
+        """
+        kube_env = self.acquire(cluster_name, kctx)
+        try:
+            yield kube_env
+        finally:
+            self.release(kube_env)
+
+    def acquire(self, cluster_name, kctx):
+        digest = hashlib.sha256(json.dumps({k: kctx.get(k) for k in ["kube_config", *AWS_ENV.values()]},
+                                           sort_keys=True).encode("utf-8")).hexdigest()
+        with self.lock:
+            entry = self.entries.get(cluster_name)
+            if entry is not None and entry.digest != digest:
+                self.__retire(entry)
+                entry = None
+            if entry is None:
+                entry = self.__materialize(cluster_name, digest, kctx)
+            entry.refs += 1
+            entry.last_used = time.time()
+            self.__evict()
+            return dict(entry.kube_env)
+
+    def release(self, kube_env):
+        with self.lock:
+            entry = self.by_path.get(kube_env.get("KUBECONFIG"))
+            if entry is None:
+                return
+            entry.refs -= 1
+            entry.last_used = time.time()
+            if entry.retired and entry.refs <= 0:
+                self.__remove(entry)
+
+    def invalidate(self, cluster_name):
+        """Drop cluster's kubeconfig, e.g. when its kube context was deleted or changed"""
+        with self.lock:
+            entry = self.entries.get(cluster_name)
+            if entry is not None:
+                self.__retire(entry)
+
+    def clear(self):
+        with self.lock:
+            for entry in list(self.entries.values()):
+                self.__retire(entry)
+
+    def stats(self):
+        with self.lock:
+            return {"clusters": len(self.entries), "files": len(self.by_path),
+                    "in_use": sum(1 for e in self.by_path.values() if e.refs > 0)}
+
+    def __materialize(self, cluster_name, digest, kctx):
+        if self.root is None:
+            self.root = tempfile.mkdtemp(prefix="spinless-kubeconf-")
+            atexit.register(shutil.rmtree, self.root, True)
+        root_path = tempfile.mkdtemp(prefix=f"{cluster_name}-", dir=self.root)
+        kube_config_file_path = f"{root_path}/{KUBECONFIG_FILE}"
+        kubeconf_str = base64.standard_b64decode(kctx["kube_config"].encode("utf-8")).decode("utf-8")
+        fd = os.open(kube_config_file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as kubeconf_file:
+            kubeconf_file.write(kubeconf_str)
+        kube_env = {"KUBECONFIG": kube_config_file_path}
+        kube_env.update({env: kctx[key] for (env, key) in AWS_ENV.items() if kctx.get(key)})
+        entry = KubeconfigEntry(cluster_name, digest, root_path, kube_env)
+        self.entries[cluster_name] = entry
+        self.by_path[kube_config_file_path] = entry
+        return entry
+
+    def __evict(self):
+        now = time.time()
+        idle = sorted((e for e in self.entries.values() if e.refs <= 0), key=lambda e: e.last_used)
+        for entry in idle:
+            if len(self.entries) <= self.max_entries and now - entry.last_used <= self.idle_ttl:
+                break
+            self.__retire(entry)
+
+    def __retire(self, entry):
+        if self.entries.get(entry.cluster_name) is entry:
+            self.entries.pop(entry.cluster_name)
+        entry.retired = True
+        if entry.refs <= 0:
+            self.__remove(entry)
+
+    def __remove(self, entry):
+        self.by_path.pop(entry.kube_env["KUBECONFIG"], None)
+        shutil.rmtree(entry.root_path, ignore_errors=True)
+
+
+kubeconfig_cache = KubeconfigCache()
@@ -1,11 +1,23 @@
+import ctypes
+import ctypes.util
 import json
 import logging
 import os
 import re
+import select
 import sys
+import threading
 import time
 
-import tailer
+# Lines of running job are kept in memory (older ones are read from log file)
+LOG_BUS_MAX_LINES = int(os.getenv("LOG_BUS_MAX_LINES", 10000))
+# Log of finished job stays in memory for late followers, then it's read from log file
+LOG_BUS_RETENTION_SEC = int(os.getenv("LOG_BUS_RETENTION_SEC", 300))
+# Following of log file (job isn't known to log bus) stops if nothing was written for this time
+LOG_FOLLOW_IDLE_SEC = int(os.getenv("LOG_FOLLOW_IDLE_SEC", 600))
+# Streaming followers get keepalive when there were no lines for this time
+LOG_HEARTBEAT_SEC = int(os.getenv("LOG_HEARTBEAT_SEC", 15))
+EOF_MARKER = '"status": "EOF"'
 
 
 def create_dir(path):
@@ -17,33 +29,288 @@ def create_dir(path):
         print("Successfully created the directory %s" % path)
 
 
-def create_logger(job_id):
+def logs_dir():
     prj_dir = os.path.dirname(sys.modules['__main__'].__file__)
-    path = "{}/state/logs".format(prj_dir)
+    return "{}/state/logs".format(prj_dir)
+
+
+def log_path(job_id):
+    return "{}/{}.log".format(logs_dir(), job_id)
+
+
+def create_logger(job_id):
+    path = logs_dir()
     create_dir(path)
     logger = logging.getLogger(job_id)
     logger.setLevel(logging.DEBUG)
     logger.addHandler(logging.FileHandler("{}/{}.log".format(path, job_id), 'w', 'utf-8'))
+    logger.addHandler(BusHandler(log_bus.open(job_id)))
     return logger
 
 
-def tail_f(job_id):
-    prj_dir = os.path.dirname(sys.modules['__main__'].__file__)
-    log_file = '{}/state/logs/{}.log'.format(prj_dir, job_id)
-    while not os.path.exists(log_file):
-        time.sleep(1)
-
-    with open(log_file, 'a+') as file:
-        file.seek(0)
-        for line in file.readlines():
-            if '"status": "EOF"' in line:
+class JobLog:
+    """
+    In-memory log of a job. Line's sequence number is its index in job's log file
+    """
+
+    def __init__(self, job_id, max_lines=LOG_BUS_MAX_LINES):
+        self.job_id = job_id
+        self.max_lines = max_lines
+        self.lines = []
+        self.first_seq = 0
+        self.next_seq = 0
+        self.closed_at = None
+        self.condition = threading.Condition()
+
+    def append(self, line):
+        with self.condition:
+            self.lines.append(line)
+            if len(self.lines) >= 2 * self.max_lines:
+                # trimmed in batches, so appending stays O(1) amortized
+                dropped = len(self.lines) - self.max_lines
+                del self.lines[:dropped]
+                self.first_seq += dropped
+            self.next_seq += 1
+            if EOF_MARKER in line:
+                self.closed_at = time.monotonic()
+            self.condition.notify_all()
+
+    def read(self, from_seq, timeout=None):
+        """
+        Wait for lines starting from from_seq
+        :param timeout: max time to wait, no lines are returned if nothing was written within it
+        :return: (first available seq, lines, whether log is complete)
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.next_seq > from_seq or self.closed_at is not None, timeout)
+            start = max(from_seq, self.first_seq)
+            return start, self.lines[start - self.first_seq:], self.closed_at is not None
+
+
+class LogBus:
+    """
+    Publish/subscribe of job logs in memory. Job's lines are pushed to followers as soon as they are written,
+    idle followers just wait on job's condition.
+    """
+
+    def __init__(self, retention_sec=LOG_BUS_RETENTION_SEC):
+        self.retention_sec = retention_sec
+        self.logs = {}
+        self.followers = 0
+        self.lock = threading.Lock()
+
+    def open(self, job_id):
+        with self.lock:
+            now = time.monotonic()
+            for (expired_id, log) in list(self.logs.items()):
+                if log.closed_at is not None and now - log.closed_at > self.retention_sec:
+                    self.logs.pop(expired_id)
+            return self.logs.setdefault(job_id, JobLog(job_id))
+
+    def get(self, job_id):
+        with self.lock:
+            return self.logs.get(job_id)
+
+    def follow(self, job_id, from_seq=0, heartbeat_sec=None):
+        """
+        Lines of job's log till EOF (inclusive). Log file is followed if job isn't in memory (e.g. it's historical)
+        :param job_id: job id
+        :param from_seq: sequence number of the first line to get
+        :param heartbeat_sec: if set - (None, None) is generated when there were no lines for this time
+        :return: generator of (seq, line)
+        """
+        job_log = self.get(job_id)
+        if job_log is None:
+            yield from follow_file(log_path(job_id), from_seq, heartbeat_sec=heartbeat_sec)
+            return
+        with self.lock:
+            self.followers += 1
+        try:
+            seq = from_seq
+            while True:
+                start, lines, closed = job_log.read(seq, heartbeat_sec)
+                if start == seq and not lines and not closed:
+                    yield None, None
+                    continue
+                if start > seq:
+                    # lines aren't in memory any more
+                    for (file_seq, line) in follow_file(log_path(job_id), seq):
+                        if file_seq >= start:
+                            break
+                        yield file_seq, line
+                for line in lines:
+                    yield start, line
+                    start += 1
+                    if EOF_MARKER in line:
+                        return
+                seq = start
+                if closed and not lines:
+                    return
+        finally:
+            with self.lock:
+                self.followers -= 1
+
+    def stats(self):
+        with self.lock:
+            return {"jobs": len(self.logs), "running": sum(1 for l in self.logs.values() if l.closed_at is None),
+                    "followers": self.followers}
+
+
+class BusHandler(logging.Handler):
+    """Publishes job logger's records to log bus, line by line as they are written to log file"""
+
+    def __init__(self, job_log):
+        super().__init__()
+        self.job_log = job_log
+
+    def emit(self, record):
+        try:
+            for line in self.format(record).split("\n"):
+                self.job_log.append(line)
+        except Exception:
+            self.handleError(record)
+
+
+class FileWatcher:
+    """
+    Waits for modifications of a file with inotify, falls back to polling where inotify isn't available
+    """
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_CREATE = 0x100
+    libc = None
+
+    def __init__(self, path):
+        self.fd = None
+        try:
+            if FileWatcher.libc is None:
+                FileWatcher.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = FileWatcher.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return
+            if FileWatcher.libc.inotify_add_watch(fd, path.encode("utf-8"),
+                                                  self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_CREATE) < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (OSError, AttributeError):
+            self.fd = None
+
+    def wait(self, timeout):
+        """
+        :return: True if file was (probably) modified within timeout
+        """
+        if self.fd is None:
+            time.sleep(min(timeout, 1.))
+            return True
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+        return bool(ready)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def follow_file(path, from_seq=0, idle_sec=LOG_FOLLOW_IDLE_SEC, heartbeat_sec=None):
+    """
+    Lines of log file till EOF (inclusive), waiting for the file to appear and grow
+    :param heartbeat_sec: if set - (None, None) is generated when there were no lines for this time
+    :return: generator of (seq, line)
+    """
+    watcher = FileWatcher(path if os.path.exists(path) else os.path.dirname(path))
+
+    def wait(deadline):
+        """:return: False if idle deadline passed, None if heartbeat is due, True otherwise"""
+        timeout = max(deadline - time.monotonic(), 0)
+        modified = watcher.wait(min(timeout, heartbeat_sec) if heartbeat_sec else timeout)
+        if not modified and time.monotonic() >= deadline:
+            return False
+        return modified or None
+
+    try:
+        deadline = time.monotonic() + idle_sec
+        while not os.path.exists(path):
+            waited = wait(deadline)
+            if waited is False:
                 return
-            yield line + '\n'
+            if waited is None:
+                yield None, None
+        watcher.close()
+        watcher = FileWatcher(path)
+        with open(path, encoding='utf-8') as file:
+            seq = 0
+            partial = ""
+            while True:
+                line = file.readline()
+                if not line:
+                    waited = wait(deadline)
+                    if waited is False:
+                        return
+                    if waited is None:
+                        yield None, None
+                    continue
+                deadline = time.monotonic() + idle_sec
+                partial += line
+                if not partial.endswith("\n"):
+                    continue
+                line, partial = partial[:-1], ""
+                if seq >= from_seq:
+                    yield seq, line
+                seq += 1
+                if EOF_MARKER in line:
+                    return
+    finally:
+        watcher.close()
 
-        for line in tailer.follow(file):
-            yield line + '\n'
-            if '"status": "EOF"' in line:
-                break
+
+def tail_f(job_id):
+    for (_, line) in log_bus.follow(job_id):
+        yield line + '\n'
+
+
+def sse_stream(job_id, from_seq=0, heartbeat_sec=LOG_HEARTBEAT_SEC):
+    """
+    Job's log as Server-Sent Events. Status records are "status" events, other lines - "log" events.
+    Event id is line's sequence number, so client can resume with Last-Event-ID
+    """
+    for (seq, line) in log_bus.follow(job_id, from_seq, heartbeat_sec):
+        if seq is None:
+            yield ': keepalive\n\n'
+        elif line:
+            yield f'id: {seq}\nevent: {"log" if parse_status(line) is None else "status"}\ndata: {line}\n\n'
+
+
+def ndjson_stream(job_id, from_seq=0, heartbeat_sec=LOG_HEARTBEAT_SEC):
+    """
+    Job's log as newline delimited json. Every object has "seq" (line's sequence number) to resume from,
+    other lines are sent as {"seq": .., "message": ..}. Keepalive is an empty line
+    """
+    for (seq, line) in log_bus.follow(job_id, from_seq, heartbeat_sec):
+        if seq is None:
+            yield '\n'
+        elif line:
+            record = parse_status(line) or {"message": line}
+            yield json.dumps({"seq": seq, **record}) + '\n'
+
+
+def parse_status(line):
+    """
+    :return: status record (see status) if line is one, None otherwise
+    """
+    if not line.startswith("{"):
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) and "status" in record else None
 
 
 def redacted(message):
@@ -68,15 +335,32 @@ class JobLogger:
     def __init__(self, id):
         self.id = id
         self.logger = create_logger(id)
+        self.closed = False
+        # keeps order of lines in log file and log bus the same
+        self.lock = threading.Lock()
 
     def info(self, message):
-        self.logger.info(f'{message}\n')
+        with self.lock:
+            self.logger.info(f'{message}\n')
 
     def emit(self, event_status, message):
-        status(self.logger, self.id, event_status, message)
+        with self.lock:
+            status(self.logger, self.id, event_status, message)
 
     def handlers(self):
         return self.logger.handlers.__len__() != 0
 
+    def close(self):
+        """Close log file and forget the logger, so finished jobs don't hold memory and file descriptors"""
+        with self.lock:
+            self.closed = True
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+                handler.close()
+            logging.Logger.manager.loggerDict.pop(self.id, None)
+
     def write_eof(self):
         self.emit("EOF", '')
+
+
+log_bus = LogBus()
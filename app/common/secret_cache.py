@@ -0,0 +1,101 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class SecretCache:
+    """
+    In-process, size bounded read-through cache for Vault secrets.
+    Entries are kept for TTL given by caller and evicted in LRU order when cache is full.
+    Cached values are deep copies, so callers may modify what they get.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # key -> [generation, number of loads in progress]. Generation changes when key is invalidated during load
+        self.loads = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(self, operation, path, ttl, loader):
+        """
+        Get cached value of operation on path or load it
+        :param operation: operation name ("read"/"list")
+        :param path: secret path
+        :param ttl: time to keep value in cache. 0 - don't cache at all
+        :param loader: function to call when there's no fresh value in cache
+        :return: value
+        """
+        if ttl <= 0:
+            return loader()
+        key = (operation, path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+            load = self.loads.setdefault(key, [0, 0])
+            load[1] += 1
+            generation = load[0]
+        try:
+            value = loader()
+        except Exception:
+            with self.lock:
+                self.__end_load(key, load)
+            raise
+        with self.lock:
+            self.__end_load(key, load)
+            # Missing secrets are not cached: they are expected to appear soon (e.g. new registry or cluster).
+            # Value loaded before the path was invalidated may be stale, it's not cached either
+            if value is not None and load[0] == generation:
+                self.entries[key] = (time.time() + ttl, copy.deepcopy(value))
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, path):
+        """
+        Drop entries affected by change of path: the path itself, everything under it,
+        and listings of its parent paths
+        :param path: changed (written/deleted) secret path
+        """
+        path = path.rstrip("/")
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if self.__affected(key, path):
+                    del self.entries[key]
+            for (key, load) in self.loads.items():
+                if self.__affected(key, path):
+                    load[0] += 1
+
+    def __end_load(self, key, load):
+        """Must be called under self.lock"""
+        load[1] -= 1
+        if load[1] == 0:
+            del self.loads[key]
+
+    @staticmethod
+    def __affected(key, path):
+        cached_path = key[1].rstrip("/")
+        return cached_path == path or cached_path.startswith(f"{path}/") or \
+            (key[0] == "list" and path.startswith(f"{cached_path}/"))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries),
+                    "max_entries": self.max_entries,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
@@ -1,6 +1,21 @@
+import io
 import os
+import selectors
 import shlex
+import signal
 import subprocess
+import threading
+import time
+from collections import deque
+
+# Time given to cancelled command's processes to exit after SIGTERM, before they are killed
+KILL_GRACE_SEC = float(os.getenv("SHELL_KILL_GRACE_SEC", 10))
+# Number of last output lines kept by StreamingCommand (e.g. to report failure details)
+SHELL_TAIL_LINES = int(os.getenv("SHELL_TAIL_LINES", 200))
+# Longer lines are split, so that output without line breaks doesn't grow the buffer
+SHELL_MAX_LINE_BYTES = 64 * 1024
+# Max output of shell_await command kept in memory, older output is dropped
+SHELL_OUTPUT_MAX_BYTES = int(os.getenv("SHELL_OUTPUT_MAX_BYTES", 64 * 1024 * 1024))
 
 
 class ShellError(Exception):
@@ -9,45 +24,176 @@ class ShellError(Exception):
     """
 
 
-def shell_await(cmd, env=None, with_output=False, cwd=None, timeout=300, get_stream=False):
+class CancelledError(Exception):
+    """
+    Raised when operation is cancelled with its CancellationToken
+    """
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation of a job. Running commands are terminated (with all their child processes)
+    as soon as the token is cancelled, and new commands are not started
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as ex:
+                print(f"Cancellation callback failed: {ex}")
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise CancelledError("Cancelled")
+
+    def on_cancel(self, callback):
+        """
+        Call callback when the token is cancelled (right away if it is already)
+        :return: function that unregisters the callback
+        """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return lambda: self.__unregister(callback)
+        callback()
+        return lambda: None
+
+    def __unregister(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+def terminate_process_group(p, grace_sec=KILL_GRACE_SEC):
+    """
+    SIGTERM to process' group (process is started in its own session), SIGKILL to what's left after grace period
+    """
+    try:
+        os.killpg(p.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        return
+
+    def kill():
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    timer = threading.Timer(grace_sec, kill)
+    timer.daemon = True
+    timer.start()
+
+
+def start_process(cmd, env=None, cwd=None, cancel_token=None, merge_stderr=True):
+    """
+    Start command in its own process group, so that the command and all its children can be terminated together
+    :param merge_stderr: stderr is redirected to stdout if True, it's a separate pipe otherwise
+    :raise CancelledError: if cancel_token is already cancelled
+    :return: (Popen, function to call when process is complete)
+    """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    if env:
+        env = dict(os.environ, **env)
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+                         env=env, cwd=cwd, start_new_session=True)
+    unregister = cancel_token.on_cancel(lambda: terminate_process_group(p)) if cancel_token else lambda: None
+    return p, unregister
+
+
+class OutputBuffer:
+    """
+    Ring buffer with last max_bytes of command's output. It's filled by reader thread while the command runs,
+    so the command never blocks on full pipe
     """
-    Execute a command in new Subprocess (Popen(...))
+
+    def __init__(self, max_bytes=SHELL_OUTPUT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def drain(self, stream):
+        """Read stream until EOF"""
+        for chunk in iter(lambda: stream.read1(65536), b""):
+            self.append(chunk)
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        while self.size > self.max_bytes:
+            oldest = self.chunks.popleft()
+            excess = self.size - self.max_bytes
+            if len(oldest) > excess:
+                self.chunks.appendleft(oldest[excess:])
+                oldest = oldest[:excess]
+            self.size -= len(oldest)
+            self.dropped += len(oldest)
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+
+def shell_await(cmd, env=None, with_output=False, cwd=None, timeout=300, get_stream=False, cancel_token=None):
+    """
+    Execute a command in new Subprocess (Popen(...)). Output is read while the command runs (see OutputBuffer)
     :param cmd: command to execute (using Popen)
     :param env: custom environment variables params to pass to command execution
     :param with_output: whether to return all output
     :param cwd: current working directory (optional)
     :param timeout: timeout to override. By default - Popen.wait's default value
+    :param cancel_token: CancellationToken, command is terminated when it's cancelled
+    :raise CancelledError: if command was cancelled
     :return: exit (code, system out iterable (if any))
     """
-    if env:
-        env = dict(os.environ, **env)
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, cwd=cwd)
-    else:
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
-
-    def stream():
-        if not with_output:
-            return None
-        else:
-            return p.stdout
+    p, unregister = start_process(cmd, env, cwd, cancel_token)
+    buffer = OutputBuffer(SHELL_OUTPUT_MAX_BYTES if with_output else 0)
+    reader = threading.Thread(target=buffer.drain, args=(p.stdout,), name=f"shell-reader-{p.pid}", daemon=True)
+    reader.start()
+    started = time.monotonic()
+    try:
+        return_code = p.wait(timeout=timeout)
+        # background children of the command may still hold the output open
+        reader.join(timeout=None if timeout is None else max(timeout - (time.monotonic() - started), 0))
+    except subprocess.TimeoutExpired:
+        terminate_process_group(p, grace_sec=0)
+        raise
+    finally:
+        unregister()
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
 
     def output():
         if not with_output:
             yield "Command started: {}".format(cmd)
         else:
-            while True:
-                line = p.stdout.readline()
-                if not line:
-                    break
-                yield line.rstrip().decode("utf-8")
+            if buffer.dropped:
+                yield f"... {buffer.dropped} bytes of output dropped"
+            for line in buffer.getvalue().decode("utf-8", errors="replace").splitlines():
+                yield line.rstrip()
 
     if get_stream:
-        return p.wait(timeout=timeout), stream()
+        return return_code, io.BytesIO(buffer.getvalue()) if with_output else None
     else:
-        return p.wait(timeout=timeout), output()
+        return return_code, output()
 
 
-def shell_run(cmd, env=None, cwd=None, timeout=300, get_stream=False, fail_fast=None):
+def shell_run(cmd, env=None, cwd=None, timeout=300, get_stream=False, fail_fast=None, cancel_token=None):
     """
     Execute a command in subprocess.run(...)
     :param get_stream: returns output in stream if True, as list of lines - otherwise
@@ -56,23 +202,124 @@ def shell_run(cmd, env=None, cwd=None, timeout=300, get_stream=False, fail_fast=
     :param cwd: current working directory (optional)
     :param timeout: timeout to override.
     :param fail_fast: if you want to fail fast - pass the error message to throw
+    :param cancel_token: CancellationToken, command is terminated when it's cancelled
+    :raise CancelledError: if command was cancelled
     :return: exit (code, system out iterable (if any))
     """
     cmd = shlex.split(cmd)
-    if env:
-        env = dict(os.environ, **env)
-        completed = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, cwd=cwd,
-                                   timeout=timeout)
-    else:
-        completed = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd, timeout=timeout)
+    p, unregister = start_process(cmd, env, cwd, cancel_token)
+    try:
+        stdout, _ = p.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        terminate_process_group(p, grace_sec=0)
+        p.communicate()
+        raise
+    finally:
+        unregister()
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
 
-    return_code = completed.returncode
+    return_code = p.returncode
     if fail_fast is not None and return_code != 0:
         raise ShellError(fail_fast)
     if get_stream:
-        return return_code, completed.stdout
+        return return_code, stdout
     else:
-        return return_code, completed.stdout.decode('utf-8').split('\n')
+        return return_code, stdout.decode('utf-8').split('\n')
+
+
+class StreamingCommand:
+    """
+    Command whose output (stdout and stderr) is read line by line while it's running:
+
+        command = StreamingCommand("terraform apply ...", cwd=work_dir, timeout=2000)
+        for line in command.lines():
+            ...
+        command.returncode
+
+    Only last tail_lines lines are retained (see tail), whatever the size of the output
+    """
+
+    def __init__(self, cmd, env=None, cwd=None, timeout=300, idle_timeout=None, tail_lines=SHELL_TAIL_LINES,
+                 cancel_token=None):
+        """
+        :param cmd: command to execute, string is split with shlex
+        :param env: custom environment variables params to pass to command execution
+        :param cwd: current working directory (optional)
+        :param timeout: max duration of the command
+        :param idle_timeout: max time without any output (optional)
+        :param tail_lines: number of last output lines to retain
+        :param cancel_token: CancellationToken, command is terminated when it's cancelled
+        """
+        self.cmd = shlex.split(cmd) if isinstance(cmd, str) else cmd
+        self.env = env
+        self.cwd = cwd
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.cancel_token = cancel_token
+        self.tail = deque(maxlen=tail_lines)
+        self.returncode = None
+
+    def lines(self):
+        """
+        Decoded output lines as soon as they are printed. returncode is set when all lines are read
+        :raise subprocess.TimeoutExpired: if command exceeds timeout or idle_timeout, command is killed
+        :raise CancelledError: if command was cancelled
+        """
+        p, unregister = start_process(self.cmd, self.env, self.cwd, self.cancel_token)
+        started = last_output = time.monotonic()
+        fd = p.stdout.fileno()
+        os.set_blocking(fd, False)
+        buffer = b""
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(fd, selectors.EVENT_READ)
+                while True:
+                    if not selector.select(self.__time_left(started, last_output)):
+                        continue
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    last_output = time.monotonic()
+                    buffer += chunk
+                    *complete, buffer = buffer.split(b"\n")
+                    if len(buffer) > SHELL_MAX_LINE_BYTES:
+                        complete.append(buffer)
+                        buffer = b""
+                    for line in complete:
+                        yield self.__line(line)
+            if buffer:
+                yield self.__line(buffer)
+            # output is closed, process is exiting (or has detached from its output)
+            self.returncode = p.wait(timeout=max(self.__time_left(started, time.monotonic()), 0))
+        except subprocess.TimeoutExpired:
+            terminate_process_group(p, grace_sec=0)
+            raise
+        finally:
+            unregister()
+            if p.poll() is None:
+                # consumer stopped reading or command timed out
+                terminate_process_group(p, grace_sec=0)
+                p.wait()
+            p.stdout.close()
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+
+    def __line(self, raw):
+        line = raw.rstrip(b"\r").decode("utf-8", errors="replace")
+        self.tail.append(line)
+        return line
+
+    def __time_left(self, started, last_output):
+        """:raise subprocess.TimeoutExpired: if there is no time left"""
+        now = time.monotonic()
+        left = self.timeout - (now - started)
+        if self.idle_timeout is not None:
+            left = min(left, self.idle_timeout - (now - last_output))
+        if left <= 0:
+            raise subprocess.TimeoutExpired(self.cmd, self.timeout if now - started >= self.timeout
+                                            else self.idle_timeout)
+        return left
 
 
 def create_dirs(path):
@@ -3,13 +3,26 @@ import os
 import hvac
 from jinja2 import Environment, FileSystemLoader
 
-MOUNT_POINT = "kubernetes"
+from common.secret_cache import SecretCache
+from common import vault_pool
+
 SECRET_ROOT = "secretv2"
 
 dev_mode = os.getenv("DEV_MODE", False)
 
 APP_ENV_PATH = "app_env"
 
+# Secrets that rarely change but are read by every job. Prefix -> seconds to keep in cache.
+# Writes/deletes made through Vault class invalidate cached entries immediately
+CACHE_TTL_SEC = int(os.getenv("VAULT_CACHE_TTL_SEC", 300))
+CACHED_PREFIXES_TTL = {
+    "{base_path}/registries": CACHE_TTL_SEC,
+    "{base_path}/kctx": CACHE_TTL_SEC,
+    "{base_path}/tolerations": CACHE_TTL_SEC,
+    f"{SECRET_ROOT}/scalecube/spinless/resources/common": CACHE_TTL_SEC,
+}
+secret_cache = SecretCache(max_entries=int(os.getenv("VAULT_CACHE_MAX_ENTRIES", 1024)))
+
 
 class Vault:
     def __init__(self, logger,
@@ -36,8 +49,7 @@ class Vault:
         try:
             policies = self.j2_env.get_template('service-policies.j2') \
                 .render(secrets_root=SECRET_ROOT, owner=self.owner, repo=self.repo, mount_point=self.mount_point)
-            self.__auth_client()
-            self.client.sys.create_or_update_policy(policy_name, policies)
+            self.__execute(lambda client: client.sys.create_or_update_policy(policy_name, policies))
         except Exception as e:
             self.logger.info("Vault create_policy exception is: {}".format(e))
         return policy_name
@@ -46,27 +58,26 @@ class Vault:
         self.logger.info("Creating service role")
         policy_name = self.__create_policy()
         try:
-            self.__auth_client()
             service_account_name = f'{self.owner}-{self.repo}'
             role_name = f"{service_account_name}-role"
-            self.client.create_role(role_name,
-                                    mount_point=self.mount_point,
-                                    bound_service_account_names=service_account_name,
-                                    bound_service_account_namespaces="*",
-                                    policies=[policy_name], ttl="1h")
+            self.__execute(lambda client: client.create_role(role_name,
+                                                             mount_point=self.mount_point,
+                                                             bound_service_account_names=service_account_name,
+                                                             bound_service_account_namespaces="*",
+                                                             policies=[policy_name], ttl="1h"))
             return role_name, 0
         except Exception as e:
             self.logger.info("Vault create_role exception is: {}".format(e))
             return str(e), 1
 
     def read(self, path):
-        self.__auth_client()
-        return self.client.read(path)
+        return secret_cache.get_or_load("read", path, self.__cache_ttl(path),
+                                        lambda: self.__execute(lambda client: client.read(path)))
 
     def list(self, path):
-        self.__auth_client()
         try:
-            result = self.client.list(path)
+            result = secret_cache.get_or_load("list", path, self.__cache_ttl(path),
+                                              lambda: self.__execute(lambda client: client.list(path)))
             if "data" in result:
                 return result.get("data").get("keys", [])
             return []
@@ -75,16 +86,19 @@ class Vault:
             return []
 
     def write(self, path, **data):
-        self.__auth_client()
-        self.client.write(path, wrap_ttl=None, **data)
+        try:
+            self.__execute(lambda client: client.write(path, wrap_ttl=None, **data))
+        finally:
+            secret_cache.invalidate(path)
 
     def delete(self, path):
         try:
-            self.__auth_client()
-            self.client.delete(path)
+            self.__execute(lambda client: client.delete(path))
             return path, 0
         except Exception as ex:
             return str(ex), 1
+        finally:
+            secret_cache.invalidate(path)
 
     def delete_service_path(self, namespace):
         return self.delete(f'{SECRET_ROOT}/{self.owner}/{self.repo}/{namespace}')
@@ -95,33 +109,31 @@ class Vault:
             self.logger.warning(f"base secrets namespace not provided. will not populate the new secrets")
             return service_path, 0
         base_path = f"{SECRET_ROOT}/{self.owner}/{self.repo}/{base_ns}"
-        self.__auth_client()
         try:
-            existing = self.client.read(service_path)
+            existing = self.__execute(lambda client: client.read(service_path))
             if existing and existing.get('data'):
                 return service_path, 0
             else:
-                base_secrets = self.client.read(base_path)
+                base_secrets = self.__execute(lambda client: client.read(base_path))
                 if base_secrets and base_secrets.get('data'):
-                    self.client.write(service_path, **base_secrets.get('data'))
+                    self.__execute(lambda client: client.write(service_path, **base_secrets.get('data')))
         except Exception as e:
             self.logger.warning(f"Failed prepare service path: {e}")
             return str(e), 1
 
     def enable_k8_auth(self, cluster_name, reviewer_jwt, kube_ca, kube_serv):
         try:
-            self.__auth_client()
             # Configure auth here
             mount_point = 'kubernetes-{}'.format(cluster_name)
-            self.client.sys.enable_auth_method(
+            self.__execute(lambda client: client.sys.enable_auth_method(
                 method_type='kubernetes',
                 path=mount_point,
-            )
-            self.client.create_kubernetes_configuration(
+            ))
+            self.__execute(lambda client: client.create_kubernetes_configuration(
                 kubernetes_host=kube_serv,
                 kubernetes_ca_cert=kube_ca,
                 token_reviewer_jwt=reviewer_jwt,
-                mount_point=mount_point)
+                mount_point=mount_point))
             return 0, "success"
         except Exception as e:
             self.logger.warning("Failed to enable k8 auth for {}. Reason: {}".format(cluster_name, e))
@@ -129,26 +141,37 @@ class Vault:
 
     def disable_vault_mount_point(self, cluster_name):
         try:
-            self.__auth_client()
             # Configure auth here
             mount_point = 'kubernetes-{}'.format(cluster_name)
-            self.client.sys.disable_auth_method(
+            self.__execute(lambda client: client.sys.disable_auth_method(
                 path=mount_point,
-            )
+            ))
             return 0, "success"
         except Exception as e:
             self.logger.warning(f"Failed to disable k8 auth for {cluster_name}. Reason: {e}")
             return 1, str(e)
 
-    # Vault's token ttl is too short so this should be called prior to any operation
-    def __auth_client(self):
-        self.client = hvac.Client()
+    def __cache_ttl(self, path):
+        for prefix, ttl in CACHED_PREFIXES_TTL.items():
+            prefix = prefix.format(base_path=self.base_path)
+            if path == prefix or path.startswith(f"{prefix}/"):
+                return ttl
+        return 0
+
+    def __execute(self, operation):
+        """
+        Run operation with authenticated client from the shared pool.
+        If Vault rejects the token (403), login again and retry once
+        :param operation: function accepting hvac client
+        :return: operation result
+        """
+        client = self.__auth_client()
         try:
-            if not self.dev_mode:
-                with open(self.vault_jwt_token)as f:
-                    jwt = f.read()
-                    self.client.auth_kubernetes(self.service_role, jwt, MOUNT_POINT)
-            else:
-                self.client.lookup_token(os.getenv("LOCAL_VAULT_TOKEN"))
-        except Exception as ex:
-            print(f"Error authenticating vault: {str(ex)}")
+            return operation(client)
+        except hvac.exceptions.Forbidden:
+            vault_pool.client_pool.invalidate(client)
+            return operation(self.__auth_client())
+
+    def __auth_client(self):
+        # looked up on every call, so the pool can be replaced (e.g. in tests)
+        return vault_pool.client_pool.get_client(self.service_role, self.vault_jwt_token, self.dev_mode)
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+import hvac
+
+from common.http_client import http_client
+
+MOUNT_POINT = "kubernetes"
+
+# Token is renewed (or re-issued) when it's closer to expiration than this
+RENEW_BEFORE_EXPIRY_SEC = int(os.getenv("VAULT_RENEW_BEFORE_EXPIRY_SEC", 60))
+
+
+class PooledClient:
+    """Authenticated hvac client together with its token lease"""
+
+    def __init__(self, client):
+        self.client = client
+        self.expires_at = 0.
+        self.renewable = False
+        self.lock = threading.Lock()
+
+    def update_lease(self, auth):
+        lease_duration = auth.get("lease_duration", 0) if auth else 0
+        # lease_duration == 0 means token never expires (e.g. root token in dev mode)
+        self.expires_at = time.time() + lease_duration if lease_duration > 0 else float("inf")
+        self.renewable = bool(auth.get("renewable")) if auth else False
+
+
+class VaultClientPool:
+    """
+    Process-wide pool of authenticated Vault clients, one per (role, jwt path, dev mode).
+    Clients share pooled HTTP session (see http_client) so connections to Vault stay alive between calls.
+    Token is renewed shortly before expiration, and new login happens only if token expired,
+    could not be renewed or was rejected by Vault (see invalidate).
+    """
+
+    def __init__(self, renew_before_expiry=RENEW_BEFORE_EXPIRY_SEC):
+        self.renew_before_expiry = renew_before_expiry
+        self.session = http_client.session
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.renewals = 0
+
+    def get_client(self, service_role, jwt_path, dev_mode):
+        """
+        Get authenticated client, login or renew token if necessary
+        :param service_role: vault role to login with (kubernetes auth)
+        :param jwt_path: path to service account token
+        :param dev_mode: if True - use token from environment (LOCAL_VAULT_TOKEN / VAULT_TOKEN) instead of login
+        :return: hvac client
+        """
+        key = (service_role, jwt_path, bool(dev_mode))
+        with self.lock:
+            pooled = self.clients.get(key)
+            if pooled is None:
+                pooled = PooledClient(hvac.Client(session=self.session))
+                self.clients[key] = pooled
+        with pooled.lock:
+            if pooled.expires_at - time.time() > self.renew_before_expiry:
+                return pooled.client
+            if not (pooled.renewable and pooled.expires_at > time.time() and self.__renew(pooled)):
+                self.__login(pooled, service_role, jwt_path, dev_mode)
+            return pooled.client
+
+    def invalidate(self, client):
+        """
+        Force new login on next get_client, e.g. when Vault responded with 403 for the client's token
+        :param client: hvac client previously returned by get_client
+        """
+        with self.lock:
+            pooled_clients = list(self.clients.values())
+        for pooled in pooled_clients:
+            if pooled.client is client:
+                with pooled.lock:
+                    pooled.expires_at = 0.
+                    pooled.renewable = False
+
+    def stats(self):
+        return {"clients": len(self.clients), "logins": self.logins, "renewals": self.renewals}
+
+    def __renew(self, pooled):
+        try:
+            response = pooled.client.renew_token()
+            pooled.update_lease(response.get("auth"))
+            self.renewals += 1
+            return True
+        except Exception as ex:
+            print(f"Failed to renew vault token: {str(ex)}")
+            return False
+
+    def __login(self, pooled, service_role, jwt_path, dev_mode):
+        try:
+            if not dev_mode:
+                with open(jwt_path) as f:
+                    jwt = f.read()
+                response = pooled.client.auth_kubernetes(service_role, jwt, mount_point=MOUNT_POINT)
+                pooled.update_lease(response.get("auth"))
+            else:
+                response = pooled.client.lookup_token(os.getenv("LOCAL_VAULT_TOKEN"))
+                pooled.update_lease({"lease_duration": response.get("data", {}).get("ttl", 0)})
+            self.logins += 1
+        except Exception as ex:
+            pooled.expires_at = 0.
+            print(f"Error authenticating vault: {str(ex)}")
+
+
+client_pool = VaultClientPool()
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+
+from common.http_client import http_client
+
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR", f"{os.getcwd()}/state/charts")
+CHART_CACHE_MAX_MB = int(os.getenv("CHART_CACHE_MAX_MB", 2048))
+CHART_DOWNLOAD_TIMEOUT_SEC = int(os.getenv("CHART_DOWNLOAD_TIMEOUT_SEC", 60))
+# Size of chunks read from registry: archive is never kept in memory as a whole
+CHART_DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+
+class UnsafeArchiveError(Exception):
+    """
+    Raised when chart archive contains members that would be extracted outside of target directory
+    """
+
+
+class DigestingStream:
+    """
+    File-like reader over chunks of http response, that computes sha256 of everything read.
+    Keeps at most one chunk in memory.
+    """
+
+    def __init__(self, response, chunk_size=CHART_DOWNLOAD_CHUNK_BYTES):
+        self.chunks = response.iter_content(chunk_size=chunk_size)
+        self.buffer = b""
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        if not self.buffer:
+            self.buffer = next(self.chunks, b"")
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.sha256.update(data)
+        return data
+
+    def drain(self):
+        while self.read():
+            pass
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+class ChartCache:
+    """
+    On-disk cache of extracted helm charts.
+
+    Entries are keyed by registry/owner/repo/version and point to extracted chart trees, that are stored by
+    digest of chart archive (same archive published under different names is extracted once).
+    Trees are read-only and shared between deployments. Immutable versions are never downloaded twice,
+    mutable ones (e.g. built from develop branch) are revalidated with conditional GET (ETag).
+    Least recently used trees are evicted when total size exceeds the limit, trees in use are never evicted
+    (tree is checked to exist and marked in use at once, under the same lock as eviction).
+    """
+
+    def __init__(self, root=CHART_CACHE_DIR, max_bytes=CHART_CACHE_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries_dir = f"{root}/entries"
+        self.trees_dir = f"{root}/trees"
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.in_use = {}
+        self.downloads = 0
+        self.not_modified = 0
+        self.hits = 0
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.trees_dir, exist_ok=True)
+
+    def acquire(self, url, registry_path, owner, repo, version, immutable):
+        """
+        Get extracted chart, downloading it if necessary. Chart must be released after use
+        :param url: url to download chart archive from
+        :param registry_path: registry path (without credentials)
+        :param owner: chart owner
+        :param repo: chart repo
+        :param version: chart version
+        :param immutable: if True - chart with this version never changes and cached chart is used without revalidation
+        :return: (path to extracted tree, 0) in case of success, (error message, 1) otherwise
+        """
+        key = hashlib.sha256(f"{registry_path}|{owner}|{repo}|{version}".encode("utf-8")).hexdigest()
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            entry = self.__read_entry(key)
+            tree = f"{self.trees_dir}/{entry['digest']}" if entry else None
+            if tree and immutable and self.__use(tree):
+                self.hits += 1
+                return tree, 0
+            while True:
+                headers = {}
+                if tree and entry.get("etag") and os.path.isdir(tree):
+                    headers["If-None-Match"] = entry["etag"]
+                with http_client.get(url, headers=headers, timeout=CHART_DOWNLOAD_TIMEOUT_SEC, stream=True) as r:
+                    if r.status_code == 304 and headers:
+                        if self.__use(tree):
+                            self.not_modified += 1
+                            return tree, 0
+                        # tree was evicted while it was revalidated, download it again
+                        tree = None
+                        continue
+                    if r.status_code != 200:
+                        return f"Failed to find artifact {owner}/{repo}-{version} in {registry_path}", 1
+                    self.downloads += 1
+                    digest, tree = self.__extract(r)
+                break
+            self.__write_entry(key, {"registry": registry_path, "owner": owner, "repo": repo, "version": version,
+                                     "etag": r.headers.get("ETag"), "digest": digest})
+        self.__evict()
+        return tree, 0
+
+    def release(self, tree):
+        with self.lock:
+            self.in_use[tree] = self.in_use.get(tree, 1) - 1
+            if self.in_use[tree] <= 0:
+                self.in_use.pop(tree)
+
+    def stats(self):
+        return {"hits": self.hits, "not_modified": self.not_modified, "downloads": self.downloads,
+                "in_use": len(self.in_use)}
+
+    def __use(self, tree):
+        """
+        Mark tree in use, it's not evicted until it's released
+        :return: True, False if tree isn't in cache (e.g. it's evicted)
+        """
+        with self.lock:
+            if not os.path.isdir(tree):
+                return False
+            self.in_use[tree] = self.in_use.get(tree, 0) + 1
+        # tree's mtime is used as "last used" time for LRU eviction
+        os.utime(tree)
+        return True
+
+    def __extract(self, response):
+        """
+        Extract chart archive while it's being downloaded. Tree is stored under digest of the archive
+        :return: (digest, path to extracted tree), tree is marked in use
+        """
+        tmp_dir = tempfile.mkdtemp(dir=self.trees_dir, prefix=".tmp-")
+        try:
+            stream = DigestingStream(response)
+            with tarfile.open(fileobj=stream, mode="r|gz") as targz:
+                for member in targz:
+                    self.__check_member(tmp_dir, member)
+                    targz.extract(member, tmp_dir, set_attrs=False)
+            stream.drain()
+            digest = stream.hexdigest()
+            tree = f"{self.trees_dir}/{digest}"
+            self.__set_read_only(tmp_dir)
+            # tree is marked in use as soon as it's in place, eviction can't remove it before it's used
+            with self.lock:
+                try:
+                    os.rename(tmp_dir, tree)
+                    duplicate = False
+                except OSError:
+                    if not os.path.isdir(tree):
+                        raise
+                    # same archive was already extracted (e.g. published under another version, concurrently)
+                    duplicate = True
+                self.in_use[tree] = self.in_use.get(tree, 0) + 1
+            if duplicate:
+                self.__remove_tree(tmp_dir)
+            os.utime(tree)
+            return digest, tree
+        except Exception:
+            self.__remove_tree(tmp_dir)
+            raise
+
+    @staticmethod
+    def __check_member(target_dir, member):
+        target_dir = os.path.realpath(target_dir)
+        member_path = os.path.realpath(os.path.join(target_dir, member.name))
+        if not member_path.startswith(target_dir + os.sep):
+            raise UnsafeArchiveError(f"Archive member {member.name} is outside of target directory")
+        if member.issym() or member.islnk():
+            link_base = os.path.dirname(member_path) if member.issym() else target_dir
+            link_path = os.path.realpath(os.path.join(link_base, member.linkname))
+            if not link_path.startswith(target_dir + os.sep):
+                raise UnsafeArchiveError(f"Archive member {member.name} links outside of target directory")
+        elif not (member.isfile() or member.isdir()):
+            raise UnsafeArchiveError(f"Archive member {member.name} has unsupported type")
+
+    def __evict(self):
+        with self.lock:
+            trees = []
+            total = 0
+            for name in os.listdir(self.trees_dir):
+                path = f"{self.trees_dir}/{name}"
+                if name.startswith(".") or not os.path.isdir(path):
+                    continue
+                size = self.__tree_size(path)
+                total += size
+                trees.append((os.path.getmtime(path), path, size))
+            for (_, path, size) in sorted(trees):
+                if total <= self.max_bytes:
+                    break
+                if path in self.in_use:
+                    continue
+                self.__remove_tree(path)
+                total -= size
+
+    def __read_entry(self, key):
+        try:
+            with open(f"{self.entries_dir}/{key}.json") as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+    def __write_entry(self, key, entry):
+        entry_path = f"{self.entries_dir}/{key}.json"
+        with open(f"{entry_path}.tmp", "w") as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(f"{entry_path}.tmp", entry_path)
+
+    @staticmethod
+    def __tree_size(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for (d, _, files) in os.walk(path) for f in files)
+
+    @staticmethod
+    def __set_read_only(path):
+        for (d, dirs, files) in os.walk(path, topdown=False):
+            for f in files:
+                os.chmod(os.path.join(d, f), 0o444)
+            os.chmod(d, 0o555)
+
+    @staticmethod
+    def __remove_tree(path):
+        for (d, _, _) in os.walk(path):
+            os.chmod(d, 0o755)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+chart_cache = None
+
+
+def get_chart_cache():
+    global chart_cache
+    if chart_cache is None:
+        chart_cache = ChartCache()
+    return chart_cache
@@ -1,23 +1,29 @@
-import base64
 import os
-import sys
-import tarfile
+import shutil
+import tempfile
 import time
 
-import requests
 import yaml
 
-from common.shell import shell_run, create_dirs
+from common.shell import shell_run, create_dirs, StreamingCommand
+from common.kubeconfig_cache import kubeconfig_cache
 from common.vault_api import Vault
+from helm.chart_cache import get_chart_cache
 
 SUPPORTED_VALUES = ("owner", "repo", "namespace")
 DEV_BRANCHES = ("develop", "master")
+# first line of release summary helm prints after installation. With --debug the summary contains computed values
+# and rendered manifests (docker registry token and secrets included), it's not forwarded to job's log
+HELM_SUMMARY_START = "NAME:"
 
 
 class HelmDeployment:
 
-    def __init__(self, logger, helm_values, k8s_cluster_conf, registries):
+    def __init__(self, logger, helm_values, k8s_cluster_conf, registries, cancel_token=None, on_output=None):
         self.logger = logger
+        self.cancel_token = cancel_token
+        # called with every line of helm output as soon as it's printed
+        self.on_output = on_output
         self.k8s_cluster_conf = k8s_cluster_conf
         self.registries = registries
         self.owner = helm_values['owner']
@@ -33,34 +39,41 @@ class HelmDeployment:
         # calculated properties
 
         self.timestamp = round(time.time() * 1000)
-        self.target_path = f'{os.getcwd()}/state/pkg/{self.timestamp}'
-        self.kube_conf_path = f'{os.getcwd()}/state/pkg/{self.timestamp}/kubeconfig'
+        # deployments run in parallel, every one has its own work dir (removed by install_package)
+        create_dirs(f'{os.getcwd()}/state/pkg')
+        self.target_path = tempfile.mkdtemp(dir=f'{os.getcwd()}/state/pkg', prefix=f'{self.timestamp}-')
         self.helm_dir = f'{self.target_path}'
+        self.chart_dir = None
         self.service_role = f"{self.owner}-{self.repo}-role"
         self.cluster_name = k8s_cluster_conf["cluster_name"]
-        create_dirs(self.target_path)
         self.values = {k: v for (k, v) in helm_values.items() if k in SUPPORTED_VALUES}
 
-    def untar_helm_gz(self, helm_tag_gz):
-        self.logger.info(f'Untar helm_tar_gz is: {helm_tag_gz}')
-        targz = tarfile.open(helm_tag_gz, "r:gz")
-        targz.extractall(r"{}".format(self.target_path))
-
     def prepare_package(self):
+        """
+        Get extracted chart from local chart cache, download it from registry if necessary.
+        Chart tree is shared with other deployments and is read-only. It has to be released after use.
+        :return: (path to chart dir, 0) in case of success, (error message, 1) otherwise
+        """
         reg = self.registries.get("helm")
         if reg is None:
             return "No helm registry provided", 1
         helm_reg_url = f'https://{reg["username"]}:{reg["password"]}@{reg["path"]}'
         chart_path = f'{self.owner}/{self.repo}/{self.repo}-{self.helm_version}.tgz'
         url = f'{helm_reg_url}{chart_path}'
-        r = requests.get(url)
-        if r.status_code != 200:
+        # charts built from dev branches are re-published under the same version
+        immutable = not any(self.helm_version.endswith(branch) for branch in DEV_BRANCHES)
+        try:
+            tree, err = get_chart_cache().acquire(url, reg["path"], self.owner, self.repo, self.helm_version,
+                                                  immutable)
+        except Exception as ex:
+            return f"Failed to get artifact {chart_path} from {reg['path']}: {ex}", 1
+        if err != 0:
             return f"Failed to find artifact in path {chart_path} or {reg['path']} not available", 1
-        else:
-            return r.content, 0
+        self.chart_dir = tree
+        return f'{tree}/{self.repo}', 0
 
     def enrich_values_yaml(self, env):
-        with open(f"{self.helm_dir}/{self.repo}/values.yaml") as default_values_yaml:
+        with open(f"{self.chart_dir}/{self.repo}/values.yaml") as default_values_yaml:
             actual_values = yaml.load(default_values_yaml, Loader=yaml.FullLoader)
 
         self.logger.info(f"Default values are: {actual_values}")
@@ -110,49 +123,55 @@ class HelmDeployment:
         pkg = f'{self.namespace}/{self.owner}/{self.repo}'
         result_output = list()
         result_output.append(f"{pkg}: Preparing package...")
-        prepare_pkg_result, err = self.prepare_package()
-        if err != 0:
-            result_output.append(f"{pkg}: Preparing package failed: {prepare_pkg_result}")
-            return err, result_output
-        else:
-            helm_tag_gz_path = f'{self.target_path}/{self.repo}.tgz'
-            with open(helm_tag_gz_path, "wb") as helm_archive:
-                helm_archive.write(prepare_pkg_result)
-            self.untar_helm_gz(helm_tag_gz_path)
-
+        try:
+            prepare_pkg_result, err = self.prepare_package()
+            if err != 0:
+                result_output.append(f"{pkg}: Preparing package failed: {prepare_pkg_result}")
+                return err, result_output
+            try:
+                return self.__install_chart(pkg, prepare_pkg_result, result_output)
+            finally:
+                get_chart_cache().release(self.chart_dir)
+        finally:
+            # values file contains secrets (docker token)
+            shutil.rmtree(self.target_path, ignore_errors=True)
+
+    def __install_chart(self, pkg, chart_path, result_output):
         result_output.append(f"{pkg}: Package ready")
 
         kubeconfig_base64 = self.k8s_cluster_conf.get("kube_config")
         if not kubeconfig_base64:
             result_output.append(f"{pkg}: WARNING: No kube ctx. Deploying to default cluster")
-        else:
-            with open(self.kube_conf_path, "w") as kubeconf_file:
-                kubeconf_str = base64.standard_b64decode(kubeconfig_base64.encode("utf-8")).decode("utf-8")
-                kubeconf_file.writelines(kubeconf_str)
 
         # set aws secrets and custom kubeconfig if all secrets are present, otherwise - default cloud wil be used
-        env = {}
-        if all(k in self.k8s_cluster_conf for k in ("aws_region", "aws_access_key", "aws_secret_key")):
-            env = {"KUBECONFIG": self.kube_conf_path,
-                   "AWS_DEFAULT_REGION": self.k8s_cluster_conf.get("aws_region"),
-                   "AWS_ACCESS_KEY_ID": self.k8s_cluster_conf.get("aws_access_key"),
-                   "AWS_SECRET_ACCESS_KEY": self.k8s_cluster_conf.get("aws_secret_key")
-                   }
+        if kubeconfig_base64 and all(k in self.k8s_cluster_conf for k in ("aws_region", "aws_access_key",
+                                                                            "aws_secret_key")):
+            with kubeconfig_cache.kube_env(self.cluster_name, self.k8s_cluster_conf) as env:
+                return self.__helm_upgrade(pkg, chart_path, env, result_output)
+        return self.__helm_upgrade(pkg, chart_path, {}, result_output)
 
+    def __helm_upgrade(self, pkg, chart_path, env, result_output):
         values_path, values_content = self.enrich_values_yaml(env)
 
         # actually call helm install
-        helm_install_cmd = f'helm upgrade -i {self.owner}-{self.repo} {self.helm_dir}/{self.repo} -f {values_path}  ' \
+        helm_install_cmd = f'helm upgrade -i {self.owner}-{self.repo} {chart_path} -f {values_path}  ' \
                            f'-n {self.namespace} --create-namespace --debug'
 
         result_output.append(f"{pkg}: Installing package: {helm_install_cmd}")
-        err_code, cmd_output = shell_run(helm_install_cmd, env)
-        cmd_output = map(lambda s: f"{pkg}: " + s, cmd_output)
+        command = StreamingCommand(helm_install_cmd, env, cancel_token=self.cancel_token)
+        in_summary = False
+        for line in command.lines():
+            in_summary = in_summary or line.startswith(HELM_SUMMARY_START)
+            if self.on_output is not None and not in_summary:
+                self.on_output(f"{pkg}: {line}")
+        err_code = command.returncode
         if err_code == 0:
             result_output.append(f"{pkg}: Release installed successfully ")
+        elif self.on_output is not None:
+            result_output.append(f"{pkg}: Failed to install release. See helm output above")
         else:
             result_output.append(f"{pkg}: Failed to install release. Details:")
-            result_output.extend(cmd_output)
+            result_output.extend(f"{pkg}: {line}" for line in command.tail)
         return err_code, result_output
 
     def __get_tolerations(self):
@@ -171,7 +190,8 @@ class HelmDeployment:
         # get values from helm release
         code, output = shell_run(f"helm -n {self.namespace} get values {self.owner}-{self.repo} -o yaml",
                                  env=env,
-                                 get_stream=True)
+                                 get_stream=True,
+                                 cancel_token=self.cancel_token)
         # fresh installation - result doesn't matter
         if code != 0:
             return True
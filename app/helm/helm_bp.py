@@ -4,7 +4,7 @@ from flask import request, jsonify, Response, abort
 # Blueprint Configuration
 from common.authentication import requires_auth, requires_scope
 from common.job_api import create_job, get_job_status
-from common.log_api import tail_f
+from common.log_api import tail_f, sse_stream, ndjson_stream
 
 HELM_ADMIN_SCOPE = "admin:helm"
 HELM_READ_SCOPE = "read:helm"
@@ -33,16 +33,36 @@ def get_log_api(job_id):
     app.logger.info(f'Request to get_log  is {job_id}')
     if not job_id:
         return abort(400, Response("No job id provided"))
-    return Response(tail_f(job_id))
+    log_format = request.args.get("format")
+    if not log_format:
+        accept = request.headers.get("Accept", "")
+        log_format = "sse" if "text/event-stream" in accept else "ndjson" if "application/x-ndjson" in accept else None
+    if not log_format:
+        return Response(tail_f(job_id))
 
-# TODO: not supported yet (persistence issue)
-# @helm_bp_instance.route('/deploy/status/<job_id>', strict_slashes=False)
+    # resume after the last received event, or from the given line
+    try:
+        last_event_id = request.headers.get("Last-Event-ID")
+        from_seq = int(last_event_id) + 1 if last_event_id else int(request.args.get("from", 0))
+    except ValueError:
+        return abort(400, Response("Last-Event-ID and from must be integers"))
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if log_format == "sse":
+        return Response(sse_stream(job_id, from_seq), mimetype="text/event-stream", headers=headers)
+    if log_format == "ndjson":
+        return Response(ndjson_stream(job_id, from_seq), mimetype="application/x-ndjson", headers=headers)
+    return abort(400, Response(f"Unsupported format: {log_format}. Supported: sse, ndjson"))
+
+@helm_bp_instance.route('/deploy/status/<job_id>', strict_slashes=False)
 # @requires_auth
 def helm_deploy_status(job_id):
     app.logger.info(f'Request to status is {job_id}')
     if not job_id:
         return abort(400, Response("No job id provided"))
-    return get_job_status(job_id)
+    status, err = get_job_status(job_id)
+    if err != 0:
+        return abort(404, Response(status))
+    return jsonify(status)
 
 
 @helm_bp_instance.route('/destroy', methods=['POST'], strict_slashes=False)
@@ -1,53 +1,166 @@
-from threading import Thread
+import os
+import queue
+import time
+from collections import deque
+from threading import Thread, Lock
 
 from common.vault_api import Vault
 from helm.helm_api import HelmDeployment
 
+# Number of releases installed in parallel (across all jobs)
+HELM_WORKERS = int(os.getenv("HELM_WORKERS", 4))
+# Max number of releases installed in parallel in the same cluster/namespace
+HELM_NAMESPACE_CONCURRENCY = int(os.getenv("HELM_NAMESPACE_CONCURRENCY", 2))
+
+
+class NamespaceLane:
+    """
+    Tasks submitted for single cluster/namespace.
+    Tasks start in submission order, at most 'limit' at once, and the same release is never installed twice at once
+    """
+
+    def __init__(self):
+        self.pending = deque()
+        self.running = set()
+
+    def next_task(self, limit):
+        if len(self.running) >= limit:
+            return None
+        for helm_task in self.pending:
+            if helm_task.release not in self.running:
+                self.pending.remove(helm_task)
+                self.running.add(helm_task.release)
+                return helm_task
+        return None
+
+    def is_empty(self):
+        return not self.pending and not self.running
+
 
 class HelmProcessor:
-    def __init__(self, task_queue, completion_dict, logger):
+    def __init__(self, task_queue, logger, workers=HELM_WORKERS, namespace_concurrency=HELM_NAMESPACE_CONCURRENCY):
         self.task_queue = task_queue
-        self.shared_completion_dict = completion_dict
-        self.reader_thread = Thread(target=self._poll_queue)
+        self.job_results = {}
+        self.reader_thread = Thread(target=self._poll_queue, daemon=True)
         self.logger = logger
+        self.namespace_concurrency = namespace_concurrency
+        self.ready_queue = queue.Queue()
+        self.lanes = {}
+        self.lock = Lock()
+        self.worker_threads = [Thread(target=self._work, args=(i,), daemon=True) for i in range(workers)]
+        self.worker_stats = [{"tasks": 0, "busy_sec": 0., "current": None} for _ in range(workers)]
+        self.started_at = time.time()
 
     def start(self):
+        self.started_at = time.time()
+        for worker in self.worker_threads:
+            worker.start()
         self.reader_thread.start()
         return self
 
+    def register_job(self, job_id):
+        """
+        Register job before submitting its tasks
+        :param job_id: job id
+        :return: queue where result of every task of the job is put as soon as the task completes.
+        Helm output lines of running tasks are put there too, as {"output": line}
+        """
+        results = queue.Queue()
+        with self.lock:
+            self.job_results[job_id] = results
+        return results
+
+    def unregister_job(self, job_id):
+        """Stop collecting results of the job. Results of job's tasks that complete later are dropped"""
+        with self.lock:
+            self.job_results.pop(job_id, None)
+
     def submit_deployment(self, helm_task):
-        values = helm_task.helm_values
-        key = f'{values["namespace"]}/{values["owner"]}-{values["repo"]}'
-        self.logger.info(f"Submitting {helm_task.job_id}, {key}")
+        self.logger.info(f"Submitting {helm_task.job_id}, {helm_task.release}")
         self.task_queue.put(helm_task)
 
+    def stats(self):
+        """
+        :return: queue depth (submitted tasks that are not running yet) and utilization of every worker
+        """
+        uptime = max(time.time() - self.started_at, 1e-6)
+        with self.lock:
+            lanes_pending = sum(len(lane.pending) for lane in self.lanes.values())
+            running = sum(len(lane.running) for lane in self.lanes.values())
+            workers = [{"worker": i,
+                        "tasks": s["tasks"],
+                        "busy_sec": round(s["busy_sec"], 3),
+                        "utilization": round(s["busy_sec"] / uptime, 3),
+                        "current": s["current"]} for (i, s) in enumerate(self.worker_stats)]
+        return {"queue_depth": self.task_queue.qsize() + lanes_pending + self.ready_queue.qsize(),
+                "running": running,
+                "namespaces": len(self.lanes),
+                "namespace_concurrency": self.namespace_concurrency,
+                "jobs_awaiting": len(self.job_results),
+                "workers": workers}
+
     def _poll_queue(self):
         while True:
             helm_task = self.task_queue.get()
-            job_id = helm_task.job_id
+            with self.lock:
+                lane = self.lanes.setdefault(helm_task.lane_key, NamespaceLane())
+                lane.pending.append(helm_task)
+                self.__dispatch(lane)
 
-            # actually install helm release
-            helm_result = self.__process_single_deployment(helm_task)
+    def _work(self, worker_id):
+        stats = self.worker_stats[worker_id]
+        while True:
+            helm_task = self.ready_queue.get()
+            started = time.time()
+            stats["current"] = helm_task.release
+            try:
+                # actually install helm release
+                helm_result = self.__process_single_deployment(helm_task)
+                self.__report(helm_task.job_id, helm_result)
+            finally:
+                with self.lock:
+                    stats["current"] = None
+                    stats["tasks"] += 1
+                    stats["busy_sec"] += time.time() - started
+                    lane = self.lanes[helm_task.lane_key]
+                    lane.running.discard(helm_task.release)
+                    self.__dispatch(lane)
+                    if lane.is_empty():
+                        self.lanes.pop(helm_task.lane_key)
 
-            # Report job status to shared memory map. It's up to consumer to keep track of it's size
-            current_services = self.shared_completion_dict.get(job_id, {"services": []}).get("services")
-            # Write access is single threaded so it's safe operation
-            self.shared_completion_dict[job_id] = {"services": current_services + [helm_result]}
+    def __dispatch(self, lane):
+        """Move tasks that may start now from lane to workers. Must be called under self.lock"""
+        helm_task = lane.next_task(self.namespace_concurrency)
+        while helm_task is not None:
+            self.ready_queue.put(helm_task)
+            helm_task = lane.next_task(self.namespace_concurrency)
+
+    def __report(self, job_id, helm_result):
+        # Wake up the job awaiting for results (if it's still waiting)
+        with self.lock:
+            results = self.job_results.get(job_id)
+        if results is not None:
+            results.put(helm_result)
 
     def __process_single_deployment(self, helm_task):
         values = helm_task.helm_values
-        service_key = f'{values["namespace"]}/{values["owner"]}-{values["repo"]}'
+        service_key = helm_task.release
         self.logger.info(f"Job: {helm_task.job_id}, Installing {service_key}")
         helm_result = {"service": service_key, "error_code": 1}
+        if helm_task.cancel_token is not None and helm_task.cancel_token.cancelled:
+            helm_result["log"] = [f"{service_key}: Cancelled"]
+            return helm_result
         try:
             vault = Vault(self.logger, values['owner'], values['repo'], values['cluster'])
             service_role, err_code = vault.create_role()
             if err_code != 0:
-                helm_result["log"] = f'Failed to create role: {service_role}'
+                helm_result["log"] = [f'Failed to create role: {service_role}']
                 return helm_result
 
             vault.prepare_service_path(values.get('base_namespace'), values.get('namespace'))
-            helm_deployment = HelmDeployment(self.logger, values, helm_task.k8_config, helm_task.registry)
+            helm_deployment = HelmDeployment(self.logger, values, helm_task.k8_config, helm_task.registry,
+                                             helm_task.cancel_token,
+                                             lambda line: self.__report(helm_task.job_id, {"output": line}))
             err_code, output = helm_deployment.install_package()
             helm_result["error_code"] = err_code
             helm_result["log"] = output
@@ -57,8 +170,18 @@ class HelmProcessor:
 
 
 class HelmTask:
-    def __init__(self, job_id, helm_values, registry, k8_config):
+    def __init__(self, job_id, helm_values, registry, k8_config, cancel_token=None):
         self.job_id = job_id
         self.helm_values = helm_values
         self.registry = registry
         self.k8_config = k8_config
+        # job's CancellationToken: task is skipped if it's cancelled before start, helm commands are terminated
+        self.cancel_token = cancel_token
+
+    @property
+    def release(self):
+        return f'{self.helm_values["namespace"]}/{self.helm_values["owner"]}-{self.helm_values["repo"]}'
+
+    @property
+    def lane_key(self):
+        return f'{self.helm_values.get("cluster", "")}/{self.helm_values["namespace"]}'
@@ -1,6 +1,8 @@
 import os
+import queue
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 from common.kube_api import KctxApi
 from common.vault_api import Vault
@@ -10,37 +12,66 @@ from helm.registry_api import RegistryApi
 dev_mode = os.getenv("DEV_MODE", False)
 SUPPORTED_HELM_PROPERTIES = (
     "owner", "repo", "image_tag", "env", "namespace", "base_namespace", "cluster", "helm_version")
+# Environments of /helm/list request are queried concurrently, each one within the deadline
+HELM_LIST_WORKERS = int(os.getenv("HELM_LIST_WORKERS", 8))
+HELM_LIST_TIMEOUT_SEC = float(os.getenv("HELM_LIST_TIMEOUT_SEC", 20))
+# Listing of an environment is reused by requests within this time (e.g. dashboard polls)
+HELM_LIST_CACHE_TTL_SEC = float(os.getenv("HELM_LIST_CACHE_TTL_SEC", 10))
 
 
 class HelmService:
 
-    def __init__(self, helm_results, helm_processor):
+    def __init__(self, helm_processor):
         # 10 charts - 1 min for each, plus wait time in case of same namespace parallel installation
         self.TIMEOUT_MIN = 20.
-        self.helm_results = helm_results
         self.helm_processor = helm_processor
+        self.list_executor = ThreadPoolExecutor(max_workers=HELM_LIST_WORKERS, thread_name_prefix="helm-list")
+        # (cluster, namespace) -> (expires at, future with list of services)
+        self.list_snapshots = {}
+        self.list_lock = threading.Lock()
 
-    def __await_helms_installation(self, job_id, expected_services_count):
+    def __await_helms_installation(self, job_ref, results, expected_services_count):
         """
-        Await for job completion and return status
-        :param job_id: job id
+        Await for job completion and return status. Result of every service is written to job log as soon as it arrives
+        :param job_ref: job reference
+        :param results: queue with results of job's services (see HelmProcessor.register_job)
         :param expected_services_count: expected number of services to await for completion
-        :return:
+        :return: {"services": [results of completed services]}
         """
-        end_waiting = datetime.now().timestamp() + self.TIMEOUT_MIN * 60 * 1000
-        curr_status = self.helm_results.get(job_id)
-        while datetime.now().timestamp() <= end_waiting:
-            curr_status = self.helm_results.get(job_id, {"services": []})
-            if expected_services_count != len(curr_status["services"]):
-                time.sleep(1.)
-            else:
-                self.helm_results.pop(job_id)
-                return curr_status
-        self.helm_results.pop(job_id)
-        return curr_status
+        end_waiting = time.monotonic() + self.TIMEOUT_MIN * 60
+        services = []
+        # wake up right away when the job is cancelled
+        unregister = job_ref.cancel_token.on_cancel(lambda: results.put(None))
+        try:
+            while len(services) < expected_services_count:
+                remaining = end_waiting - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    result = results.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if result is None:
+                    job_ref.emit("RUNNING", f'Cancelled with {expected_services_count - len(services)} services '
+                                            f'not completed')
+                    return {"services": services}
+                if "output" in result:
+                    job_ref.emit("RUNNING", result["output"])
+                    continue
+                services.append(result)
+                job_ref.emit_all("RUNNING", result.get("log", ()))
+                job_ref.emit("RUNNING", f'Completed {len(services)}/{expected_services_count}: '
+                                        f'{result.get("service")} '
+                                        f'({"OK" if result.get("error_code", 1) == 0 else "FAILED"})')
+        finally:
+            unregister()
+        if len(services) < expected_services_count:
+            job_ref.emit("RUNNING", f'Timed out after {self.TIMEOUT_MIN} min waiting for '
+                                    f'{expected_services_count - len(services)} services')
+        return {"services": services}
 
     def helm_deploy(self, job_ref, app_logger):
-        if self.helm_results is None or self.helm_processor is None:
+        if self.helm_processor is None:
             return job_ref.complete_err(
                 "Spinless is not initialized properly and can't work with helms. Check Helm task queue initialization")
         try:
@@ -64,20 +95,24 @@ class HelmService:
                 return job_ref.complete_err(k8_contexts)
 
             job_ref.emit("RUNNING", f'Installing {len(helms_input)} helm releases...')
+            results = self.helm_processor.register_job(job_ref.job_id)
             for h_input in helms_input:
                 helm_properties = {k: v for (k, v) in h_input.items() if k in SUPPORTED_HELM_PROPERTIES}
                 registry = {r_type: registries.get(r_type).get(r_name) for (r_type, r_name) in
                             h_input["registry"].items()}
                 k8_config = k8_contexts.get(h_input["cluster"])
 
-                helm_task = HelmTask(job_ref.job_id, helm_properties, registry, k8_config)
+                helm_task = HelmTask(job_ref.job_id, helm_properties, registry, k8_config, job_ref.cancel_token)
                 # Submit tasks to install services
                 self.helm_processor.submit_deployment(helm_task)
 
             # Await for the tasks to complete
-            status = self.__await_helms_installation(job_ref.job_id, len(helms_input))
-            for result in status.get("services", []):
-                job_ref.emit_all("RUNNING", result.get("log", ()))
+            try:
+                status = self.__await_helms_installation(job_ref, results, len(helms_input))
+            finally:
+                self.helm_processor.unregister_job(job_ref.job_id)
+                for (cluster, namespace) in set((h["cluster"], h["namespace"]) for h in helms_input):
+                    self.invalidate_list(cluster, namespace)
             errors = list(filter(lambda s: s.get("error_code", 1) != 0, status.get("services")))
             if len(errors) == 0 and len(status.get("services")) == len(helms_input):
                 job_ref.complete_succ(f'Installed {len(helms_input)}/{len(helms_input)} services')
@@ -98,6 +133,7 @@ class HelmService:
             # destroy namespace
 
             [KctxApi(app_logger).delete_ns(cluster_, namespace) for cluster_ in clusters]
+            [self.invalidate_list(cluster_, namespace) for cluster_ in clusters]
             job_ref.emit("RUNNING", 'Deleted namespace from k8')
 
             for service in services:
@@ -110,24 +146,77 @@ class HelmService:
             job_ref.complete_err(f'Failed to destroy env {namespace}: {str(ex)}')
 
     def helm_list(self, data, app_logger):
+        """
+        Get service versions in environments. Environments are queried concurrently, listing of an environment
+        is reused for HELM_LIST_CACHE_TTL_SEC. Environment that isn't listed within HELM_LIST_TIMEOUT_SEC
+        is returned without services and with "error"
+        :param data: {"environments": [{"cluster": ..., "namespace": ...}]}
+        :param app_logger: logger
+        :return: ([{"cluster", "namespace", "services"}], 0) in case of success, (err message, 1) otherwise
+        """
         envs = data.get("environments", [])
         try:
             app_logger.info(f'Getting versions of environments={envs}')
+            listings = [(env.get("cluster"), env.get("namespace"),
+                         self.__list_environment(env.get("cluster"), env.get("namespace"), app_logger))
+                        for env in envs]
+            deadline = time.monotonic() + HELM_LIST_TIMEOUT_SEC
             service_versions = []
-            for environment in envs:
-                cluster = environment.get("cluster")
-                namespace = environment.get("namespace")
-                res, code = KctxApi(app_logger).get_services_by_namespace(cluster, namespace)
-                if code == 0:
-                    service_versions.append({"cluster": cluster, "namespace": namespace, "services": res})
-                else:
-                    app_logger.warn(res)
-                    service_versions.append({"cluster": cluster, "namespace": namespace, "services": []})
+            for (cluster, namespace, listing) in listings:
+                env_versions = {"cluster": cluster, "namespace": namespace, "services": []}
+                try:
+                    env_versions["services"] = listing.result(timeout=max(deadline - time.monotonic(), 0))
+                except TimeoutError:
+                    app_logger.warn(f"Timed out listing services in {cluster}/{namespace}")
+                    env_versions["error"] = f"Timed out after {HELM_LIST_TIMEOUT_SEC} sec"
+                except Exception as ex:
+                    app_logger.warn(str(ex))
+                service_versions.append(env_versions)
             return service_versions, 0
         except Exception as ex:
             app_logger.error(str(ex))
             return str(ex), 1
 
+    def invalidate_list(self, cluster, namespace):
+        with self.list_lock:
+            self.list_snapshots.pop((cluster, namespace), None)
+
+    def __list_environment(self, cluster, namespace, app_logger):
+        """
+        :return: future with services of the environment, shared with other requests while it's running or fresh
+        """
+        key = (cluster, namespace)
+        with self.list_lock:
+            now = time.monotonic()
+            snapshot = self.list_snapshots.get(key)
+            if snapshot is not None:
+                (expires_at, listing) = snapshot
+                failed = listing.done() and listing.exception() is not None
+                if (expires_at is None and not failed) or (expires_at is not None and now < expires_at):
+                    return listing
+            self.list_snapshots = {k: v for (k, v) in self.list_snapshots.items() if v[0] is None or now < v[0]}
+            listing = self.list_executor.submit(self.__get_services, cluster, namespace, app_logger)
+            self.list_snapshots[key] = (None, listing)
+        listing.add_done_callback(lambda f: self.__listing_done(key, f))
+        return listing
+
+    def __listing_done(self, key, listing):
+        with self.list_lock:
+            snapshot = self.list_snapshots.get(key)
+            if snapshot is None or snapshot[1] is not listing:
+                return
+            if listing.exception() is None:
+                self.list_snapshots[key] = (time.monotonic() + HELM_LIST_CACHE_TTL_SEC, listing)
+            else:
+                self.list_snapshots.pop(key)
+
+    @staticmethod
+    def __get_services(cluster, namespace, app_logger):
+        res, code = KctxApi(app_logger).get_services_by_namespace(cluster, namespace)
+        if code != 0:
+            raise Exception(res)
+        return res
+
     def __parse_k8_contexts(self, app_logger, helms_input):
         """
         map cluster -> k8 context for all clusters in request
@@ -1,20 +1,26 @@
 import base64
 import json
+import os
 
 from jinja2 import Environment, FileSystemLoader
 
+from common.dag_executor import DagExecutor, Step
 from common.kube_api import KctxApi
 from common.vault_api import Vault
+from infra.network_allocator import network_allocator, NetworkAllocationError
 
 CLUSTERS_RESOURCE_PATH = "secretv2/scalecube/spinless/resources/cluster"
 INFRA_TEMPLATES_ROOT = "infra/templates"
 RESOURCE_CLUSTER = 'cluster'
+# Max number of cluster post-setup steps running at once
+POST_SETUP_WORKERS = int(os.getenv("POST_SETUP_WORKERS", 6))
 
 
-def compute_properties(logger, creating_resource=True):
+def compute_properties(logger, creating_resource=True, resource_name=None):
     """
     :param creating_resource: if True - means we are going to create resource, and specific logic applies
     :param logger: logger
+    :param resource_name: name of cluster to be created, network_id is leased to it
     :return: cluster config, such as:
     General cluster settings:
     "nebula_cidr_block"
@@ -31,11 +37,11 @@ def compute_properties(logger, creating_resource=True):
     """
     vault = Vault(logger)
     cluster_config = vault.read(CLUSTERS_RESOURCE_PATH)["data"]
-    # Get network_id (for second octet), increase number for new cluster, save for next deployments
+    # network_id (for second octet) is leased to the cluster, ids up to configured network_id are taken already
     if creating_resource:
-        network_id = int(cluster_config["network_id"]) + 1
+        network_id = network_allocator.allocate(vault, resource_name, floor=int(cluster_config["network_id"]))
+        logger.info(f"Network id {network_id} is leased to cluster {resource_name}")
         cluster_config.update({"network_id": str(network_id)})
-        vault.write(CLUSTERS_RESOURCE_PATH, **cluster_config)
     if "reserved_clusters" in cluster_config:
         cluster_config["reserved_clusters"] = tuple(cluster_config["reserved_clusters"].split(":"))
     return cluster_config
@@ -96,64 +102,53 @@ def resource_post_setup(terraform):
                 "AWS_ACCESS_KEY_ID": terraform.account["aws_access_key"],
                 "AWS_SECRET_ACCESS_KEY": terraform.account["aws_secret_key"]
                 }
-    # Apply node auth configmap
-    yield "RUNNING: Applying node auth configmap...", None
-    auth_conf_map_result, msg = terraform.apply_node_auth_configmap(kube_env)
-    if auth_conf_map_result != 0:
-        yield "FAILED: Failed to apply node config map...", auth_conf_map_result
-    else:
-        yield "SUCCESS: Cluster creation and conf setup complete", None
-
-    # Provision Vault
-    vault_prov_res, msg = terraform.kctx_api.provision_vault(terraform.resource_name, terraform.work_dir, kube_env,
-                                                             templates_root=INFRA_TEMPLATES_ROOT)
-    if vault_prov_res != 0:
-        yield f"FAILED: Failed setup vault account in new cluster. Aborting: {msg}", vault_prov_res
-    yield "Vault provisioning complete", None
-
-    # Set up storage
-    storage_res, msg = terraform.kctx_api.setup_storage(kube_env, terraform.work_dir, terraform.resource_name,
-                                                        templates_root=INFRA_TEMPLATES_ROOT)
-    if storage_res != 0:
-        yield "FAILED: Failed to setup storage volume. Aborting: {}".format(msg), storage_res
-    yield "Storage volume set up successfully.", None
-
-    #  Setup cluster autoscaler
-    ca, msg = terraform.kctx_api.setup_ca(kube_env, terraform.resource_name, terraform.account["aws_region"])
-    if ca != 0:
-        yield "Failed to setup cluster autoscaler. Resuming anyway", None
-    else:
-        yield "Cluster autoscaler installed successfully.", None
-
-    # Set up traefik
-    traefik_res, msg = terraform.kctx_api.setup_traefik(kube_env)
-    if traefik_res != 0:
-        yield "Failed to setup traefik. Resuming anyway", None
-    else:
-        yield "Traefik installed successfully.", None
-
-    # Set up ext SNAT
-    snat_res, msg = terraform.kctx_api.setup_ext_snat(kube_env)
-    if snat_res != 0:
-        yield "Failed to setup external SNAT. Resuming anyway", None
-    else:
-        yield "External SNAT installed successfully.", None
-
-    # Set up metrics
-    res, msg = terraform.kctx_api.setup_metrics(kube_env)
-    if res != 0:
-        yield f"FAILED: Failed to setup metrics. Aborting: {msg}", None
-    yield "Metrics installed successfully.", None
-
-    # If deployment was successful, save kubernetes context to vault
-    kube_conf_base64 = base64.standard_b64encode(kube_conf_str.encode("utf-8")).decode("utf-8")
-    terraform.kctx_api.save_aws_context(aws_access_key=terraform.account["aws_access_key"],
-                                        aws_secret_key=terraform.account["aws_secret_key"],
-                                        aws_region=terraform.account["aws_region"],
-                                        kube_cfg_base64=kube_conf_base64,
-                                        cluster_name=terraform.resource_name,
-                                        dns_suffix=terraform.properties['dns_suffix'])
-    yield "Saved cluster config.", None
+    kctx_api = terraform.kctx_api
+
+    def save_context():
+        # If deployment was successful, save kubernetes context to vault
+        kube_conf_base64 = base64.standard_b64encode(kube_conf_str.encode("utf-8")).decode("utf-8")
+        result = kctx_api.save_aws_context(aws_access_key=terraform.account["aws_access_key"],
+                                           aws_secret_key=terraform.account["aws_secret_key"],
+                                           aws_region=terraform.account["aws_region"],
+                                           kube_cfg_base64=kube_conf_base64,
+                                           cluster_name=terraform.resource_name,
+                                           dns_suffix=terraform.properties['dns_suffix'])
+        return (1, result["error"]) if "error" in result else (0, "Saved cluster config.")
+
+    # Cluster add-ons are independent of each other, they are installed concurrently
+    addons = ("autoscaler", "traefik", "external_snat", "metrics")
+    steps = [
+        Step("node_auth_configmap", lambda: _command_result(terraform.apply_node_auth_configmap(kube_env))),
+        Step("vault", lambda: kctx_api.provision_vault(terraform.resource_name, terraform.work_dir, kube_env,
+                                                       templates_root=INFRA_TEMPLATES_ROOT),
+             depends_on=("node_auth_configmap",)),
+        Step("storage", lambda: kctx_api.setup_storage(kube_env, terraform.work_dir, terraform.resource_name,
+                                                       templates_root=INFRA_TEMPLATES_ROOT),
+             depends_on=("node_auth_configmap",)),
+        # both add-ons' charts come from repositories added (and updated) at once, helm's repositories file
+        # doesn't survive concurrent updates
+        Step("helm_repos", lambda: _command_result(kctx_api.setup_helm_repos(kube_env)), fatal=False),
+        Step("autoscaler", lambda: _command_result(kctx_api.setup_ca(kube_env, terraform.resource_name,
+                                                                     terraform.account["aws_region"])),
+             depends_on=("node_auth_configmap", "helm_repos"), fatal=False),
+        Step("traefik", lambda: _command_result(kctx_api.setup_traefik(kube_env)),
+             depends_on=("node_auth_configmap", "helm_repos"), fatal=False),
+        Step("external_snat", lambda: _command_result(kctx_api.setup_ext_snat(kube_env)),
+             depends_on=("node_auth_configmap",), fatal=False),
+        Step("metrics", lambda: _command_result(kctx_api.setup_metrics(kube_env)),
+             depends_on=("node_auth_configmap",), fatal=False),
+        Step("save_cluster_config", save_context, depends_on=("vault", "storage") + addons),
+    ]
+    yield from DagExecutor(steps, max_workers=POST_SETUP_WORKERS).run()
+
+
+def _command_result(command_result):
+    """(err code, output lines) of kubectl/helm command -> (err code, message)"""
+    code, output = command_result
+    if isinstance(output, str):
+        return code, output
+    output = list(output)
+    return code, output[-1] if code != 0 and output else ""
 
 
 def resource_post_destroy(terraform):
@@ -169,3 +164,10 @@ def resource_post_destroy(terraform):
     # If deployment was successful, save kubernetes context to vault
     terraform.kctx_api.delete_kubernetes_context(terraform.resource_name)
     yield "Cleared cluster config.", None
+
+    if terraform.resource_type == RESOURCE_CLUSTER:
+        try:
+            network_id = network_allocator.release(Vault(terraform.logger), terraform.resource_name)
+            yield f"Released network id {network_id} of {terraform.resource_name}", None
+        except NetworkAllocationError as ex:
+            yield f"WARNING: {ex}", None
@@ -4,7 +4,7 @@
 from flask import current_app as app, Blueprint
 from flask import request, jsonify, Response, abort
 
-from common.authentication import requires_account, requires_auth, requires_scope
+from common.authentication import AuthError, requires_account, requires_auth, requires_scope
 from common.job_api import create_job
 
 RESOURCE_READ_SCOPE = "read:resources"
@@ -34,6 +34,23 @@ def create_resource_api():
     return jsonify({'id': job.job_id})
 
 
+@infra_bp_instance.route("/", methods=['GET'], strict_slashes=False)
+@requires_auth
+def list_resources_api():
+    account = request.args.get('account')
+    if not account:
+        return abort(400, Response("Query parameter 'account' is mandatory"))
+    if not requires_scope(RESOURCE_READ_SCOPE):
+        raise AuthError({"code": "no_scope",
+                         "description": f"Listing resources requires '{RESOURCE_READ_SCOPE}' permission"}, 403)
+    requires_account(account)
+    result = service.list_resources(account, request.args.get('type'),
+                                    refresh=request.args.get('refresh', "false").lower() == "true")
+    if "error" in result:
+        return abort(502, Response(result["error"]))
+    return jsonify(result)
+
+
 # TODO: currently disabled
 # @infra_bp_instance.route("/<name>", methods=['DELETE'], strict_slashes=False)
 @requires_auth
@@ -1,10 +1,12 @@
 import base64
 import os
 
+from common.aws_clients import aws_clients
 from common.kube_api import KctxApi
 from common.shell import create_dirs, shell_run
 from common.vault_api import Vault
 from infra.cluster_service import compute_properties, RESOURCE_CLUSTER
+from infra.resource_inventory import resource_inventory
 from infra.terraform_api import Terraform
 
 ACCOUNTS_PATH = "secretv2/scalecube/spinless/accounts"
@@ -86,7 +88,7 @@ class InfrastructureService:
             custom_resource_props = {}
             # Get custom common properties depending on resource_type
             if resource_type == RESOURCE_CLUSTER:
-                custom_resource_props = compute_properties(app_logger)
+                custom_resource_props = compute_properties(app_logger, resource_name=resource_name)
             # Client request may override preconfigured common properties
             resource_properties = {**custom_resource_props, **request.get('properties')}
             resource_properties.update(common_resource_properties)
@@ -96,7 +98,8 @@ class InfrastructureService:
                                   account,
                                   resource_properties,
                                   action="create",
-                                  resource_type=resource_type)
+                                  resource_type=resource_type,
+                                  cancel_token=job_ref.cancel_token)
 
             for (msg, res) in terraform.create_resource():
                 if res is None:
@@ -148,7 +151,8 @@ class InfrastructureService:
                                   account,
                                   properties,
                                   action="destroy",
-                                  resource_type=resource_type)
+                                  resource_type=resource_type,
+                                  cancel_token=job_ref.cancel_token)
 
             for (msg, res) in terraform.destroy_resource():
                 if res is None:
@@ -163,6 +167,26 @@ class InfrastructureService:
         except Exception as ex:
             job_ref.complete_err(f'failed to delete resource. reason {ex}')
 
+    def list_resources(self, account_name, resource_type=None, refresh=False):
+        """
+        List resources of the account in state bucket, served from resource inventory
+        :param account_name: account name
+        :param resource_type: only resources of this type (optional)
+        :param refresh: list the bucket even if inventory is fresh
+        :return: resources in form of {"result": [...]} or {"error": ...}
+        """
+        try:
+            vault = Vault(logger=self.app_logger)
+            account_data = vault.read(f"{ACCOUNTS_PATH}/{account_name}")["data"]
+            bucket = vault.read(COMMON_RESOURCES_PART)["data"]["s3_bucket"]
+            s3_client = aws_clients.client("s3", account_data.get("aws_access_key"), account_data.get("aws_secret_key"),
+                                           role_arn=account_data.get("aws_role_arn"))
+            return {"result": resource_inventory.resources(s3_client, bucket, account_name, resource_type,
+                                                           force=refresh)}
+        except Exception as ex:
+            self.app_logger.error(f"Failed to list resources of {account_name}: {ex}")
+            return {"error": str(ex)}
+
     def list_clusters(self):
         return KctxApi(self.app_logger).get_clusters_list()
 
@@ -0,0 +1,139 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+NETWORK_LEASES_PATH = "secretv2/scalecube/spinless/resources/cluster_network_leases"
+# network_id is the second octet of cluster's CIDR
+NETWORK_ID_MAX = int(os.getenv("NETWORK_ID_MAX", 255))
+NETWORK_ALLOC_RETRIES = int(os.getenv("NETWORK_ALLOC_RETRIES", 5))
+NETWORK_ALLOC_BACKOFF_SEC = float(os.getenv("NETWORK_ALLOC_BACKOFF_SEC", 0.2))
+# Number of latest allocations/releases kept in audit log
+NETWORK_AUDIT_MAX_ENTRIES = int(os.getenv("NETWORK_AUDIT_MAX_ENTRIES", 500))
+
+
+class NetworkAllocationError(Exception):
+    pass
+
+
+class NetworkAllocator:
+    """
+    Leases of network ids to clusters, kept in one Vault secret together with the audit log of changes:
+    {"leases": {cluster name: network id}, "audit": [{"time", "action", "cluster", "network_id"}]}.
+    Cluster keeps its lease until it's destroyed, so creating it again doesn't change its CIDR. Released ids are
+    reused, lowest first. Ids up to 'floor' (legacy network_id counter) belong to clusters created before leases.
+    Secrets engine is KV v1, it has no check-and-set: uniqueness of leases is guaranteed only by the lock of this
+    process, so the service must run as a single replica (see replicas in its chart). Every write is read back,
+    that catches a change written between the write and the read-back (e.g. an edit of the secret by hand), then
+    the change is retried with backoff. It doesn't catch a lost update: two writers that read the table before
+    each other's write both read back their own write intact and may lease the same id
+    """
+
+    def __init__(self, path=NETWORK_LEASES_PATH, max_id=NETWORK_ID_MAX, retries=NETWORK_ALLOC_RETRIES,
+                 backoff_sec=NETWORK_ALLOC_BACKOFF_SEC):
+        self.path = path
+        self.max_id = max_id
+        self.retries = retries
+        self.backoff_sec = backoff_sec
+        self.lock = threading.Lock()
+        self.allocations = 0
+        self.reuses = 0
+        self.releases = 0
+        self.conflicts = 0
+
+    def allocate(self, vault, cluster_name, floor=0):
+        """
+        :param vault: Vault
+        :param cluster_name: cluster to lease network id to
+        :param floor: ids up to it are taken by clusters without leases
+        :raise NetworkAllocationError: if all ids are leased or Vault can't be updated
+        :return: cluster's network id
+        """
+        with self.lock:
+            for _ in self.__attempts():
+                table = self.__try_read(vault)
+                if table is None:
+                    continue
+                if cluster_name in table["leases"]:
+                    self.reuses += 1
+                    return int(table["leases"][cluster_name])
+                leased = {int(network_id) for network_id in table["leases"].values()}
+                network_id = next((i for i in range(floor + 1, self.max_id + 1) if i not in leased), None)
+                if network_id is None:
+                    raise NetworkAllocationError(f"All network ids up to {self.max_id} are leased")
+                table["leases"][cluster_name] = str(network_id)
+                if self.__write(vault, table, "allocate", cluster_name, network_id):
+                    self.allocations += 1
+                    return network_id
+        raise NetworkAllocationError(f"Failed to lease network id to {cluster_name} in {self.retries} attempts")
+
+    def release(self, vault, cluster_name):
+        """
+        Return cluster's network id to the pool
+        :return: released network id, None if cluster had no lease
+        """
+        with self.lock:
+            for _ in self.__attempts():
+                table = self.__try_read(vault)
+                if table is None:
+                    continue
+                if cluster_name not in table["leases"]:
+                    return None
+                network_id = int(table["leases"].pop(cluster_name))
+                if self.__write(vault, table, "release", cluster_name, network_id):
+                    self.releases += 1
+                    return network_id
+        raise NetworkAllocationError(f"Failed to release network id of {cluster_name} in {self.retries} attempts")
+
+    def leases(self, vault):
+        """:return: {cluster name: network id}"""
+        return {name: int(network_id) for (name, network_id) in self.__read(vault)["leases"].items()}
+
+    def audit_log(self, vault):
+        """:return: latest allocations and releases, oldest first"""
+        return self.__read(vault)["audit"]
+
+    def stats(self):
+        return {"allocations": self.allocations, "reuses": self.reuses, "releases": self.releases,
+                "conflicts": self.conflicts}
+
+    def __attempts(self):
+        """Yields attempt numbers, sleeping with exponential backoff and jitter before every retry"""
+        for attempt in range(self.retries):
+            if attempt > 0:
+                time.sleep(random.uniform(0.5, 1) * self.backoff_sec * 2 ** (attempt - 1))
+            yield attempt
+
+    def __try_read(self, vault):
+        """:return: lease table, None if it can't be read now"""
+        try:
+            return self.__read(vault)
+        except Exception as ex:
+            print(f"Failed to read network leases: {ex}")
+            return None
+
+    def __read(self, vault):
+        secret = vault.read(self.path)
+        data = (secret or {}).get("data") or {}
+        return {"leases": dict(data.get("leases") or {}), "audit": list(data.get("audit") or [])}
+
+    def __write(self, vault, table, action, cluster_name, network_id):
+        """:return: True if change is written and read back intact, False if it has to be retried"""
+        entry = {"time": datetime.now(timezone.utc).isoformat(), "action": action, "cluster": cluster_name,
+                 "network_id": network_id}
+        audit = (table["audit"] + [entry])[-NETWORK_AUDIT_MAX_ENTRIES:]
+        try:
+            vault.write(self.path, leases=table["leases"], audit=audit)
+            written = self.__read(vault)
+        except Exception as ex:
+            print(f"Failed to {action} network id {network_id} of {cluster_name}: {ex}")
+            return False
+        if written["leases"] != table["leases"] or entry not in written["audit"]:
+            # somebody else has written the table between the write and the read-back
+            self.conflicts += 1
+            return False
+        return True
+
+
+network_allocator = NetworkAllocator()
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+import yaml
+
+# Index of account is served from memory within this period after its listing, then bucket is listed again
+RESOURCE_INVENTORY_SYNC_INTERVAL_SEC = int(os.getenv("RESOURCE_INVENTORY_SYNC_INTERVAL_SEC", 60))
+STATE_FILE = "terraform.tfstate"
+TFVARS_FILE = "resource.tfvars"
+INFO_FILE = "resource_info.yaml"
+
+
+class AccountIndex:
+    """Resources of one account in a state bucket, as of the last listing"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # monotonic time of the last listing, None if index has to be synced
+        self.synced_at = None
+        # "type/name" -> resource entry
+        self.resources = {}
+        # key of resource_info.yaml -> (ETag, parsed content)
+        self.infos = {}
+
+
+class ResourceInventory:
+    """
+    Index of resources in terraform state buckets: account/type/name -> state size, last modification, module
+    version (from resource_info.yaml) and tfvars digest (ETag of resource.tfvars).
+    Account's index is synced with one paged listing of its prefix (objects are laid out as
+    {account}/{type}/{name}/{file}), resource_info.yaml is downloaded only when its ETag changes
+    """
+
+    def __init__(self, sync_interval_sec=RESOURCE_INVENTORY_SYNC_INTERVAL_SEC):
+        self.sync_interval_sec = sync_interval_sec
+        self.lock = threading.Lock()
+        # (bucket, account) -> AccountIndex
+        self.indexes = {}
+        self.syncs = 0
+        self.pages = 0
+        self.info_downloads = 0
+        self.hits = 0
+
+    def resources(self, s3_client, bucket, account, resource_type=None, force=False):
+        """
+        :param s3_client: client with access to the bucket
+        :param bucket: state bucket
+        :param account: account name
+        :param resource_type: only resources of this type (optional)
+        :param force: list the bucket even if index is fresh
+        :return: resource entries sorted by type and name
+        """
+        index = self.__sync(s3_client, bucket, account, force)
+        return [index.resources[key] for key in sorted(index.resources)
+                if resource_type is None or index.resources[key]["type"] == resource_type]
+
+    def state_size(self, s3_client, bucket, account, resource_type, name, force=False):
+        """
+        :param force: list the bucket even if index is fresh
+        :return: size of resource's terraform state, None if resource has no state
+        """
+        index = self.__sync(s3_client, bucket, account, force)
+        resource = index.resources.get(f"{resource_type}/{name}")
+        return resource["state_size"] if resource else None
+
+    def invalidate(self, bucket, account):
+        """Resources of the account have been changed, next request lists the bucket again"""
+        with self.lock:
+            index = self.indexes.get((bucket, account))
+        if index is not None:
+            index.synced_at = None
+
+    def stats(self):
+        with self.lock:
+            indexes = list(self.indexes.values())
+        return {"accounts": len(indexes), "resources": sum(len(index.resources) for index in indexes),
+                "syncs": self.syncs, "pages": self.pages, "info_downloads": self.info_downloads, "hits": self.hits}
+
+    def __sync(self, s3_client, bucket, account, force):
+        with self.lock:
+            index = self.indexes.setdefault((bucket, account), AccountIndex())
+        with index.lock:
+            if not force and index.synced_at is not None and \
+                    time.monotonic() - index.synced_at < self.sync_interval_sec:
+                self.hits += 1
+                return index
+            started = time.monotonic()
+            objects = {}
+            for obj in self.__list_objects(s3_client, bucket, f"{account}/"):
+                parts = obj["Key"].split("/")
+                if len(parts) == 4 and parts[3] in (STATE_FILE, TFVARS_FILE, INFO_FILE):
+                    objects.setdefault((parts[1], parts[2]), {})[parts[3]] = obj
+            infos = {}
+            resources = {}
+            for ((resource_type, name), files) in objects.items():
+                info = {}
+                if INFO_FILE in files:
+                    obj = files[INFO_FILE]
+                    info = self.__read_info(s3_client, bucket, obj, index.infos.get(obj["Key"]))
+                    if info is None:
+                        info = {}
+                    else:
+                        infos[obj["Key"]] = (obj["ETag"], info)
+                state = files.get(STATE_FILE)
+                tfvars = files.get(TFVARS_FILE)
+                resources[f"{resource_type}/{name}"] = {
+                    "account": account,
+                    "type": resource_type,
+                    "name": name,
+                    "state_size": state["Size"] if state else None,
+                    "last_modified": max(obj["LastModified"] for obj in files.values()).isoformat(),
+                    "module": info.get("module"),
+                    "module_version": info.get("version"),
+                    "tfvars_digest": tfvars["ETag"].strip('"') if tfvars else None}
+            index.resources = resources
+            index.infos = infos
+            index.synced_at = started
+            self.syncs += 1
+        return index
+
+    def __list_objects(self, s3_client, bucket, prefix):
+        kwargs = {"Bucket": bucket, "Prefix": prefix}
+        while True:
+            response = s3_client.list_objects_v2(**kwargs)
+            self.pages += 1
+            yield from response.get("Contents", [])
+            if not response.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def __read_info(self, s3_client, bucket, obj, cached):
+        """
+        :return: parsed resource_info.yaml, downloaded only if it has changed since the last sync. None if it can't
+        be read, it's retried on the next sync
+        """
+        if cached is not None and cached[0] == obj["ETag"]:
+            return cached[1]
+        try:
+            body = s3_client.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read()
+            self.info_downloads += 1
+            return yaml.safe_load(body) or {}
+        except Exception as ex:
+            print(f"Failed to read {obj['Key']} from {bucket}: {ex}")
+            return None
+
+
+resource_inventory = ResourceInventory()
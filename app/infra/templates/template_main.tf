@@ -1,5 +1,5 @@
 module "{{ module_name }}" {
-  source = "git@github.com:{{ repository }}.git?ref={{ version }}"
+  source = "{{ source }}"
   {% for key in variables %}
   {{ key }} = var.{{ key }}
   {% endfor %}
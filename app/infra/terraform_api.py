@@ -1,20 +1,32 @@
+import hashlib
 import os
 import time
 
-import boto3
+from botocore.exceptions import ClientError
 
-from common.shell import shell_run, create_dirs
+from common.aws_clients import aws_clients
+from common.shell import shell_run, create_dirs, StreamingCommand, CancelledError
 # TODO: pass as parameters from POST request
 from infra.cluster_service import *
+from infra.resource_inventory import resource_inventory
+from infra.terraform_cache import get_terraform_cache, get_plan_cache
 
 INFRA_TEMPLATES_ROOT = "infra/templates"
 KUBECONF_FILE = "kubeconfig"
 BACKEND_FILE = 'backend.tf'
+# terraform reports progress of long operations every 10 sec ("Still creating..."), silence means it's stuck
+TF_IDLE_TIMEOUT_SEC = int(os.getenv("TF_IDLE_TIMEOUT_SEC", 600))
+# Run 'terraform plan' and apply the saved plan only if it has changes (otherwise blind 'apply -auto-approve')
+TF_PLAN_MODE = os.getenv("TF_PLAN_MODE", "true").lower() == "true"
+PLAN_FILE = "plan.tfplan"
 
 
 class Terraform:
-    def __init__(self, logger=None, name=None, account=None, properties=None, action="UNKNOWN", resource_type=None):
+    def __init__(self, logger=None, name=None, account=None, properties=None, action="UNKNOWN", resource_type=None,
+                 cancel_token=None):
         self.logger = logger
+        # CancellationToken of the job, terraform and kubectl commands are terminated when it's cancelled
+        self.cancel_token = cancel_token
         self.resource_name = name
         self.resource_type = resource_type
         self.account = account
@@ -27,7 +39,9 @@ class Terraform:
         create_dirs(self.work_dir)
         self.kube_config_file_path = f"{self.work_dir}/{KUBECONF_FILE}"
         self.templates = Environment(loader=FileSystemLoader("infra/templates"), trim_blocks=True)
-        self.kctx_api = KctxApi(logger)
+        self.kctx_api = KctxApi(logger, cancel_token)
+        # commit of terraform module (see TerraformCache.module_revision), None if module isn't from local mirror
+        self.module_revision = None
 
         # cluster state properties
         self.tf_dynamodb_table = properties['tf_dynamodb_table']  # dynamodb table used to lock states
@@ -53,21 +67,24 @@ class Terraform:
                                                                            self.resource_name,
                                                                            self.properties)
         yield "New resource is being created. Generated tf vars", None
-        self.__generate_tf_configs(variables)
+        yield from self.__prepare_work_dir(variables)
+
+        plan_key = self.__plan_key(aws_vars_path, resource_vars_path) if TF_PLAN_MODE else None
+        # resource was applied and set up with the same inputs. Plan is run anyway, it detects drift of resources
+        set_up = bool(plan_key) and (get_plan_cache().get(plan_key) or {}).get("complete", False)
 
         # Terraform init
         yield "RUNNING: Initializing terraform...", None
         # Attention to "cwd=" that's important to work in same directory (/tmp/...)
-        err, outp = shell_run("terraform init -no-color", cwd=self.work_dir, timeout=300)
-        for s in outp:
-            yield f"Terraform init: {s}", None
+        err = yield from self.__stream("terraform init -no-color", "Terraform init", timeout=300)
         if err != 0:
             yield f"FAILED: Failed to init terraform in dir {self.work_dir}", err
         else:
             yield "RUNNING: Terraform init complete", None
 
         # Need to have same exact variables.tf in parent dir, as in module
-        shell_run(f"cp {self.work_dir}/.terraform/modules/{self.resource_name}/variables.tf {self.work_dir}/")
+        shell_run(f"cp {self.work_dir}/.terraform/modules/{self.resource_name}/variables.tf {self.work_dir}/",
+                  cancel_token=self.cancel_token)
 
         yield "Saving resource parameters to S3...", None
         result = self.__save_resource_to_s3(resource_vars_path)
@@ -78,11 +95,34 @@ class Terraform:
 
         # Terraform apply
         _cmd_apply = f"terraform apply -no-color -var-file={aws_vars_path} -var-file={resource_vars_path} -auto-approve"
-        yield f"RUNNING: Actually CREATING resource. This may take time... {_cmd_apply}", None
-        err_code_apply, outp = shell_run(_cmd_apply, cwd=self.work_dir, timeout=2000)
-        for s in outp:
-            self.logger.info(s)
-            yield f"Terraform apply: {s}", None
+        has_changes = True
+        if TF_PLAN_MODE:
+            _cmd_plan = f"terraform plan -no-color -input=false -detailed-exitcode -out={PLAN_FILE}" \
+                        f" -var-file={aws_vars_path} -var-file={resource_vars_path}"
+            yield f"RUNNING: Planning changes... {_cmd_plan}", None
+            err_code_plan = yield from self.__stream(_cmd_plan, "Terraform plan", timeout=900)
+            # -detailed-exitcode: 0 - no changes, 2 - there are changes, 1 - error
+            if err_code_plan not in (0, 2):
+                yield "FAILED: Failed to plan resource changes", err_code_plan
+            has_changes = err_code_plan == 2
+            set_up = set_up and not has_changes
+            if plan_key:
+                get_plan_cache().put(plan_key, has_changes, complete=set_up, plan=f"{self.work_dir}/{PLAN_FILE}")
+            # saved plan is applied exactly as planned, variables are in it
+            _cmd_apply = f"terraform apply -no-color -input=false {PLAN_FILE}"
+
+        if set_up:
+            yield f"RUNNING: Resource is up to date with this configuration (plan {plan_key[:12]}), skipping", None
+            yield "success", 0
+            return
+        if not has_changes:
+            err_code_apply = 0
+            yield "RUNNING: Terraform plan has no changes, skipping apply", None
+        else:
+            yield f"RUNNING: Actually CREATING resource. This may take time... {_cmd_apply}", None
+            err_code_apply = yield from self.__stream(_cmd_apply, "Terraform apply", timeout=2000)
+            # apply (even failed one) writes terraform.tfstate, destroy removes resources from it
+            resource_inventory.invalidate(self.tf_s3_bucket_name, self.account_name)
         self.logger.info(f"Terraform finished resource creation. Errcode: {err_code_apply}")
         if err_code_apply != 0:
             yield "FAILED: Failed to create resource", None
@@ -90,9 +130,8 @@ class Terraform:
             _cmd_destroy = f"terraform destroy -no-color" \
                            f" -var-file={aws_vars_path} -var-file={resource_vars_path} -auto-approve"
             yield f"RUNNING: DESTROYING partially created resource. This may take time... {_cmd_destroy}", None
-            err_code_destroy, outp = shell_run(_cmd_destroy, cwd=self.work_dir, timeout=2000)
-            for s in outp:
-                self.logger.info(s)
+            err_code_destroy = yield from self.__stream(_cmd_destroy, "Terraform destroy", timeout=2000)
+            resource_inventory.invalidate(self.tf_s3_bucket_name, self.account_name)
             self.logger.info(f"Terraform destroy complete. Errcode: {err_code_destroy}")
             yield "FAILED: Failed to create resource", err_code_apply
         else:
@@ -107,6 +146,10 @@ class Terraform:
                     else:
                         yield msg, status
                 yield msg, status
+        complete_key = self.__plan_key(aws_vars_path, resource_vars_path) if TF_PLAN_MODE else None
+        if complete_key:
+            # next run with the same inputs (state has changed if plan was applied) skips setup if plan is empty
+            get_plan_cache().put(complete_key, False, complete=True)
         yield "success", 0
 
     def destroy_resource(self):
@@ -122,29 +165,27 @@ class Terraform:
         if self.resource_type == RESOURCE_CLUSTER:
             aws_vars_path, _, aws_vars = props_to_tfvars(self.work_dir, self.account, self.resource_name)
 
-        self.__generate_tf_configs(aws_vars + list(resource_vars.keys()))
+        yield from self.__prepare_work_dir(aws_vars + list(resource_vars.keys()))
 
         # Terraform init
         _cmd_init = f"terraform init -no-color"
         yield "RUNNING: Initializing terraform...", None
         # Attention to "cwd=" that's important to work in same directory (/tmp/...)
-        err, outp = shell_run(_cmd_init, cwd=self.work_dir, timeout=300)
-        for s in outp:
-            yield f"Terraform init: {s}", None
+        err = yield from self.__stream(_cmd_init, "Terraform init", timeout=300)
         if err != 0:
             yield f"FAILED: Failed to init terraform in dir {self.work_dir}", err
         else:
             yield "RUNNING: Terraform init complete", None
 
-        shell_run(f"cp {self.work_dir}/.terraform/modules/{self.resource_name}/variables.tf {self.work_dir}/")
+        shell_run(f"cp {self.work_dir}/.terraform/modules/{self.resource_name}/variables.tf {self.work_dir}/",
+                  cancel_token=self.cancel_token)
 
         _cmd_destroy = f"terraform destroy -no-color" \
                        f" -var-file={aws_vars_path} -var-file={resource_vars_path} -auto-approve"
         yield f"RUNNING: Actually DESTROYING resources. This may take time... {_cmd_destroy}", None
-        err_code_destroy, outp = shell_run(_cmd_destroy, cwd=self.work_dir, timeout=2000)
-        for s in outp:
-            self.logger.info(s)
-            yield f"Terraform destroy: {s}", None
+        err_code_destroy = yield from self.__stream(_cmd_destroy, "Terraform destroy", timeout=2000)
+        # terraform.tfstate is rewritten by destroy
+        resource_inventory.invalidate(self.tf_s3_bucket_name, self.account_name)
         self.logger.info(f"Terraform destroy complete. Errcode: {err_code_destroy}")
         if err_code_destroy != 0:
             yield "FAILED: Failed to destroy cluster", err_code_destroy
@@ -165,6 +206,18 @@ class Terraform:
 
         yield "success", 0
 
+    def __stream(self, cmd, prefix, timeout):
+        """
+        Run terraform command in work dir, its output lines are yielded as they are printed
+        :return: exit code of the command
+        """
+        command = StreamingCommand(cmd, env=get_terraform_cache().env(), cwd=self.work_dir, timeout=timeout,
+                                   idle_timeout=TF_IDLE_TIMEOUT_SEC, cancel_token=self.cancel_token)
+        for line in command.lines():
+            self.logger.info(line)
+            yield f"{prefix}: {line}", None
+        return command.returncode
+
     def __read_environment(self):
         """
         Checks if terraform.state exists
@@ -173,7 +226,9 @@ class Terraform:
         """
         try:
             # check if state exists:
-            if self._s3_key_exists(f"{self.s3_path}/terraform.tfstate") is None:
+            # state may have been written or removed by another job (or process) since the last listing
+            if resource_inventory.state_size(self.s3_client, self.tf_s3_bucket_name, self.account_name,
+                                             self.resource_type, self.resource_name, force=True) is None:
                 return False, False
             # download variables (if fails - return False
             f_name = f'{self.work_dir}/resource.tfvars'
@@ -188,18 +243,6 @@ class Terraform:
             self.logger.error(e)
             return False, False
 
-    def _s3_key_exists(self, key):
-        """
-        return the key's size if it exist, else None
-        """
-        response = self.s3_client.list_objects_v2(
-            Bucket=self.tf_s3_bucket_name,
-            Prefix=key,
-        )
-        for obj in response.get('Contents', []):
-            if obj['Key'] == key:
-                return obj['Size']
-
     def __generate_backend_tf(self):
         f_name = f"{self.work_dir}/{BACKEND_FILE}"
         with open(f_name, "w") as file:
@@ -214,23 +257,72 @@ class Terraform:
             file.write(gen_template)
         return f_name
 
-    def __generate_tf_configs(self, all_variables):
+    def __prepare_work_dir(self, all_variables):
+        """
+        Generate main.tf with module installed from local mirror, seed work dir from terraform cache
+        (see TerraformCache). If cache isn't available, module is installed from GitHub by 'terraform init'
+        """
+        try:
+            cache = get_terraform_cache()
+            source, err = cache.module_source(self.tf_repository, self.tf_repository_version, self.cancel_token)
+            if err != 0:
+                yield f"RUNNING: Module mirror is not available, installing module from GitHub: {source}", None
+                self.__generate_tf_configs(all_variables)
+                return
+            self.__generate_tf_configs(all_variables, source)
+            self.module_revision = cache.module_revision(source)
+            msg, err = cache.seed(self.work_dir, self.resource_name, self.tf_repository, self.tf_repository_version,
+                                  source, self.cancel_token)
+            yield f"RUNNING: {msg}" if err == 0 else f"RUNNING: Work dir is not seeded from cache: {msg}", None
+        except CancelledError:
+            raise
+        except Exception as ex:
+            self.logger.error(f"Terraform cache failed: {ex}")
+            yield f"RUNNING: Terraform cache is not available, installing module from GitHub: {ex}", None
+            self.__generate_tf_configs(all_variables)
+
+    def __plan_key(self, *var_files):
+        """
+        Hash of everything 'terraform plan' depends on: generated configuration, variables, module revision and
+        version (ETag) of remote state
+        :return: hash, None if module revision or state version is unknown
+        """
+        state_version = self.__state_version()
+        if not self.module_revision or state_version is None:
+            return None
+        digest = hashlib.sha256(f"{self.module_revision}|{state_version}".encode("utf-8"))
+        for path in (f"{self.work_dir}/main.tf", f"{self.work_dir}/{BACKEND_FILE}", *var_files):
+            if path and os.path.isfile(path):
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+        return digest.hexdigest()
+
+    def __state_version(self):
+        """:return: ETag of remote state, "none" if there is no state, None if it can't be checked"""
+        try:
+            return self.s3_client.head_object(Bucket=self.tf_s3_bucket_name,
+                                              Key=f"{self.s3_path}/terraform.tfstate")["ETag"]
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return "none"
+            self.logger.warn(f"Failed to get version of terraform state: {ex}")
+            return None
+
+    def __generate_tf_configs(self, all_variables, source=None):
         f_name = f"{self.work_dir}/main.tf"
+        if source is None:
+            source = f"git@github.com:{self.tf_repository}.git?ref={self.tf_repository_version}"
         with open(f_name, "w") as file:
             gen_template = self.templates.get_template('template_main.tf').render(
                 module_name=self.resource_name,
-                repository=self.tf_repository,
-                version=self.tf_repository_version,
+                source=source,
                 variables=all_variables)
             file.write(gen_template)
         return f_name
 
     def generate_configmap(self):
-        client = boto3.client('iam',
-                              region_name=self.account["aws_region"],
-                              aws_access_key_id=self.account["aws_access_key"],
-                              aws_secret_access_key=self.account["aws_secret_key"],
-                              )
+        client = aws_clients.client('iam', self.account["aws_access_key"], self.account["aws_secret_key"],
+                                    region=self.account["aws_region"])
         role_arn = client.get_role(RoleName=f'eks-node-role-{self.resource_name}')['Role']['Arn']
         f_name = f"{self.work_dir}/nodes_cm.yaml"
         with open(f_name, "w") as nodes_cm:
@@ -241,7 +333,7 @@ class Terraform:
     def apply_node_auth_configmap(self, kube_env):
         self.generate_configmap()
         kube_cmd = f"kubectl apply -f {self.work_dir}/nodes_cm.yaml"
-        res, outp = shell_run(kube_cmd, env=kube_env)
+        res, outp = shell_run(kube_cmd, env=kube_env, cancel_token=self.cancel_token)
         if res != 0:
             for s in outp:
                 self.logger.info(s)
@@ -261,6 +353,7 @@ class Terraform:
         try:
             self.s3_client.upload_file(resource_vars_path, self.tf_s3_bucket_name, f"{self.s3_path}/resource.tfvars")
             self.s3_client.upload_file(resource_info_path, self.tf_s3_bucket_name, f"{self.s3_path}/resource_info.yaml")
+            resource_inventory.invalidate(self.tf_s3_bucket_name, self.account_name)
         except Exception as e:
             self.logger.error(e)
             return False
@@ -270,6 +363,7 @@ class Terraform:
         try:
             self.s3_client.delete_object(Bucket=self.tf_s3_bucket_name, Key=f"{self.s3_path}")
             self.s3_client.delete_object(Bucket=self.tf_s3_bucket_name, Key=f"states/{self.resource_name}")
+            resource_inventory.invalidate(self.tf_s3_bucket_name, self.account_name)
         except Exception as e:
             self.logger.error(e)
             return False
@@ -287,17 +381,8 @@ class Terraform:
             self.logger.warn(f"Error while getting keys from variables file: {ex}")
             return None
 
-    def __init_s3_client(self, account):
-        session = boto3.Session(aws_access_key_id=account['aws_access_key'],
-                                aws_secret_access_key=account['aws_secret_key'])
-        sts_client = session.client('sts')
-        temp_credentials = sts_client.assume_role(RoleArn=account['aws_role_arn'],
-                                                  RoleSessionName="name",
-                                                  DurationSeconds=3600)
-
-        session = boto3.Session(
-            aws_access_key_id=temp_credentials['Credentials']['AccessKeyId'],
-            aws_secret_access_key=temp_credentials['Credentials']['SecretAccessKey'],
-            aws_session_token=temp_credentials['Credentials']['SessionToken'])
-
-        return session.client('s3')
+    @staticmethod
+    def __init_s3_client(account):
+        # shared by all Terraform instances of the account, assumed role credentials are refreshed before expiry
+        return aws_clients.client('s3', account['aws_access_key'], account['aws_secret_key'],
+                                  role_arn=account['aws_role_arn'])
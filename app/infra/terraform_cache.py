@@ -0,0 +1,269 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from common.shell import shell_run
+
+TF_CACHE_DIR = os.getenv("TF_CACHE_DIR", f"{os.getcwd()}/state/tf_cache")
+# Where tf_repo (owner/repo) is mirrored from
+TF_MODULE_REMOTE = os.getenv("TF_MODULE_REMOTE", "git@github.com:{tf_repo}.git")
+# Branch refs of module mirror are fetched at most once per this period, tags are fetched once
+TF_MODULE_FETCH_INTERVAL_SEC = int(os.getenv("TF_MODULE_FETCH_INTERVAL_SEC", 300))
+TF_CACHE_INIT_TIMEOUT_SEC = int(os.getenv("TF_CACHE_INIT_TIMEOUT_SEC", 600))
+# Plan results are reused within this period
+TF_PLAN_CACHE_TTL_SEC = int(os.getenv("TF_PLAN_CACHE_TTL_SEC", 7 * 24 * 3600))
+# Name of the module in pre-initialized work dirs, it's renamed to resource name when work dir is seeded
+SEED_MODULE = "seed"
+
+
+class TerraformCache:
+    """
+    Shared cache that makes 'terraform init' of a new work dir local and fast:
+     - provider plugin cache (TF_PLUGIN_CACHE_DIR) shared by all terraform commands
+     - local git mirror of every tf_repo, modules are installed from the mirror instead of GitHub
+     - pre-initialized work dir per tf_repo@tf_repo_version (installed module and providers, lock file).
+       New work dirs are seeded from it with hardlinks, so 'terraform init' only configures backend
+    """
+
+    def __init__(self, root=TF_CACHE_DIR, remote=TF_MODULE_REMOTE):
+        self.root = root
+        self.remote = remote
+        self.plugins_dir = f"{root}/plugins"
+        self.mirrors_dir = f"{root}/mirrors"
+        self.workdirs_dir = f"{root}/workdirs"
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        # mirror path -> time of last fetch
+        self.fetched = {}
+        self.fetches = 0
+        self.seeds = 0
+        self.builds = 0
+        for path in (self.plugins_dir, self.mirrors_dir, self.workdirs_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def env(self):
+        """Environment for terraform commands"""
+        return {"TF_PLUGIN_CACHE_DIR": self.plugins_dir}
+
+    def module_source(self, tf_repo, version, cancel_token=None):
+        """
+        Mirror tf_repo locally, fetching it if version isn't there yet (or version is a branch, see
+        TF_MODULE_FETCH_INTERVAL_SEC). Mirror is used even if GitHub isn't available, as long as it has the version
+        :param tf_repo: github owner/repo with terraform module
+        :param version: tag or branch
+        :return: (module source for main.tf, 0) in case of success, (error message, 1) otherwise
+        """
+        mirror = f"{self.mirrors_dir}/{self.__safe_name(tf_repo)}.git"
+        with self.__key_lock(mirror):
+            if not os.path.isdir(mirror):
+                tmp_dir = tempfile.mkdtemp(dir=self.mirrors_dir, prefix=".tmp-")
+                code, output = shell_run(f"git clone --mirror {self.remote.format(tf_repo=tf_repo)} {tmp_dir}",
+                                         cancel_token=cancel_token)
+                if code != 0:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    return f"Failed to mirror {tf_repo}: {' '.join(output)}", 1
+                os.rename(tmp_dir, mirror)
+                self.fetches += 1
+                self.fetched[mirror] = time.monotonic()
+            elif not self.__is_tag(mirror, version) and \
+                    time.monotonic() - self.fetched.get(mirror, 0) > TF_MODULE_FETCH_INTERVAL_SEC:
+                code, _ = shell_run(f"git --git-dir={mirror} fetch --prune --tags origin",
+                                    cancel_token=cancel_token)
+                # stale mirror is still better than no mirror
+                if code == 0:
+                    self.fetches += 1
+                    self.fetched[mirror] = time.monotonic()
+            if self.__commit(mirror, version) is None:
+                return f"Version {version} not found in {tf_repo}", 1
+        return f"git::file://{mirror}?ref={version}", 0
+
+    def seed(self, work_dir, module_name, tf_repo, version, source, cancel_token=None):
+        """
+        Copy installed module, providers and lock file of pre-initialized work dir (built if necessary) to work_dir
+        :param work_dir: new terraform work dir
+        :param module_name: name of the module in work dir's main.tf
+        :param source: module source returned by module_source
+        :return: (message, 0) in case of success, (error message, 1) otherwise - then init installs everything itself
+        """
+        mirror = source[len("git::file://"):].split("?")[0]
+        template = f"{self.workdirs_dir}/{self.__safe_name(tf_repo)}@{self.__safe_name(version)}"
+        with self.__key_lock(template):
+            commit = self.__commit(mirror, version)
+            seed_info = self.__read_seed_info(template)
+            if seed_info is None or seed_info.get("commit") != commit or seed_info.get("source") != source:
+                err = self.__build(template, source, commit, cancel_token)
+                if err:
+                    return err, 1
+            self.__copy(template, work_dir, module_name)
+            self.seeds += 1
+        return f"Work dir is seeded with {tf_repo}@{version} ({commit[:8]})", 0
+
+    def module_revision(self, source):
+        """
+        :param source: module source returned by module_source
+        :return: commit of the module version in local mirror, None if it's unknown
+        """
+        if not source.startswith("git::file://"):
+            return None
+        (mirror, _, version) = source[len("git::file://"):].partition("?ref=")
+        return self.__commit(mirror, version)
+
+    def stats(self):
+        return {"mirrors": len(os.listdir(self.mirrors_dir)), "workdirs": len(os.listdir(self.workdirs_dir)),
+                "fetches": self.fetches, "builds": self.builds, "seeds": self.seeds}
+
+    def __build(self, template, source, commit, cancel_token):
+        """Initialize template work dir with the module only. :return: error message or None"""
+        tmp_dir = tempfile.mkdtemp(dir=self.workdirs_dir, prefix=".tmp-")
+        with open(f"{tmp_dir}/main.tf", "w") as main_tf:
+            main_tf.write(f'module "{SEED_MODULE}" {{\n  source = "{source}"\n}}\n')
+        code, output = shell_run("terraform init -backend=false -input=false -no-color", env=self.env(), cwd=tmp_dir,
+                                 timeout=TF_CACHE_INIT_TIMEOUT_SEC, cancel_token=cancel_token)
+        if code != 0:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return f"Failed to initialize template work dir: {' '.join(output[-5:])}"
+        with open(f"{tmp_dir}/seed.json", "w") as seed_file:
+            json.dump({"commit": commit, "source": source}, seed_file)
+        shutil.rmtree(template, ignore_errors=True)
+        os.rename(tmp_dir, template)
+        self.builds += 1
+        return None
+
+    def __copy(self, template, work_dir, module_name):
+        """Hardlink template's .terraform into work dir, seed module (and its nested modules) is renamed"""
+        prefix = ".terraform/modules/"
+        os.makedirs(f"{work_dir}/{prefix}", exist_ok=True)
+        for name in os.listdir(f"{template}/.terraform"):
+            if name != "modules":
+                shutil.copytree(f"{template}/.terraform/{name}", f"{work_dir}/.terraform/{name}", symlinks=True,
+                                copy_function=self.__link)
+        with open(f"{template}/{prefix}modules.json") as modules_file:
+            modules = json.load(modules_file)
+        renamed_dirs = {}
+        for module in modules["Modules"]:
+            if module["Key"] == SEED_MODULE or module["Key"].startswith(f"{SEED_MODULE}."):
+                module["Key"] = module_name + module["Key"][len(SEED_MODULE):]
+            if module["Dir"].startswith(prefix):
+                (dir_name, _, rest) = module["Dir"][len(prefix):].partition("/")
+                if dir_name == SEED_MODULE or dir_name.startswith(f"{SEED_MODULE}."):
+                    renamed_dirs[dir_name] = module_name + dir_name[len(SEED_MODULE):]
+                    module["Dir"] = f"{prefix}{renamed_dirs[dir_name]}" + (f"/{rest}" if rest else "")
+        for (dir_name, new_name) in renamed_dirs.items():
+            shutil.copytree(f"{template}/{prefix}{dir_name}", f"{work_dir}/{prefix}{new_name}", symlinks=True,
+                            copy_function=self.__link)
+        with open(f"{work_dir}/{prefix}modules.json", "w") as modules_file:
+            json.dump(modules, modules_file)
+        # lock file is rewritten by init, it's copied not linked
+        if os.path.exists(f"{template}/.terraform.lock.hcl"):
+            shutil.copy2(f"{template}/.terraform.lock.hcl", f"{work_dir}/.terraform.lock.hcl")
+
+    def __key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def __link(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            # other filesystem
+            shutil.copy2(src, dst)
+
+    @staticmethod
+    def __is_tag(mirror, version):
+        code, _ = shell_run(f"git --git-dir={mirror} rev-parse --verify --quiet refs/tags/{version}")
+        return code == 0
+
+    @staticmethod
+    def __commit(mirror, version):
+        code, output = shell_run(f"git --git-dir={mirror} rev-parse --verify --quiet {version}^{{commit}}")
+        return output[0] if code == 0 and output and output[0] else None
+
+    @staticmethod
+    def __read_seed_info(template):
+        try:
+            with open(f"{template}/seed.json") as seed_file:
+                return json.load(seed_file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def __safe_name(name):
+        return re.sub(r"[^A-Za-z0-9._-]", "__", name)
+
+
+class PlanCache:
+    """
+    Results of 'terraform plan' by hash of plan inputs: configuration, variables, module revision and version of
+    remote state. Resource whose setup completed with these inputs is up to date if its plan (always run, resources
+    may drift) has no changes: apply and setup are skipped. Saved plans contain secrets, they stay in job's work dir
+    and are not cached
+    """
+
+    def __init__(self, root=f"{TF_CACHE_DIR}/plans", ttl_sec=TF_PLAN_CACHE_TTL_SEC):
+        self.root = root
+        self.ttl_sec = ttl_sec
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def get(self, key):
+        """:return: {"changes": bool, "complete": bool, "plan": path, "created": time} or None"""
+        try:
+            with open(f"{self.root}/{key}.json") as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if time.time() - entry["created"] > self.ttl_sec:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, changes, complete=False, plan=None):
+        """
+        :param changes: whether plan has changes
+        :param complete: whether the resource is applied and set up with these inputs
+        :param plan: path to saved plan
+        """
+        entry_path = f"{self.root}/{key}.json"
+        with open(f"{entry_path}.tmp", "w") as entry_file:
+            json.dump({"changes": changes, "complete": complete, "plan": plan, "created": time.time()}, entry_file)
+        os.replace(f"{entry_path}.tmp", entry_path)
+        self.__evict()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(os.listdir(self.root))}
+
+    def __evict(self):
+        threshold = time.time() - self.ttl_sec
+        for name in os.listdir(self.root):
+            path = f"{self.root}/{name}"
+            try:
+                if os.path.getmtime(path) < threshold:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+terraform_cache = None
+plan_cache = None
+
+
+def get_terraform_cache():
+    global terraform_cache
+    if terraform_cache is None:
+        terraform_cache = TerraformCache()
+    return terraform_cache
+
+
+def get_plan_cache():
+    global plan_cache
+    if plan_cache is None:
+        plan_cache = PlanCache()
+    return plan_cache
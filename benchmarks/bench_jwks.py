@@ -0,0 +1,113 @@
+"""
+Micro-benchmark of 'requires_auth' decorator against local stub JWKS server.
+
+Compares latency of token validation when JWKS is fetched for every request (previous behaviour)
+and when signing keys are served from JwksCache.
+
+Usage: python benchmarks/bench_jwks.py [requests_count] [jwks_delay_ms]
+Requires packages from requirements.txt ('rsa' generates signing key of the test token)
+"""
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rsa
+from flask import Flask, jsonify
+from jose import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from common import authentication  # noqa: E402
+from common.authentication import requires_auth  # noqa: E402
+
+KID = "bench-key"
+DOMAIN = "bench.auth0.local"
+AUDIENCE = "https://spinless/api"
+
+
+def b64url_uint(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("utf-8")
+
+
+def start_jwks_server(public_key, delay_sec):
+    jwks = json.dumps({"keys": [{"kty": "RSA", "kid": KID, "use": "sig", "alg": "RS256",
+                                 "n": b64url_uint(public_key.n), "e": b64url_uint(public_key.e)}]}).encode("utf-8")
+
+    class JwksHandler(BaseHTTPRequestHandler):
+        requests_served = 0
+
+        def do_GET(self):
+            JwksHandler.requests_served += 1
+            time.sleep(delay_sec)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(jwks)))
+            self.end_headers()
+            self.wfile.write(jwks)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), JwksHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, JwksHandler
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(client, token, count, before_request=None):
+    latencies = []
+    for _ in range(count):
+        if before_request:
+            before_request()
+        started = time.perf_counter()
+        response = client.get("/protected", headers={"Authorization": f"Bearer {token}"})
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.data
+    return latencies
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    delay_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0.
+    public_key, private_key = rsa.newkeys(2048)
+    server, handler = start_jwks_server(public_key, delay_ms / 1000)
+
+    authentication.auth_config = {
+        "auth0_domain": DOMAIN,
+        "auth0_client_identifier": AUDIENCE,
+        "jwks_url": f"http://127.0.0.1:{server.server_port}/.well-known/jwks.json"
+    }
+    token = jwt.encode({"iss": f"https://{DOMAIN}/", "aud": AUDIENCE, "sub": "bench",
+                        "exp": int(time.time()) + 3600},
+                       private_key.save_pkcs1().decode("utf-8"), algorithm="RS256", headers={"kid": KID})
+
+    app = Flask(__name__)
+
+    @app.route("/protected")
+    @requires_auth
+    def protected():
+        return jsonify({"status": "OK"})
+
+    client = app.test_client()
+    cache = authentication.jwks_cache
+    print(f"requests={count} jwks_delay={delay_ms}ms")
+    for name, before_request in (("fetch per request", cache.clear), ("cached jwks", None)):
+        cache.clear()
+        served_before = handler.requests_served
+        latencies = run(client, token, count, before_request)
+        print(f"{name:>18}: p50={percentile(latencies, 50):.3f}ms p99={percentile(latencies, 99):.3f}ms "
+              f"jwks_fetches={handler.requests_served - served_before}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
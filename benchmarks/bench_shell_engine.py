@@ -0,0 +1,72 @@
+"""
+Throughput of many concurrent short commands (like 'kubectl get ...' during cluster setup).
+
+Compares running commands one after another with shell_await (previous behaviour of KctxApi.execute_command),
+a thread per command with shell_await, and ShellEngine.run_many (all commands on the engine's event loop).
+
+Usage: python benchmarks/bench_shell_engine.py [commands_count] [command_duration_ms]
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from common.async_shell import ShellEngine  # noqa: E402
+from common.shell import shell_await  # noqa: E402
+
+
+def kubectl_like(duration_ms):
+    # prints a few lines of output after some "API latency"
+    return ["sh", "-c", f"sleep {duration_ms / 1000}; printf 'NAME STATUS AGE\\ndefault Active 10d\\n'"]
+
+
+def sequential(commands):
+    return [shell_await(cmd, with_output=True) for cmd in commands]
+
+
+def thread_per_command(commands):
+    with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+        return list(executor.map(lambda cmd: shell_await(cmd, with_output=True), commands))
+
+
+def engine(commands):
+    return ShellEngine(max_concurrency=len(commands)).run_many(commands)
+
+
+def measure(name, func, commands):
+    threads_before = threading.active_count()
+    peak_threads = [threads_before]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.005)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    results = func(commands)
+    elapsed = time.perf_counter() - started
+    done.set()
+    sampler.join()
+    assert all(code == 0 for (code, _) in results), name
+    print(f"{name:>20}: {elapsed:.3f}s {len(commands) / elapsed:.1f} commands/s "
+          f"extra_threads={peak_threads[0] - threads_before - 1}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    duration_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 50.
+    commands = [kubectl_like(duration_ms) for _ in range(count)]
+    print(f"commands={count} command_duration={duration_ms}ms")
+    measure("sequential", sequential, commands)
+    measure("thread per command", thread_per_command, commands)
+    measure("asyncio engine", engine, commands)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# application modules are imported relative to 'app' dir (that's how api.py is started)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
@@ -0,0 +1,131 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeVault:
+    """
+    Minimal local Vault: kubernetes login, token renewal and generic KV read/list/write/delete.
+    Counts requests, so tests can check how much traffic Vault gets.
+    """
+
+    def __init__(self, lease_duration=3600, renewable=True):
+        self.lease_duration = lease_duration
+        self.renewable = renewable
+        self.secrets = {}
+        self.valid_tokens = set()
+        self.logins = 0
+        self.renewals = 0
+        self.reads = 0
+        self.lists = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.__handler())
+
+    @property
+    def addr(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def revoke_all(self):
+        with self.lock:
+            self.valid_tokens.clear()
+
+    def __auth(self):
+        return {"auth": {"client_token": f"token-{self.logins}-{self.renewals}",
+                         "lease_duration": self.lease_duration,
+                         "renewable": self.renewable}}
+
+    def __handler(self):
+        vault = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if "list=true" in self.path.lower():
+                    return self.do_LIST()
+                if not self.__authorized():
+                    return
+                path = self.__secret_path()
+                with vault.lock:
+                    vault.reads += 1
+                    data = vault.secrets.get(path)
+                if data is None:
+                    return self.__reply(404, {"errors": []})
+                self.__reply(200, {"data": data})
+
+            def do_LIST(self):
+                if not self.__authorized():
+                    return
+                prefix = self.__secret_path().rstrip("/") + "/"
+                with vault.lock:
+                    vault.lists += 1
+                    keys = sorted({p[len(prefix):].split("/")[0] for p in vault.secrets if p.startswith(prefix)})
+                if not keys:
+                    return self.__reply(404, {"errors": []})
+                self.__reply(200, {"data": {"keys": keys}})
+
+            def do_POST(self):
+                body = self.__body()
+                if self.path.startswith("/v1/auth/kubernetes/login"):
+                    with vault.lock:
+                        vault.logins += 1
+                        response = vault._FakeVault__auth()
+                        vault.valid_tokens.add(response["auth"]["client_token"])
+                    return self.__reply(200, response)
+                if self.path.startswith("/v1/auth/token/renew-self"):
+                    if not self.__authorized():
+                        return
+                    with vault.lock:
+                        vault.renewals += 1
+                    auth = {"client_token": self.headers.get("X-Vault-Token"),
+                            "lease_duration": vault.lease_duration, "renewable": vault.renewable}
+                    return self.__reply(200, {"auth": auth})
+                if not self.__authorized():
+                    return
+                with vault.lock:
+                    vault.secrets[self.__secret_path()] = body
+                self.__reply(204, None)
+
+            def do_PUT(self):
+                self.do_POST()
+
+            def do_DELETE(self):
+                if not self.__authorized():
+                    return
+                with vault.lock:
+                    vault.secrets.pop(self.__secret_path(), None)
+                self.__reply(204, None)
+
+            def __authorized(self):
+                if self.headers.get("X-Vault-Token") in vault.valid_tokens:
+                    return True
+                self.__reply(403, {"errors": ["permission denied"]})
+                return False
+
+            def __secret_path(self):
+                return self.path.split("?")[0][len("/v1/"):]
+
+            def __body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length)) if length else {}
+
+            def __reply(self, code, payload):
+                body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
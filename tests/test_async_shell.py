@@ -0,0 +1,47 @@
+import subprocess
+import threading
+import time
+import unittest
+
+from common.async_shell import ShellEngine
+from common.shell import CancellationToken, CancelledError
+
+
+class ShellEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = ShellEngine(max_concurrency=50)
+
+    def test_stdout_and_stderr_are_collected(self):
+        code, lines = self.engine.run("sh -c 'echo out; echo err >&2; exit 2'")
+        self.assertEqual((2, ["out", "err"]), (code, lines))
+
+    def test_commands_run_concurrently_on_one_thread(self):
+        threads_before = threading.active_count()
+        started = time.monotonic()
+        results = self.engine.run_many([["sh", "-c", f"sleep 0.5; echo {i}"] for i in range(50)])
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([(0, [str(i)]) for i in range(50)], results)
+        # event loop thread only
+        self.assertLessEqual(threading.active_count() - threads_before, 1)
+
+    def test_large_output_on_both_pipes(self):
+        # each stream is far bigger than pipe buffer
+        code, lines = self.engine.run(["sh", "-c", "seq 1 200000; seq 1 200000 >&2"], timeout=30)
+        self.assertEqual((0, 400000), (code, len(lines)))
+
+    def test_timeout_kills_command(self):
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.engine.run("sleep 30", timeout=0.3)
+        self.assertEqual(0, self.engine.stats()["running"])
+
+    def test_cancelled_command(self):
+        token = CancellationToken()
+        threading.Timer(0.3, token.cancel).start()
+        started = time.monotonic()
+        with self.assertRaises(CancelledError):
+            self.engine.run("sleep 30", cancel_token=token)
+        self.assertLess(time.monotonic() - started, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
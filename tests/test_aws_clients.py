@@ -0,0 +1,54 @@
+import datetime
+import unittest
+
+from botocore.stub import Stubber
+
+from common.aws_clients import AwsClientPool
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/spinless"
+
+
+def assume_role_response(access_key, expires_in_sec):
+    expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=expires_in_sec)
+    return {"Credentials": {"AccessKeyId": access_key, "SecretAccessKey": "secret", "SessionToken": "token",
+                            "Expiration": expiration}}
+
+
+class AwsClientPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = AwsClientPool(max_accounts=2)
+
+    def test_clients_shared_per_account_service_and_region(self):
+        s3 = self.pool.client("s3", "key", "secret")
+        self.assertIs(s3, self.pool.client("s3", "key", "secret"))
+        self.assertIsNot(s3, self.pool.client("s3", "key", "other secret"))
+        self.assertIsNot(self.pool.client("eks", "key", "secret", region="eu-west-1"),
+                         self.pool.client("eks", "key", "secret", region="us-east-1"))
+        self.assertEqual({"accounts": 2, "clients": 4, "clients_created": 4, "assume_role_calls": 0},
+                         self.pool.stats())
+
+    def test_least_recently_used_account_dropped(self):
+        first = self.pool.client("s3", "key1", "secret")
+        self.pool.client("s3", "key2", "secret")
+        self.pool.client("s3", "key1", "secret")
+        self.pool.client("s3", "key3", "secret")
+        self.assertIs(first, self.pool.client("s3", "key1", "secret"))
+        self.assertEqual(2, self.pool.stats()["accounts"])
+
+    def test_role_assumed_once_and_refreshed_before_expiry(self):
+        sts = self.pool.client("sts", "key", "secret")
+        with Stubber(sts) as stubber:
+            stubber.add_response("assume_role", assume_role_response("ASIATEMPORARYKEY1", 5 * 60),
+                                 {"RoleArn": ROLE_ARN, "RoleSessionName": "spinless", "DurationSeconds": 3600})
+            stubber.add_response("assume_role", assume_role_response("ASIATEMPORARYKEY2", 3600))
+            s3 = self.pool.client("s3", "key", "secret", role_arn=ROLE_ARN)
+            self.assertIs(s3, self.pool.client("s3", "key", "secret", role_arn=ROLE_ARN))
+            # role isn't assumed until credentials are used
+            self.assertEqual(0, self.pool.stats()["assume_role_calls"])
+            credentials = s3._request_signer._credentials
+            self.assertEqual("ASIATEMPORARYKEY1", credentials.get_frozen_credentials().access_key)
+            # expiring in 5 minutes, refreshed on next use
+            self.assertEqual("ASIATEMPORARYKEY2", credentials.get_frozen_credentials().access_key)
+            self.assertEqual("ASIATEMPORARYKEY2", credentials.get_frozen_credentials().access_key)
+            stubber.assert_no_pending_responses()
+        self.assertEqual(2, self.pool.stats()["assume_role_calls"])
@@ -0,0 +1,188 @@
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from helm.chart_cache import ChartCache, UnsafeArchiveError
+
+
+def chart_archive(repo, values, extra_member=None):
+    buffer = io.BytesIO()
+    members = [(f"{repo}/Chart.yaml", f"name: {repo}\n"), (f"{repo}/values.yaml", values)]
+    if extra_member:
+        members.append((extra_member, "unexpected"))
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for (name, content) in members:
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class ChartRegistry:
+    """Local helm registry serving chart archives with ETag"""
+
+    def __init__(self):
+        self.charts = {}
+        self.requests = []
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                registry.requests.append((self.path, self.headers.get("If-None-Match")))
+                content = registry.charts.get(self.path)
+                if content is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                etag = f'"{hashlib.md5(content).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+
+class ChartCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = ChartRegistry()
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = ChartCache(root=self.cache_dir)
+
+    def tearDown(self):
+        self.registry.server.shutdown()
+        self.registry.server.server_close()
+        for (d, _, _) in os.walk(self.cache_dir):
+            os.chmod(d, 0o755)
+        shutil.rmtree(self.cache_dir)
+
+    def acquire(self, path, version, immutable):
+        return self.cache.acquire(self.registry.url(path), "registry", "owner", "svc", version, immutable)
+
+    def test_immutable_version_downloaded_once(self):
+        self.registry.charts["/svc-1.0.1.tgz"] = chart_archive("svc", "replicas: 1\n")
+        trees = [self.acquire("/svc-1.0.1.tgz", "1.0.1", True) for _ in range(5)]
+
+        self.assertEqual(1, len(self.registry.requests))
+        self.assertEqual(1, len(set(trees)))
+        tree, err = trees[0]
+        self.assertEqual(0, err)
+        with open(f"{tree}/svc/values.yaml") as values:
+            self.assertEqual("replicas: 1\n", values.read())
+        self.assertEqual(0o444, os.stat(f"{tree}/svc/values.yaml").st_mode & 0o777)
+
+    def test_mutable_version_revalidated(self):
+        self.registry.charts["/svc-1.0-develop.tgz"] = chart_archive("svc", "replicas: 1\n")
+        first, _ = self.acquire("/svc-1.0-develop.tgz", "1.0-develop", False)
+        second, _ = self.acquire("/svc-1.0-develop.tgz", "1.0-develop", False)
+        self.registry.charts["/svc-1.0-develop.tgz"] = chart_archive("svc", "replicas: 2\n")
+        third, _ = self.acquire("/svc-1.0-develop.tgz", "1.0-develop", False)
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, third)
+        self.assertIsNotNone(self.registry.requests[1][1])
+        self.assertEqual({"hits": 0, "not_modified": 1, "downloads": 2, "in_use": 2}, self.cache.stats())
+
+    def test_missing_chart(self):
+        message, err = self.acquire("/missing.tgz", "1.0.0", True)
+        self.assertEqual(1, err)
+
+    def test_archive_members_outside_of_tree_rejected(self):
+        self.registry.charts["/evil.tgz"] = chart_archive("svc", "a: 1\n", extra_member="../../escaped.txt")
+
+        with self.assertRaises(UnsafeArchiveError):
+            self.acquire("/evil.tgz", "1.0.0", True)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "escaped.txt")))
+        self.assertEqual([], os.listdir(self.cache.trees_dir))
+
+    def test_large_chart_streamed(self):
+        values = "".join(f"key{i}: {'x' * 64}\n" for i in range(50000))
+        self.registry.charts["/big.tgz"] = chart_archive("svc", values)
+        tree, err = self.acquire("/big.tgz", "1.0.0", True)
+
+        self.assertEqual(0, err)
+        self.assertEqual(hashlib.sha256(self.registry.charts["/big.tgz"]).hexdigest(), os.path.basename(tree))
+        self.assertEqual(len(values), os.path.getsize(f"{tree}/svc/values.yaml"))
+
+    def test_least_recently_used_tree_evicted(self):
+        self.cache.max_bytes = 1
+        self.registry.charts["/a.tgz"] = chart_archive("svc", "a: 1\n")
+        self.registry.charts["/b.tgz"] = chart_archive("svc", "b: 1\n")
+        tree_a, _ = self.acquire("/a.tgz", "a", True)
+        self.cache.release(tree_a)
+        tree_b, _ = self.acquire("/b.tgz", "b", True)
+
+        self.assertFalse(os.path.exists(tree_a))
+        self.assertTrue(os.path.exists(tree_b))
+
+    def test_same_archive_extracted_concurrently(self):
+        self.registry.charts["/svc-1.0.0.tgz"] = self.registry.charts["/svc-1.0.1.tgz"] = \
+            chart_archive("svc", "replicas: 1\n")
+        barrier = threading.Barrier(2, timeout=5)
+        set_read_only = ChartCache._ChartCache__set_read_only
+
+        def set_read_only_together(path):
+            # both archives are extracted before any of them is moved in place
+            barrier.wait()
+            set_read_only(path)
+
+        results = {}
+
+        def acquire(version):
+            results[version] = self.acquire(f"/svc-{version}.tgz", version, True)
+
+        with mock.patch.object(ChartCache, "_ChartCache__set_read_only", staticmethod(set_read_only_together)):
+            threads = [threading.Thread(target=acquire, args=(version,)) for version in ("1.0.0", "1.0.1")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results["1.0.0"], results["1.0.1"])
+        tree, err = results["1.0.0"]
+        self.assertEqual(0, err)
+        self.assertEqual([os.path.basename(tree)], os.listdir(self.cache.trees_dir))
+        self.assertEqual({tree: 2}, self.cache.in_use)
+
+    def test_tree_evicted_before_use_downloaded_again(self):
+        self.registry.charts["/a.tgz"] = chart_archive("svc", "a: 1\n")
+        tree, _ = self.acquire("/a.tgz", "a", True)
+        self.cache.release(tree)
+        self.cache.max_bytes = 1
+        read_entry = self.cache._ChartCache__read_entry
+
+        def read_entry_then_evict(key):
+            entry = read_entry(key)
+            # another deployment's eviction runs meanwhile
+            self.cache._ChartCache__evict()
+            return entry
+
+        with mock.patch.object(self.cache, "_ChartCache__read_entry", read_entry_then_evict):
+            self.assertEqual((tree, 0), self.acquire("/a.tgz", "a", True))
+        self.assertTrue(os.path.isdir(tree))
+        self.assertEqual(2, len(self.registry.requests))
+        self.assertEqual({tree: 1}, self.cache.in_use)
+
+
+if __name__ == '__main__':
+    unittest.main()
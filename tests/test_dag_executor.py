@@ -0,0 +1,64 @@
+import threading
+import time
+import unittest
+
+from common.dag_executor import DagExecutor, Step
+
+
+class DagExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.order = []
+        self.lock = threading.Lock()
+
+    def step(self, name, depends_on=(), fatal=True, duration=0., code=0):
+        def run():
+            time.sleep(duration)
+            with self.lock:
+                self.order.append(name)
+            return code, f"{name} done"
+
+        return Step(name, run, depends_on, fatal)
+
+    def test_independent_steps_run_concurrently(self):
+        steps = [self.step("first"),
+                 *(self.step(f"addon-{i}", depends_on=("first",), duration=0.5) for i in range(4)),
+                 self.step("last", depends_on=tuple(f"addon-{i}" for i in range(4)))]
+        started = time.monotonic()
+        messages = [msg for (msg, code) in DagExecutor(steps).run() if code is None]
+
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual("first", self.order[0])
+        self.assertEqual("last", self.order[-1])
+        self.assertEqual(6, len(self.order))
+        self.assertTrue(any(msg.startswith("addon-0: OK in 0.5s") for msg in messages))
+
+    def test_fatal_failure_skips_dependents(self):
+        steps = [self.step("vault", code=2),
+                 self.step("addon", fatal=False, code=1),
+                 self.step("after_addon", depends_on=("addon",)),
+                 self.step("save", depends_on=("vault", "addon"))]
+        events = list(DagExecutor(steps).run())
+
+        self.assertNotIn("save", self.order)
+        self.assertIn("after_addon", self.order)
+        self.assertIn(("Skipped save: vault failed", None), events)
+        (msg, code) = events[-1]
+        self.assertEqual(2, code)
+        self.assertTrue(msg.startswith("FAILED: Failed steps: vault"))
+
+    def test_exception_fails_step(self):
+        def broken():
+            raise Exception("no cluster")
+
+        events = list(DagExecutor([Step("broken", broken)]).run())
+        self.assertEqual(("FAILED: Failed steps: broken. no cluster", 1), events[-1])
+
+    def test_invalid_dependencies(self):
+        with self.assertRaises(ValueError):
+            DagExecutor([self.step("a", depends_on=("missing",))])
+        with self.assertRaises(ValueError):
+            DagExecutor([self.step("a", depends_on=("b",)), self.step("b", depends_on=("a",))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+import unittest
+from unittest import mock
+
+from common.kube_api import KctxApi
+from helm import helm_service
+from helm.helm_service import HelmService
+
+
+class FakeCluster:
+    """Replacement of KctxApi.get_services_by_namespace with configurable latency"""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_services_by_namespace(self, kctx_api, cluster, namespace):
+        with self.lock:
+            self.calls.append((cluster, namespace))
+        time.sleep(self.delays.get(namespace, 0.))
+        if namespace == "broken":
+            return f"Failed to get list of releases in namespace {namespace}", 1
+        return [{"repo": f"{namespace}-svc", "version": "1.0.0"}], 0
+
+
+class HelmListTest(unittest.TestCase):
+    def setUp(self):
+        self.service = HelmService(None)
+        self.logger = logging.getLogger("test")
+
+    def list(self, cluster_fake, *namespaces):
+        with mock.patch.object(KctxApi, "get_services_by_namespace", autospec=True,
+                               side_effect=cluster_fake.get_services_by_namespace):
+            return self.service.helm_list({"environments": [{"cluster": "c1", "namespace": ns} for ns in namespaces]},
+                                          self.logger)
+
+    def test_environments_listed_concurrently(self):
+        cluster = FakeCluster({f"ns-{i}": 0.3 for i in range(6)})
+        started = time.monotonic()
+        result, err = self.list(cluster, *[f"ns-{i}" for i in range(6)])
+
+        self.assertEqual(0, err)
+        self.assertLess(time.monotonic() - started, 1.)
+        self.assertEqual([f"ns-{i}" for i in range(6)], [env["namespace"] for env in result])
+        self.assertEqual("ns-5-svc", result[5]["services"][0]["repo"])
+
+    def test_slow_environment_returned_partially(self):
+        cluster = FakeCluster({"slow": 2.})
+        with mock.patch.object(helm_service, "HELM_LIST_TIMEOUT_SEC", 0.3):
+            result, err = self.list(cluster, "fast", "slow", "broken")
+
+        self.assertEqual(0, err)
+        self.assertEqual(1, len(result[0]["services"]))
+        self.assertEqual([], result[1]["services"])
+        self.assertIn("error", result[1])
+        self.assertEqual([], result[2]["services"])
+
+    def test_repeated_listing_served_from_snapshot(self):
+        cluster = FakeCluster({})
+        self.list(cluster, "ns-1", "broken")
+        self.list(cluster, "ns-1", "broken")
+        self.assertEqual(1, cluster.calls.count(("c1", "ns-1")))
+        self.assertEqual(2, cluster.calls.count(("c1", "broken")))
+
+        self.service.invalidate_list("c1", "ns-1")
+        self.list(cluster, "ns-1")
+        self.assertEqual(2, cluster.calls.count(("c1", "ns-1")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from common.shell import StreamingCommand
+from helm import helm_api
+from helm.helm_api import HelmDeployment
+from helm.helm_processor import HelmProcessor, HelmTask, NamespaceLane
+
+
+def task(job_id, repo, namespace="ns", cluster="c1"):
+    return HelmTask(job_id, {"owner": "o", "repo": repo, "namespace": namespace, "cluster": cluster}, {}, {})
+
+
+class RecordingProcessor(HelmProcessor):
+    """Processor whose deployment only records how many releases of every namespace run at once"""
+
+    def __init__(self, workers, namespace_concurrency):
+        super().__init__(queue.Queue(), logging.getLogger("test"), workers, namespace_concurrency)
+        self.record_lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+        self.running_releases = set()
+        self.overlapping_releases = []
+        self.started = []
+
+    def _HelmProcessor__process_single_deployment(self, helm_task):
+        with self.record_lock:
+            if helm_task.release in self.running_releases:
+                self.overlapping_releases.append(helm_task.release)
+            self.running_releases.add(helm_task.release)
+            self.started.append((helm_task.job_id, helm_task.release))
+            lane_running = self.running.get(helm_task.lane_key, 0) + 1
+            self.running[helm_task.lane_key] = lane_running
+            self.max_running[helm_task.lane_key] = max(self.max_running.get(helm_task.lane_key, 0), lane_running)
+        time.sleep(0.05)
+        with self.record_lock:
+            self.running[helm_task.lane_key] -= 1
+            self.running_releases.discard(helm_task.release)
+        return {"service": helm_task.release, "error_code": 0, "log": []}
+
+
+class NamespaceLaneTest(unittest.TestCase):
+    def test_tasks_start_in_submission_order_up_to_limit(self):
+        lane = NamespaceLane()
+        lane.pending.extend([task("j1", "a"), task("j1", "b"), task("j1", "c")])
+        self.assertEqual("ns/o-a", lane.next_task(2).release)
+        self.assertEqual("ns/o-b", lane.next_task(2).release)
+        self.assertIsNone(lane.next_task(2))
+        lane.running.discard("ns/o-a")
+        self.assertEqual("ns/o-c", lane.next_task(2).release)
+
+    def test_same_release_waits_for_running_one(self):
+        lane = NamespaceLane()
+        lane.pending.extend([task("j1", "a"), task("j2", "a"), task("j2", "b")])
+        first = lane.next_task(3)
+        # the second "a" is skipped, later release of another service may start
+        self.assertEqual(("j1", "ns/o-a"), (first.job_id, first.release))
+        self.assertEqual("ns/o-b", lane.next_task(3).release)
+        self.assertIsNone(lane.next_task(3))
+        lane.running.discard("ns/o-a")
+        second = lane.next_task(3)
+        self.assertEqual(("j2", "ns/o-a"), (second.job_id, second.release))
+        self.assertFalse(lane.is_empty())
+        lane.running.clear()
+        self.assertTrue(lane.is_empty())
+
+
+class HelmProcessorTest(unittest.TestCase):
+    def test_namespace_concurrency_and_release_exclusion(self):
+        processor = RecordingProcessor(workers=6, namespace_concurrency=2).start()
+        results = processor.register_job("j1")
+        tasks = [task("j1", repo, namespace) for namespace in ("ns1", "ns2") for repo in ("a", "b", "c", "a")]
+        for helm_task in tasks:
+            processor.submit_deployment(helm_task)
+        completed = [results.get(timeout=5) for _ in tasks]
+
+        self.assertEqual(sorted(t.release for t in tasks), sorted(r["service"] for r in completed))
+        self.assertEqual({"c1/ns1": 2, "c1/ns2": 2}, processor.max_running)
+        self.assertEqual([], processor.overlapping_releases)
+        # releases of every namespace start in submission order
+        for namespace in ("ns1", "ns2"):
+            self.assertEqual([f"{namespace}/o-{repo}" for repo in ("a", "b", "c", "a")],
+                             [release for (_, release) in processor.started if release.startswith(namespace)])
+        self.assertEqual(0, processor.stats()["running"])
+
+
+class HelmDeploymentTest(unittest.TestCase):
+    OUTPUT = "\n".join(["upgrade.go:139: [debug] preparing upgrade for o-r",
+                        'Release "o-r" has been upgraded. Happy Helming!',
+                        "NAME: o-r",
+                        "COMPUTED VALUES:",
+                        "dockerjsontoken: c2VjcmV0",
+                        "MANIFEST:",
+                        "kind: Secret"]) + "\n"
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_work_dir_unique_and_removed(self):
+        values = {"owner": "o", "repo": "r", "namespace": "ns", "image_tag": "1.0"}
+        deployments = [HelmDeployment(logging.getLogger("test"), values, {"cluster_name": "c1"}, {})
+                       for _ in range(20)]
+        self.assertEqual(20, len({d.target_path for d in deployments}))
+        # no helm registry, deployment fails before installing
+        err, _ = deployments[0].install_package()
+        self.assertEqual(1, err)
+        self.assertFalse(os.path.exists(deployments[0].target_path))
+        self.assertTrue(os.path.isdir(deployments[1].target_path))
+
+    def test_release_summary_not_streamed(self):
+        lines = []
+        values = {"owner": "o", "repo": "r", "namespace": "ns", "image_tag": "1.0"}
+        deployment = HelmDeployment(logging.getLogger("test"), values, {"cluster_name": "c1"}, {},
+                                    on_output=lines.append)
+        with mock.patch.object(helm_api, "StreamingCommand",
+                               lambda cmd, env, cancel_token: StreamingCommand(["printf", self.OUTPUT])), \
+                mock.patch.object(deployment, "enrich_values_yaml", return_value=("values.yaml", "")):
+            err, output = deployment._HelmDeployment__helm_upgrade("ns/o/r", "chart", {}, [])
+
+        self.assertEqual(0, err)
+        self.assertEqual(["ns/o/r: upgrade.go:139: [debug] preparing upgrade for o-r",
+                          'ns/o/r: Release "o-r" has been upgraded. Happy Helming!'], lines)
+        self.assertFalse(any("dockerjsontoken" in line for line in output))
@@ -0,0 +1,71 @@
+import queue
+import threading
+import time
+import unittest
+
+from common.shell import CancellationToken
+from helm.helm_service import HelmService
+
+
+class RecordingJob:
+    """Job reference that keeps emitted lines"""
+
+    def __init__(self):
+        self.cancel_token = CancellationToken()
+        self.lines = []
+
+    def emit(self, _status, message):
+        self.lines.append(message)
+
+    def emit_all(self, _status, messages):
+        self.lines.extend(messages)
+
+
+def result(service, error_code=0):
+    return {"service": service, "error_code": error_code, "log": [f"{service}: log"]}
+
+
+class AwaitHelmsInstallationTest(unittest.TestCase):
+    def setUp(self):
+        self.service = HelmService(None)
+        self.job = RecordingJob()
+        self.results = queue.Queue()
+
+    def await_installation(self, expected):
+        return self.service._HelmService__await_helms_installation(self.job, self.results, expected)
+
+    def test_results_reported_in_completion_order(self):
+        def complete():
+            self.results.put({"output": "ns/o-b: installing"})
+            self.results.put(result("ns/o-b"))
+            time.sleep(0.05)
+            self.results.put(result("ns/o-a", error_code=1))
+
+        threading.Thread(target=complete).start()
+        status = self.await_installation(2)
+
+        self.assertEqual(["ns/o-b", "ns/o-a"], [s["service"] for s in status["services"]])
+        self.assertEqual(["ns/o-b: installing", "ns/o-b: log", "Completed 1/2: ns/o-b (OK)",
+                          "ns/o-a: log", "Completed 2/2: ns/o-a (FAILED)"], self.job.lines)
+
+    def test_timeout_with_pending_services(self):
+        self.service.TIMEOUT_MIN = 0.3 / 60
+        self.results.put(result("ns/o-a"))
+        started = time.monotonic()
+        status = self.await_installation(3)
+
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(["ns/o-a"], [s["service"] for s in status["services"]])
+        self.assertEqual(f"Timed out after {self.service.TIMEOUT_MIN} min waiting for 2 services", self.job.lines[-1])
+
+    def test_cancel_wakes_up_waiting_job(self):
+        self.results.put(result("ns/o-a"))
+        threading.Timer(0.1, self.job.cancel_token.cancel).start()
+        started = time.monotonic()
+        status = self.await_installation(2)
+
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(["ns/o-a"], [s["service"] for s in status["services"]])
+        self.assertEqual("Cancelled with 1 services not completed", self.job.lines[-1])
+        # wake-up marker is consumed
+        self.assertTrue(self.results.empty())
@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from common.http_client import HttpClient
+
+
+class ScriptedServer:
+    """Local HTTP/1.1 server replying with scripted statuses per path (200 when the script is over)"""
+
+    def __init__(self):
+        self.scripts = {}
+        self.requests = []
+        self.delay_sec = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.__handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.__reply()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.__reply()
+
+            def __reply(self):
+                server.requests.append((self.command, self.path))
+                script = server.scripts.get(self.path, [])
+                status = script.pop(0) if script else 200
+                time.sleep(server.delay_sec)
+                body = b"ok"
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class HttpClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ScriptedServer()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_get_retried_on_gateway_errors(self):
+        client = HttpClient(retries=3)
+        self.server.scripts["/flaky"] = [502, 503, 504]
+        response = client.get(self.server.url("/flaky"))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(4, len(self.server.requests))
+
+    def test_post_not_retried(self):
+        client = HttpClient(retries=3)
+        self.server.scripts["/flaky"] = [503]
+        response = client.post(self.server.url("/flaky"), data="payload")
+        self.assertEqual(503, response.status_code)
+        self.assertEqual([("POST", "/flaky")], self.server.requests)
+
+    def test_default_timeout_applied(self):
+        client = HttpClient(retries=0, timeout=(1, 0.2))
+        self.server.delay_sec = 0.5
+        started = time.monotonic()
+        with self.assertRaises(requests.exceptions.RequestException):
+            client.get(self.server.url("/slow"))
+        self.assertLess(time.monotonic() - started, 0.45)
+        self.assertEqual(1, client.stats()["127.0.0.1"]["errors"])
+
+    def test_stats_per_host(self):
+        client = HttpClient()
+        for _ in range(5):
+            self.assertEqual(200, client.get(self.server.url("/ok")).status_code)
+        stats = client.stats()["127.0.0.1"]
+        self.assertEqual(5, stats["responses"])
+        self.assertEqual(0, stats["errors"])
+        self.assertEqual(1, stats["connections_opened"])
+        self.assertEqual(0.8, stats["connection_reuse"])
+        self.assertGreater(stats["max_latency_ms"], 0)
@@ -0,0 +1,66 @@
+import time
+import unittest
+from unittest import mock
+
+import rsa
+from flask import Flask, jsonify
+from jose import jwk, jwt
+
+from common import authentication
+from common.authentication import AuthError
+from infra import infrastructure_bp
+
+DOMAIN = "test.auth0.local"
+AUDIENCE = "https://spinless/api"
+
+
+class ListedResources:
+    """Infrastructure service returning no resources"""
+
+    def list_resources(self, account, resource_type, refresh=False):
+        return {"result": []}
+
+
+class ListResourcesApiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        public_key, cls.private_key = rsa.newkeys(1024)
+        cls.public_key = jwk.construct(public_key.save_pkcs1().decode("utf-8"), "RS256")
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.register_blueprint(infrastructure_bp.infra_bp_instance)
+
+        @app.errorhandler(AuthError)
+        def handle_auth_error(ex):
+            response = jsonify(ex.error)
+            response.status_code = ex.status_code
+            return response
+
+        self.client = app.test_client()
+        patches = [mock.patch.object(infrastructure_bp, "service", ListedResources()),
+                   mock.patch.object(authentication, "auth_config",
+                                     {"auth0_domain": DOMAIN, "auth0_client_identifier": AUDIENCE}),
+                   mock.patch.object(authentication.jwks_cache, "get_key", return_value=self.public_key)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def list_resources(self, permissions):
+        token = jwt.encode({"iss": f"https://{DOMAIN}/", "aud": AUDIENCE, "sub": "test",
+                            "exp": int(time.time()) + 60, "permissions": permissions},
+                           self.private_key.save_pkcs1().decode("utf-8"), algorithm="RS256", headers={"kid": "k1"})
+        return self.client.get("/resources?account=dev", headers={"Authorization": f"Bearer {token}"})
+
+    def test_read_scope_required(self):
+        response = self.list_resources(["account:dev"])
+        self.assertEqual(403, response.status_code)
+        self.assertEqual("no_scope", response.get_json()["code"])
+
+    def test_account_required(self):
+        self.assertEqual(401, self.list_resources(["read:resources", "account:prod"]).status_code)
+
+    def test_resources_listed(self):
+        response = self.list_resources(["read:resources", "account:dev"])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"result": []}, response.get_json())
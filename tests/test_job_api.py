@@ -0,0 +1,53 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from common import job_api, job_store, log_api
+from common.job_api import Job, JobState
+from common.job_store import JobStore
+
+
+class JobCancelTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        patches = [mock.patch.object(job_store, "job_store", JobStore(os.path.join(self.tmp_dir.name, "jobs.db"))),
+                   mock.patch.object(log_api, "logs_dir", lambda: self.tmp_dir.name)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.job = Job(lambda job, logger: None, None, None)
+        self.job.status.update(JobState.RUNNING.value)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cancel_of_complete_job(self):
+        self.job.complete_succ("done")
+        self.assertFalse(self.job.cancel())
+        self.assertEqual(JobState.SUCCESS.value, self.job.status.state)
+
+    def test_job_completing_during_cancel(self):
+        completed = []
+
+        def complete_meanwhile(job, kind):
+            # job's function returns right after its commands are terminated
+            thread = threading.Thread(target=lambda: completed.append(job.complete_succ("done")))
+            thread.start()
+            time.sleep(0.1)
+            return False
+
+        with mock.patch.object(job_api.scheduler, "cancel", complete_meanwhile):
+            self.assertTrue(self.job.cancel())
+        for _ in range(50):
+            if completed:
+                break
+            time.sleep(0.05)
+        self.assertEqual(JobState.SUCCESS.value, self.job.status.state)
+        self.assertTrue(self.job.logger.closed)
+        with open(log_api.log_path(self.job.job_id)) as log:
+            lines = log.read()
+        # job's log is closed only after cancel() is done with it
+        self.assertIn("Cancelling job...", lines)
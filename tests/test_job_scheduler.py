@@ -0,0 +1,92 @@
+import threading
+import time
+import unittest
+
+from common.job_scheduler import JobScheduler, QueueFullError
+
+
+class FakeJob:
+    def __init__(self, name, started, release, duration=0.):
+        self.job_id = name
+        self.started = started
+        self.release = release
+        self.duration = duration
+
+    def run(self):
+        self.started.append(self.job_id)
+        self.release.wait(5)
+        time.sleep(self.duration)
+
+
+class JobSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = JobScheduler(pools={"helm_deploy": (2, 3), "create_resource": (1, 1)})
+        self.started = []
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def job(self, name):
+        return FakeJob(name, self.started, self.release)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_jobs_run_on_bounded_pool(self):
+        for i in range(2):
+            self.scheduler.submit(self.job(f"deploy-{i}"), "helm_deploy")
+        self.wait_for(lambda: len(self.started) == 2)
+        for i in range(2, 5):
+            self.scheduler.submit(self.job(f"deploy-{i}"), "helm_deploy")
+        time.sleep(0.1)
+
+        self.assertEqual(["deploy-0", "deploy-1"], self.started)
+        stats = self.scheduler.stats()["helm_deploy"]
+        self.assertEqual((2, 3), (stats["running"], stats["queued"]))
+
+        self.release.set()
+        self.wait_for(lambda: self.scheduler.stats()["helm_deploy"]["completed"] == 5)
+        self.assertEqual(5, len(self.started))
+
+    def test_queued_jobs_ordered_by_priority(self):
+        self.scheduler.submit(self.job("first"), "create_resource")
+        self.wait_for(lambda: self.started)
+        self.scheduler.pools["create_resource"].max_queued = 10
+        self.scheduler.submit(self.job("low-1"), "create_resource", priority=20)
+        self.scheduler.submit(self.job("high"), "create_resource", priority=1)
+        self.scheduler.submit(self.job("low-2"), "create_resource", priority=20)
+
+        self.release.set()
+        self.wait_for(lambda: len(self.started) == 4)
+        self.assertEqual(["first", "high", "low-1", "low-2"], self.started)
+
+    def test_job_rejected_when_queue_is_full(self):
+        self.scheduler.submit(self.job("running"), "create_resource")
+        self.wait_for(lambda: self.started)
+        self.scheduler.submit(self.job("queued"), "create_resource")
+
+        with self.assertRaises(QueueFullError):
+            self.scheduler.submit(self.job("rejected"), "create_resource")
+        # other kinds are not affected
+        self.scheduler.submit(self.job("deploy"), "helm_deploy")
+        self.assertEqual(1, self.scheduler.stats()["create_resource"]["rejected"])
+
+    def test_queued_job_is_cancelled(self):
+        self.scheduler.submit(self.job("running"), "create_resource")
+        self.wait_for(lambda: self.started)
+        queued = self.job("queued")
+        self.scheduler.submit(queued, "create_resource")
+
+        self.assertTrue(self.scheduler.cancel(queued, "create_resource"))
+        self.assertFalse(self.scheduler.cancel(queued, "create_resource"))
+        self.release.set()
+        self.wait_for(lambda: self.scheduler.stats()["create_resource"]["completed"] == 1)
+        time.sleep(0.1)
+        self.assertEqual(["running"], self.started)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from common.job_store import JobStore
+
+
+class JobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "jobs.db")
+        self.store = JobStore(self.path, retention_sec=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_job_status_survives_restart(self):
+        self.store.create("job-1", "helm_deploy", "CREATED", 1000.)
+        self.store.update("job-1", "RUNNING")
+        self.store.update("job-1", "SUCCESS", end=1010., elapsed=10.)
+
+        restarted = JobStore(self.path)
+        self.assertEqual({"job_id": "job-1", "name": "helm_deploy", "state": "SUCCESS", "start": 1000.,
+                          "end": 1010., "elapsed": 10.}, restarted.get("job-1"))
+        self.assertIsNone(restarted.get("job-2"))
+
+    def test_unfinished_jobs_failed_after_restart(self):
+        self.store.create("job-1", "helm_deploy", "RUNNING", 1000.)
+        self.store.create("job-2", "helm_deploy", "SUCCESS", 1000.)
+
+        self.assertEqual(1, JobStore(self.path).fail_unfinished("FAILED"))
+        self.assertEqual("FAILED", self.store.get("job-1")["state"])
+        self.assertEqual({"FAILED": 1, "SUCCESS": 1}, self.store.stats())
+
+    def test_jobs_listed_by_pages(self):
+        for i in range(7):
+            self.store.create(f"job-{i}", "helm_deploy" if i % 2 else "create_resource", "SUCCESS", 1000. + i // 2)
+
+        first, err = self.store.list(limit=3)
+        second, _ = self.store.list(limit=3, page_token=first["next_page_token"])
+        third, _ = self.store.list(limit=3, page_token=second["next_page_token"])
+        listed = [j["job_id"] for page in (first, second, third) for j in page["jobs"]]
+
+        self.assertEqual(0, err)
+        self.assertEqual(sorted(listed, reverse=True), listed)
+        self.assertEqual(7, len(set(listed)))
+        self.assertIsNone(third["next_page_token"])
+        deploys, _ = self.store.list(name="helm_deploy")
+        self.assertEqual(["job-5", "job-3", "job-1"], [j["job_id"] for j in deploys["jobs"]])
+        self.assertEqual(1, self.store.list(page_token="broken")[1])
+
+    def test_old_finished_jobs_purged(self):
+        self.store.create("old", "helm_deploy", "SUCCESS", 1000.)
+        self.store.create("old-running", "helm_deploy", "RUNNING", 1000.)
+        self.store.create("new", "helm_deploy", "FAILED", 1950.)
+
+        self.assertEqual(["old"], self.store.purge(now=2000.))
+        self.assertIsNone(self.store.get("old"))
+        self.assertIsNotNone(self.store.get("old-running"))
+        self.assertIsNotNone(self.store.get("new"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import base64
+import gzip
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import yaml
+
+from common.kube_client import KubeClientPool, decode_helm_release
+
+
+def release_secret(name, version, values, status="deployed"):
+    release = {"name": name, "version": version, "info": {"status": status}, "config": values}
+    data = base64.b64encode(base64.b64encode(gzip.compress(json.dumps(release).encode("utf-8"))))
+    return {"metadata": {"name": f"sh.helm.release.v1.{name}.v{version}",
+                         "labels": {"owner": "helm", "name": name, "version": str(version), "status": status}},
+            "type": "helm.sh/release.v1",
+            "data": {"release": data.decode("utf-8")}}
+
+
+class FakeKubeApi:
+    """Local kubernetes API serving namespaces and helm release secrets"""
+
+    def __init__(self, token):
+        self.namespaces = ["default", "ns-1"]
+        self.secrets = {}
+        self.requests = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                api.requests.append((self.command, url.path, parse_qs(url.query)))
+                if self.headers.get("Authorization") != f"Bearer {token}":
+                    return self.respond(401, {"message": "Unauthorized"})
+                parts = url.path.strip("/").split("/")
+                if parts == ["api", "v1", "namespaces"]:
+                    return self.respond(200, {"items": [{"metadata": {"name": ns}} for ns in api.namespaces]})
+                if len(parts) == 5 and parts[4] == "secrets":
+                    return self.respond(200, {"items": api.secrets.get(parts[3], [])})
+                self.respond(404, {"message": "Not found"})
+
+            def do_DELETE(self):
+                api.requests.append((self.command, self.path, {}))
+                ns = self.path.strip("/").split("/")[-1]
+                if ns not in api.namespaces:
+                    return self.respond(404, {"message": f"namespaces \"{ns}\" not found"})
+                api.namespaces.remove(ns)
+                self.respond(200, {})
+
+            def respond(self, code, body):
+                content = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def kctx(self, token):
+        kube_config = {"apiVersion": "v1", "current-context": "test",
+                       "clusters": [{"name": "test", "cluster": {
+                           "server": f"http://127.0.0.1:{self.server.server_port}"}}],
+                       "users": [{"name": "test", "user": {"token": token}}],
+                       "contexts": [{"name": "test", "context": {"cluster": "test", "user": "test"}}]}
+        return {"kube_config": base64.standard_b64encode(yaml.dump(kube_config).encode("utf-8")).decode("utf-8"),
+                "kube_backend": "api", "cluster_name": "test"}
+
+
+class KubeClientTest(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeKubeApi("secret-token")
+        self.pool = KubeClientPool()
+        self.client = self.pool.get_client("test", self.api.kctx("secret-token"))
+
+    def tearDown(self):
+        self.pool.invalidate("test")
+        self.api.server.shutdown()
+        self.api.server.server_close()
+
+    def test_list_and_delete_namespaces(self):
+        self.assertEqual(["default", "ns-1"], self.client.list_namespaces())
+        self.client.delete_namespace("ns-1")
+        self.assertEqual(["default"], self.client.list_namespaces())
+        self.assertIs(self.client, self.pool.get_client("test", self.api.kctx("secret-token")))
+
+    def test_latest_helm_release_revisions_decoded(self):
+        self.api.secrets["ns-1"] = [
+            release_secret("svc", 1, {"repo": "svc", "images": {"service": {"tag": "1.0.0"}}}, "superseded"),
+            release_secret("svc", 2, {"repo": "svc", "images": {"service": {"tag": "1.0.1"}}}),
+            release_secret("gone", 1, {"repo": "gone"}, "uninstalled"),
+        ]
+        releases = self.client.helm_releases("ns-1")
+
+        self.assertEqual(1, len(releases))
+        self.assertEqual(2, releases[0]["version"])
+        self.assertEqual("1.0.1", releases[0]["config"]["images"]["service"]["tag"])
+        self.assertEqual({"labelSelector": ["owner=helm"], "fieldSelector": ["type=helm.sh/release.v1"]},
+                         self.api.requests[-1][2])
+
+    def test_changed_kctx_recreates_client(self):
+        client = self.pool.get_client("test", self.api.kctx("other-token"))
+        self.assertIsNot(self.client, client)
+        with self.assertRaises(Exception):
+            client.list_namespaces()
+
+    def test_uncompressed_release_decoded(self):
+        data = base64.b64encode(base64.b64encode(json.dumps({"name": "svc"}).encode("utf-8")))
+        self.assertEqual({"name": "svc"}, decode_helm_release(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
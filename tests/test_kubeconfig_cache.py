@@ -0,0 +1,61 @@
+import base64
+import os
+import unittest
+
+from common.kubeconfig_cache import KubeconfigCache
+
+
+def kctx(kube_config, aws_secret_key="secret"):
+    return {"kube_config": base64.standard_b64encode(kube_config.encode("utf-8")).decode("utf-8"),
+            "aws_region": "eu-west-1", "aws_access_key": "key", "aws_secret_key": aws_secret_key}
+
+
+class KubeconfigCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = KubeconfigCache(max_entries=2)
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def test_kubeconfig_shared_between_calls(self):
+        with self.cache.kube_env("c1", kctx("config: 1\n")) as first:
+            with self.cache.kube_env("c1", kctx("config: 1\n")) as second:
+                self.assertEqual(first, second)
+        path = first["KUBECONFIG"]
+        with open(path) as kubeconf:
+            self.assertEqual("config: 1\n", kubeconf.read())
+        self.assertEqual(0o600, os.stat(path).st_mode & 0o777)
+        self.assertEqual("eu-west-1", first["AWS_DEFAULT_REGION"])
+        self.assertEqual({"clusters": 1, "files": 1, "in_use": 0}, self.cache.stats())
+
+    def test_changed_kctx_replaces_kubeconfig_after_release(self):
+        old_env = self.cache.acquire("c1", kctx("config: 1\n"))
+        with self.cache.kube_env("c1", kctx("config: 1\n", aws_secret_key="rotated")) as new_env:
+            self.assertNotEqual(old_env["KUBECONFIG"], new_env["KUBECONFIG"])
+            self.assertEqual("rotated", new_env["AWS_SECRET_ACCESS_KEY"])
+            # old file is still used by another call
+            self.assertTrue(os.path.exists(old_env["KUBECONFIG"]))
+        self.cache.release(old_env)
+        self.assertFalse(os.path.exists(old_env["KUBECONFIG"]))
+        self.assertTrue(os.path.exists(new_env["KUBECONFIG"]))
+
+    def test_least_recently_used_kubeconfig_evicted(self):
+        paths = []
+        for cluster in ("c1", "c2", "c3"):
+            with self.cache.kube_env(cluster, kctx(f"cluster: {cluster}\n")) as kube_env:
+                paths.append(kube_env["KUBECONFIG"])
+
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(all(os.path.exists(p) for p in paths[1:]))
+        self.assertEqual(2, self.cache.stats()["clusters"])
+
+    def test_invalidated_kubeconfig_removed(self):
+        with self.cache.kube_env("c1", kctx("config: 1\n")) as kube_env:
+            pass
+        self.cache.invalidate("c1")
+        self.assertFalse(os.path.exists(kube_env["KUBECONFIG"]))
+        self.assertEqual({"clusters": 0, "files": 0, "in_use": 0}, self.cache.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from common import log_api
+from common.log_api import BusHandler, LogBus, follow_file, ndjson_stream, sse_stream
+
+
+class LogBusTest(unittest.TestCase):
+    def setUp(self):
+        self.logs_dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(log_api, "logs_dir", return_value=self.logs_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bus = LogBus()
+
+        bus_patcher = mock.patch.object(log_api, "log_bus", self.bus)
+        bus_patcher.start()
+        self.addCleanup(bus_patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.logs_dir)
+
+    def job_logger(self, job_id, max_lines=100):
+        job_log = self.bus.open(job_id)
+        job_log.max_lines = max_lines
+        logger = logging.getLogger(f"test-{job_id}")
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        file_handler = logging.FileHandler(log_api.log_path(job_id), 'w', 'utf-8')
+        logger.addHandler(file_handler)
+        logger.addHandler(BusHandler(job_log))
+        self.addCleanup(file_handler.close)
+        return logger
+
+    def test_lines_pushed_to_followers(self):
+        logger = self.job_logger("job-1")
+        received = []
+        follower = threading.Thread(target=lambda: received.extend((time.monotonic(), l) for l in
+                                                                   self.bus.follow("job-1")))
+        follower.start()
+        time.sleep(0.1)
+
+        written_at = time.monotonic()
+        log_api.status(logger, "job-1", "RUNNING", "first")
+        time.sleep(0.1)
+        log_api.status(logger, "job-1", "EOF", "")
+        follower.join(5)
+
+        self.assertFalse(follower.is_alive())
+        self.assertEqual([0, 1], [seq for (_, (seq, _)) in received])
+        self.assertEqual("first", json.loads(received[0][1][1])["message"])
+        self.assertLess(received[0][0] - written_at, 0.05)
+        self.assertEqual({"jobs": 1, "running": 0, "followers": 0}, self.bus.stats())
+
+    def test_lines_dropped_from_memory_read_from_file(self):
+        logger = self.job_logger("job-2", max_lines=5)
+        for i in range(20):
+            logger.info(f"line {i}")
+        log_api.status(logger, "job-2", "EOF", "")
+
+        self.assertGreater(self.bus.get("job-2").first_seq, 0)
+        lines = list(self.bus.follow("job-2", from_seq=3))
+        self.assertEqual(list(range(3, 21)), [seq for (seq, _) in lines])
+        self.assertEqual("line 3", lines[0][1])
+
+    def test_historical_log_file_followed(self):
+        path = log_api.log_path("old-job")
+        with open(path, "w") as f:
+            f.write("line 0\n")
+
+        def append():
+            time.sleep(0.2)
+            with open(path, "a") as log:
+                log.write("line 1\n")
+                log.write(json.dumps({"status": "EOF"}) + "\n")
+
+        threading.Thread(target=append).start()
+        lines = list(self.bus.follow("old-job"))
+        self.assertEqual(["line 0", "line 1"], [line for (_, line) in lines[:2]])
+        self.assertEqual(3, len(lines))
+
+    def test_missing_log_file_not_followed_forever(self):
+        started = time.monotonic()
+        self.assertEqual([], list(follow_file(os.path.join(self.logs_dir, "missing.log"), idle_sec=0.2)))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_sse_stream_resumed_after_last_event(self):
+        logger = self.job_logger("job-3")
+        log_api.status(logger, "job-3", "RUNNING", "first")
+        logger.info("plain line\n")
+        log_api.status(logger, "job-3", "SUCCESS", "done")
+        log_api.status(logger, "job-3", "EOF", "")
+
+        events = list(sse_stream("job-3", from_seq=1))
+        self.assertEqual(3, len(events))
+        self.assertTrue(events[0].startswith("id: 1\nevent: log\ndata: plain line\n\n"))
+        self.assertTrue(events[1].startswith("id: 3\nevent: status\n"))
+        self.assertIn('"status": "SUCCESS"', events[1])
+
+        records = [json.loads(line) for line in ndjson_stream("job-3", from_seq=3)]
+        self.assertEqual([(3, "SUCCESS"), (4, "EOF")], [(r["seq"], r["status"]) for r in records])
+
+    def test_keepalive_sent_while_job_is_idle(self):
+        logger = self.job_logger("job-4")
+        stream = sse_stream("job-4", heartbeat_sec=0.1)
+        self.assertEqual(": keepalive\n\n", next(stream))
+        log_api.status(logger, "job-4", "RUNNING", "first")
+        self.assertTrue(next(stream).startswith("id: 0\n"))
+        stream.close()
+        self.assertEqual(0, self.bus.stats()["followers"])
+
+
+if __name__ == '__main__':
+    unittest.main()
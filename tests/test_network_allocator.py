@@ -0,0 +1,88 @@
+import logging
+import os
+import tempfile
+import unittest
+
+from common.vault_api import Vault, secret_cache
+from infra.network_allocator import NetworkAllocator, NetworkAllocationError, NETWORK_LEASES_PATH
+from tests.fake_vault import FakeVault
+
+
+class NetworkAllocatorTest(unittest.TestCase):
+    def setUp(self):
+        self.vault = FakeVault().start()
+        self.jwt_file = tempfile.NamedTemporaryFile("w", delete=False)
+        self.jwt_file.close()
+        self.env = {k: os.environ.get(k) for k in ("VAULT_ADDR", "VAULT_JWT_PATH")}
+        os.environ.update({"VAULT_ADDR": self.vault.addr, "VAULT_JWT_PATH": self.jwt_file.name})
+        secret_cache.clear()
+        self.allocator = NetworkAllocator(max_id=40, backoff_sec=0.01)
+
+    def tearDown(self):
+        secret_cache.clear()
+        for k, v in self.env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        os.unlink(self.jwt_file.name)
+        self.vault.stop()
+
+    def new_vault(self):
+        return Vault(logging.getLogger("test"))
+
+    def test_cluster_keeps_its_lease(self):
+        self.assertEqual(11, self.allocator.allocate(self.new_vault(), "c1", floor=10))
+        self.assertEqual(12, self.allocator.allocate(self.new_vault(), "c2", floor=10))
+        self.assertEqual(11, self.allocator.allocate(self.new_vault(), "c1", floor=10))
+        self.assertEqual({"c1": 11, "c2": 12}, self.allocator.leases(self.new_vault()))
+        self.assertEqual({"allocations": 2, "reuses": 1, "releases": 0, "conflicts": 0}, self.allocator.stats())
+
+    def test_change_before_read_back_detected(self):
+        replica = NetworkAllocator(max_id=40, backoff_sec=0.01)
+        vault = self.new_vault()
+        original_write = vault.write
+
+        def write_then_replica_allocates(path, **data):
+            original_write(path, **data)
+            if path == NETWORK_LEASES_PATH and replica.stats()["allocations"] == 0:
+                # another allocator (own lock) changes the table before this write is read back
+                self.assertEqual(12, replica.allocate(self.new_vault(), "c2", floor=10))
+
+        vault.write = write_then_replica_allocates
+        # lease written by this replica is found on retry
+        self.assertEqual(11, self.allocator.allocate(vault, "c1", floor=10))
+        self.assertEqual({"c1": 11, "c2": 12}, self.allocator.leases(self.new_vault()))
+        self.assertEqual(1, self.allocator.stats()["conflicts"])
+        self.assertEqual(0, replica.stats()["conflicts"])
+
+    def test_released_id_reused_and_audited(self):
+        for name in ("c1", "c2", "c3"):
+            self.allocator.allocate(self.new_vault(), name, floor=10)
+        self.assertEqual(12, self.allocator.release(self.new_vault(), "c2"))
+        self.assertIsNone(self.allocator.release(self.new_vault(), "c2"))
+        self.assertEqual(12, self.allocator.allocate(self.new_vault(), "c4", floor=10))
+        self.assertEqual([("allocate", "c1", 11), ("allocate", "c2", 12), ("allocate", "c3", 13),
+                          ("release", "c2", 12), ("allocate", "c4", 12)],
+                         [(e["action"], e["cluster"], e["network_id"])
+                          for e in self.allocator.audit_log(self.new_vault())])
+
+    def test_exhausted_ids(self):
+        self.allocator.allocate(self.new_vault(), "c1", floor=39)
+        with self.assertRaises(NetworkAllocationError):
+            self.allocator.allocate(self.new_vault(), "c2", floor=39)
+
+    def test_overwrite_before_read_back_detected(self):
+        vault = self.new_vault()
+        original_write = vault.write
+
+        def write_then_overwrite(path, **data):
+            original_write(path, **data)
+            if path == NETWORK_LEASES_PATH and self.allocator.stats()["conflicts"] == 0:
+                # secret is overwritten (e.g. by hand) right after the write
+                self.vault.secrets[NETWORK_LEASES_PATH] = {"leases": {"other": "11"}, "audit": []}
+
+        vault.write = write_then_overwrite
+        self.assertEqual(12, self.allocator.allocate(vault, "c1", floor=10))
+        self.assertEqual({"other": 11, "c1": 12}, self.allocator.leases(self.new_vault()))
+        self.assertEqual(1, self.allocator.stats()["conflicts"])
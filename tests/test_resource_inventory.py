@@ -0,0 +1,101 @@
+import datetime
+import io
+import unittest
+
+import boto3
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+from infra.resource_inventory import ResourceInventory
+
+BUCKET = "states"
+MODIFIED = datetime.datetime(2020, 9, 1, tzinfo=datetime.timezone.utc)
+
+
+def obj(key, etag, size=10):
+    return {"Key": key, "ETag": f'"{etag}"', "Size": size, "LastModified": MODIFIED}
+
+
+def info_body(version):
+    data = f'module: "scalecube/cluster"\nversion: "{version}"\n'.encode("utf-8")
+    return {"Body": StreamingBody(io.BytesIO(data), len(data))}
+
+
+class ResourceInventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.s3 = boto3.client("s3", region_name="eu-west-1", aws_access_key_id="key", aws_secret_access_key="secret")
+        self.stubber = Stubber(self.s3)
+        self.stubber.activate()
+        self.inventory = ResourceInventory(sync_interval_sec=3600)
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_paged_listing_indexed(self):
+        self.stubber.add_response("list_objects_v2", {
+            "Contents": [obj("dev/cluster/c1/terraform.tfstate", "s1", size=1234),
+                         obj("dev/cluster/c1/resource.tfvars", "v1")],
+            "IsTruncated": True, "NextContinuationToken": "page2"},
+                                  {"Bucket": BUCKET, "Prefix": "dev/"})
+        self.stubber.add_response("list_objects_v2", {
+            "Contents": [obj("dev/cluster/c1/resource_info.yaml", "i1"),
+                         obj("dev/cluster/c1", "dir"),
+                         obj("dev/db/d1/resource.tfvars", "v2")],
+            "IsTruncated": False},
+                                  {"Bucket": BUCKET, "Prefix": "dev/", "ContinuationToken": "page2"})
+        self.stubber.add_response("get_object", info_body("v1.0.0"),
+                                  {"Bucket": BUCKET, "Key": "dev/cluster/c1/resource_info.yaml"})
+
+        resources = self.inventory.resources(self.s3, BUCKET, "dev")
+        self.assertEqual([{"account": "dev", "type": "cluster", "name": "c1", "state_size": 1234,
+                           "last_modified": MODIFIED.isoformat(), "module": "scalecube/cluster",
+                           "module_version": "v1.0.0", "tfvars_digest": "v1"},
+                          {"account": "dev", "type": "db", "name": "d1", "state_size": None,
+                           "last_modified": MODIFIED.isoformat(), "module": None, "module_version": None,
+                           "tfvars_digest": "v2"}], resources)
+        # served from memory
+        self.assertEqual(1234, self.inventory.state_size(self.s3, BUCKET, "dev", "cluster", "c1"))
+        self.assertIsNone(self.inventory.state_size(self.s3, BUCKET, "dev", "db", "d1"))
+        self.assertEqual(["d1"], [r["name"] for r in self.inventory.resources(self.s3, BUCKET, "dev", "db")])
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual({"accounts": 1, "resources": 2, "syncs": 1, "pages": 2, "info_downloads": 1, "hits": 3},
+                         self.inventory.stats())
+
+    def test_resource_info_downloaded_when_etag_changes(self):
+        listing = {"Contents": [obj("dev/cluster/c1/terraform.tfstate", "s1"),
+                                obj("dev/cluster/c1/resource_info.yaml", "i1")], "IsTruncated": False}
+        self.stubber.add_response("list_objects_v2", listing)
+        self.stubber.add_response("get_object", info_body("v1.0.0"))
+        self.inventory.resources(self.s3, BUCKET, "dev")
+
+        self.stubber.add_response("list_objects_v2", listing)
+        self.inventory.invalidate(BUCKET, "dev")
+        self.assertEqual("v1.0.0", self.inventory.resources(self.s3, BUCKET, "dev")[0]["module_version"])
+
+        self.stubber.add_response("list_objects_v2", {
+            "Contents": [obj("dev/cluster/c1/terraform.tfstate", "s2"),
+                         obj("dev/cluster/c1/resource_info.yaml", "i2"),
+                         obj("dev/cluster/c2/terraform.tfstate", "s3")], "IsTruncated": False})
+        self.stubber.add_response("get_object", info_body("v2.0.0"))
+        resources = self.inventory.resources(self.s3, BUCKET, "dev", force=True)
+        self.assertEqual([("c1", "v2.0.0"), ("c2", None)], [(r["name"], r["module_version"]) for r in resources])
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(2, self.inventory.stats()["info_downloads"])
+
+    def test_failed_listing_keeps_index(self):
+        self.stubber.add_response("list_objects_v2", {"Contents": [obj("dev/cluster/c1/terraform.tfstate", "s1")],
+                                                      "IsTruncated": False})
+        self.stubber.add_client_error("list_objects_v2", "AccessDenied")
+        self.inventory.resources(self.s3, BUCKET, "dev")
+        with self.assertRaises(Exception):
+            self.inventory.resources(self.s3, BUCKET, "dev", force=True)
+        self.assertEqual(10, self.inventory.state_size(self.s3, BUCKET, "dev", "cluster", "c1"))
+
+    def test_forced_state_check_sees_removed_state(self):
+        self.stubber.add_response("list_objects_v2", {"Contents": [obj("dev/cluster/c1/terraform.tfstate", "s1")],
+                                                      "IsTruncated": False})
+        self.stubber.add_response("list_objects_v2", {"IsTruncated": False})
+        self.assertEqual(10, self.inventory.state_size(self.s3, BUCKET, "dev", "cluster", "c1"))
+        # state is removed by another process, index is still fresh
+        self.assertIsNone(self.inventory.state_size(self.s3, BUCKET, "dev", "cluster", "c1", force=True))
+        self.stubber.assert_no_pending_responses()
@@ -0,0 +1,109 @@
+import logging
+import os
+import tempfile
+import unittest
+
+from common import vault_pool
+from common.secret_cache import SecretCache
+from common.vault_api import Vault, secret_cache
+from common.vault_pool import VaultClientPool
+from tests.fake_vault import FakeVault
+
+BASE_PATH = "secretv2/scalecube/spinless"
+
+
+class SecretCacheTest(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = SecretCache(max_entries=2)
+        cache.get_or_load("read", "a", 60, lambda: {"v": "a"})
+        cache.get_or_load("read", "b", 60, lambda: {"v": "b"})
+        cache.get_or_load("read", "a", 60, lambda: {"v": "stale"})
+        cache.get_or_load("read", "c", 60, lambda: {"v": "c"})
+
+        self.assertEqual({"v": "a"}, cache.get_or_load("read", "a", 60, lambda: {"v": "reloaded"}))
+        self.assertEqual({"v": "reloaded"}, cache.get_or_load("read", "b", 60, lambda: {"v": "reloaded"}))
+        self.assertEqual(2, cache.stats()["evictions"])
+
+    def test_values_are_copied(self):
+        cache = SecretCache()
+        cache.get_or_load("read", "a", 60, lambda: {"data": {"v": "a"}})
+        cache.get_or_load("read", "a", 60, lambda: None)["data"]["v"] = "modified"
+
+        self.assertEqual({"data": {"v": "a"}}, cache.get_or_load("read", "a", 60, lambda: None))
+
+    def test_value_loaded_before_invalidation_not_cached(self):
+        cache = SecretCache()
+
+        def load_then_invalidate():
+            # path is written while its old value is being read
+            cache.invalidate("secrets/a")
+            return {"v": "old"}
+
+        self.assertEqual({"v": "old"}, cache.get_or_load("read", "secrets/a", 60, load_then_invalidate))
+        self.assertEqual({"v": "new"}, cache.get_or_load("read", "secrets/a", 60, lambda: {"v": "new"}))
+        self.assertEqual({"v": "new"}, cache.get_or_load("read", "secrets/a", 60, lambda: {"v": "newer"}))
+        self.assertEqual({}, cache.loads)
+
+
+class VaultSecretCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.vault = FakeVault().start()
+        self.jwt_file = tempfile.NamedTemporaryFile("w", delete=False)
+        self.jwt_file.close()
+        self.env = {k: os.environ.get(k) for k in ("VAULT_ADDR", "VAULT_JWT_PATH", "VAULT_SECRETS_PATH")}
+        os.environ.update({"VAULT_ADDR": self.vault.addr, "VAULT_JWT_PATH": self.jwt_file.name,
+                           "VAULT_SECRETS_PATH": BASE_PATH})
+        self.default_pool = vault_pool.client_pool
+        vault_pool.client_pool = VaultClientPool()
+        secret_cache.clear()
+        self.vault.secrets[f"{BASE_PATH}/registries/helm/reg-1"] = {"path": "helm.io/"}
+        self.vault.secrets[f"{BASE_PATH}/kctx/cluster-1"] = {"name": "cluster-1"}
+        self.vault.secrets[f"{BASE_PATH}/resources/cluster"] = {"network_id": "1"}
+
+    def tearDown(self):
+        vault_pool.client_pool = self.default_pool
+        secret_cache.clear()
+        for k, v in self.env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        os.unlink(self.jwt_file.name)
+        self.vault.stop()
+
+    def new_vault(self):
+        return Vault(logging.getLogger("test"))
+
+    def test_cached_prefix_read_once(self):
+        for _ in range(50):
+            self.assertEqual({"path": "helm.io/"}, self.new_vault().read(f"{BASE_PATH}/registries/helm/reg-1")["data"])
+        self.assertEqual(1, self.vault.reads)
+
+    def test_not_cached_prefix_always_read(self):
+        for _ in range(3):
+            self.new_vault().read(f"{BASE_PATH}/resources/cluster")
+        self.assertEqual(3, self.vault.reads)
+
+    def test_write_invalidates_read_and_parent_list(self):
+        vault = self.new_vault()
+        self.assertEqual(["cluster-1"], vault.list(f"{BASE_PATH}/kctx"))
+        vault.read(f"{BASE_PATH}/kctx/cluster-1")
+
+        vault.write(f"{BASE_PATH}/kctx/cluster-1", name="cluster-1", kube_config="new")
+        vault.write(f"{BASE_PATH}/kctx/cluster-2", name="cluster-2")
+
+        self.assertEqual("new", vault.read(f"{BASE_PATH}/kctx/cluster-1")["data"]["kube_config"])
+        self.assertEqual(["cluster-1", "cluster-2"], vault.list(f"{BASE_PATH}/kctx"))
+        self.assertEqual(2, self.vault.reads)
+        self.assertEqual(2, self.vault.lists)
+
+    def test_delete_invalidates(self):
+        vault = self.new_vault()
+        vault.read(f"{BASE_PATH}/kctx/cluster-1")
+        vault.delete(f"{BASE_PATH}/kctx/cluster-1")
+
+        self.assertIsNone(vault.read(f"{BASE_PATH}/kctx/cluster-1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
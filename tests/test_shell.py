@@ -0,0 +1,109 @@
+import os
+import subprocess
+import threading
+import time
+import unittest
+
+from common.shell import shell_run, shell_await, CancellationToken, CancelledError, StreamingCommand, OutputBuffer
+
+
+class ShellCancellationTest(unittest.TestCase):
+    def test_cancel_kills_process_tree(self):
+        token = CancellationToken()
+        pid_file = f"/tmp/spinless-test-shell-{os.getpid()}"
+        threading.Timer(0.5, token.cancel).start()
+        started = time.monotonic()
+        # child process of the shell would outlive it unless whole process group is killed
+        with self.assertRaises(CancelledError):
+            shell_run(f"sh -c 'sleep 30 & echo $! > {pid_file}; wait'", timeout=30, cancel_token=token)
+        self.assertLess(time.monotonic() - started, 5)
+
+        with open(pid_file) as f:
+            child_pid = int(f.read())
+        os.remove(pid_file)
+        deadline = time.monotonic() + 5
+        while self.__alive(child_pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(self.__alive(child_pid))
+
+    def test_cancelled_token_prevents_start(self):
+        token = CancellationToken()
+        token.cancel()
+        with self.assertRaises(CancelledError):
+            shell_await(["echo", "never"], cancel_token=token)
+
+    def test_completed_command_is_not_affected(self):
+        token = CancellationToken()
+        code, output = shell_run("echo done", cancel_token=token)
+        token.cancel()
+        self.assertEqual((0, "done"), (code, output[0]))
+
+    @staticmethod
+    def __alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        # killed process is still in process table (zombie) until its parent collects it
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                return f.read().split()[2] != "Z"
+        except FileNotFoundError:
+            return False
+
+
+class StreamingCommandTest(unittest.TestCase):
+    def test_lines_are_yielded_while_command_runs(self):
+        command = StreamingCommand("sh -c 'echo first; sleep 1; echo second; exit 3'")
+        started = time.monotonic()
+        received = []
+        for line in command.lines():
+            received.append((line, time.monotonic() - started))
+
+        self.assertEqual(["first", "second"], [line for (line, _) in received])
+        self.assertLess(received[0][1], 0.8)
+        self.assertEqual(3, command.returncode)
+
+    def test_only_tail_is_retained(self):
+        command = StreamingCommand("seq 1 10000", tail_lines=5)
+        count = sum(1 for _ in command.lines())
+        self.assertEqual(10000, count)
+        self.assertEqual(["9996", "9997", "9998", "9999", "10000"], list(command.tail))
+        self.assertEqual(0, command.returncode)
+
+    def test_idle_timeout_kills_command(self):
+        command = StreamingCommand("sh -c 'echo started; sleep 30'", timeout=30, idle_timeout=0.5)
+        started = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            list(command.lines())
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(["started"], list(command.tail))
+
+
+class ShellAwaitTest(unittest.TestCase):
+    def test_multi_megabyte_output(self):
+        # ~7 MB, used to block on full pipe until timeout since output was read only after exit
+        started = time.monotonic()
+        code, output = shell_await(["seq", "1", "1000000"], with_output=True, timeout=30)
+        lines = list(output)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual((0, 1000000, "1000000"), (code, len(lines), lines[-1]))
+
+    def test_large_output_as_stream(self):
+        code, stream = shell_await(["head", "-c", "3000000", "/dev/zero"], with_output=True, get_stream=True,
+                                   timeout=30)
+        self.assertEqual((0, 3000000), (code, len(stream.read())))
+
+    def test_output_is_drained_without_with_output(self):
+        code, _ = shell_await(["seq", "1", "1000000"], timeout=30)
+        self.assertEqual(0, code)
+
+    def test_ring_buffer_keeps_last_bytes(self):
+        buffer = OutputBuffer(max_bytes=10)
+        for chunk in (b"0123456", b"789abc", b"def"):
+            buffer.append(chunk)
+        self.assertEqual((b"6789abcdef", 6), (buffer.getvalue(), buffer.dropped))
+
+
+if __name__ == '__main__':
+    unittest.main()
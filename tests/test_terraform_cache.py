@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from infra.terraform_cache import TerraformCache, PlanCache
+
+
+def git(*args, cwd=None):
+    return subprocess.run(["git", "-c", "user.email=test@spinless", "-c", "user.name=test", *args], cwd=cwd,
+                          check=True, stdout=subprocess.PIPE).stdout.decode("utf-8").strip()
+
+
+class TerraformCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.remote = f"{self.tmp}/remote/scalecube/terraform-cluster"
+        os.makedirs(self.remote)
+        git("init", "-q", cwd=self.remote)
+        with open(f"{self.remote}/variables.tf", "w") as f:
+            f.write('variable "cluster-name" {}\n')
+        git("add", ".", cwd=self.remote)
+        git("commit", "-q", "-m", "module", cwd=self.remote)
+        git("tag", "v0.5", cwd=self.remote)
+        self.cache = TerraformCache(root=f"{self.tmp}/cache", remote=f"{self.tmp}/remote/{{tf_repo}}")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_module_source_is_local_mirror(self):
+        source, err = self.cache.module_source("scalecube/terraform-cluster", "v0.5")
+        self.assertEqual(0, err)
+        self.assertTrue(source.startswith(f"git::file://{self.tmp}/cache/mirrors/"))
+        self.assertTrue(source.endswith("?ref=v0.5"))
+
+        # mirror is used when remote isn't available
+        shutil.rmtree(f"{self.tmp}/remote")
+        self.assertEqual((source, 0), self.cache.module_source("scalecube/terraform-cluster", "v0.5"))
+        self.assertEqual(1, self.cache.module_source("scalecube/terraform-cluster", "v0.6")[1])
+        self.assertEqual(1, self.cache.stats()["fetches"])
+
+    def test_work_dir_is_seeded_with_hardlinks(self):
+        source, _ = self.cache.module_source("scalecube/terraform-cluster", "v0.5")
+        # pre-initialized work dir as 'terraform init' leaves it
+        template = f"{self.tmp}/cache/workdirs/scalecube__terraform-cluster@v0.5"
+        os.makedirs(f"{template}/.terraform/modules/seed")
+        os.makedirs(f"{template}/.terraform/providers/aws")
+        shutil.copy(f"{self.remote}/variables.tf", f"{template}/.terraform/modules/seed/variables.tf")
+        with open(f"{template}/.terraform/providers/aws/provider", "w") as f:
+            f.write("binary")
+        with open(f"{template}/.terraform/modules/modules.json", "w") as f:
+            json.dump({"Modules": [{"Key": "", "Source": "", "Dir": "."},
+                                   {"Key": "seed", "Source": source, "Dir": ".terraform/modules/seed"}]}, f)
+        with open(f"{template}/seed.json", "w") as f:
+            json.dump({"commit": git("rev-parse", "HEAD", cwd=self.remote), "source": source}, f)
+        work_dir = f"{self.tmp}/work"
+        os.makedirs(work_dir)
+
+        msg, err = self.cache.seed(work_dir, "cluster-1", "scalecube/terraform-cluster", "v0.5", source)
+
+        self.assertEqual(0, err, msg)
+        self.assertEqual(os.stat(f"{template}/.terraform/modules/seed/variables.tf").st_ino,
+                         os.stat(f"{work_dir}/.terraform/modules/cluster-1/variables.tf").st_ino)
+        self.assertTrue(os.path.exists(f"{work_dir}/.terraform/providers/aws/provider"))
+        with open(f"{work_dir}/.terraform/modules/modules.json") as f:
+            modules = json.load(f)["Modules"]
+        self.assertEqual({"Key": "cluster-1", "Source": source, "Dir": ".terraform/modules/cluster-1"}, modules[1])
+        self.assertEqual(0, self.cache.stats()["builds"])
+
+    def test_module_revision(self):
+        source, _ = self.cache.module_source("scalecube/terraform-cluster", "v0.5")
+        self.assertEqual(git("rev-parse", "HEAD", cwd=self.remote), self.cache.module_revision(source))
+        self.assertIsNone(self.cache.module_revision("git@github.com:scalecube/terraform-cluster.git?ref=v0.5"))
+
+
+class PlanCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_plan_results_by_key(self):
+        cache = PlanCache(root=self.tmp)
+        self.assertIsNone(cache.get("inputs-1"))
+        cache.put("inputs-1", True, plan="/work/plan.tfplan")
+        cache.put("inputs-2", False, complete=True)
+
+        self.assertEqual((True, False), (cache.get("inputs-1")["changes"], cache.get("inputs-1")["complete"]))
+        self.assertEqual((False, True), (cache.get("inputs-2")["changes"], cache.get("inputs-2")["complete"]))
+        self.assertEqual({"hits": 4, "misses": 1, "entries": 2}, cache.stats())
+
+    def test_expired_results_are_not_used(self):
+        cache = PlanCache(root=self.tmp, ttl_sec=-1)
+        cache.put("inputs", False, complete=True)
+        self.assertIsNone(cache.get("inputs"))
+
+
+if __name__ == '__main__':
+    unittest.main()
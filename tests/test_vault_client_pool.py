@@ -0,0 +1,79 @@
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+from common import vault_pool
+from common.vault_api import Vault
+from common.vault_pool import VaultClientPool
+from tests.fake_vault import FakeVault
+
+
+class VaultClientPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.vault = FakeVault().start()
+        self.jwt_file = tempfile.NamedTemporaryFile("w", delete=False)
+        self.jwt_file.write("service-account-jwt")
+        self.jwt_file.close()
+        self.env = {k: os.environ.get(k) for k in ("VAULT_ADDR", "VAULT_JWT_PATH", "VAULT_ROLE")}
+        os.environ.update({"VAULT_ADDR": self.vault.addr, "VAULT_JWT_PATH": self.jwt_file.name,
+                           "VAULT_ROLE": "spinless"})
+        self.pool = VaultClientPool(renew_before_expiry=1)
+        self.default_pool = vault_pool.client_pool
+        vault_pool.client_pool = self.pool
+        self.vault.secrets["secretv2/app/registry"] = {"user": "u"}
+
+    def tearDown(self):
+        vault_pool.client_pool = self.default_pool
+        for k, v in self.env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        os.unlink(self.jwt_file.name)
+        self.vault.stop()
+
+    def new_vault(self):
+        return Vault(logging.getLogger("test"))
+
+    def test_login_once_for_many_operations(self):
+        for _ in range(20):
+            self.assertEqual({"user": "u"}, self.new_vault().read("secretv2/app/registry")["data"])
+            self.new_vault().write("secretv2/app/other", key="value")
+            self.assertEqual(["other", "registry"], self.new_vault().list("secretv2/app"))
+
+        self.assertEqual(1, self.vault.logins)
+        self.assertEqual(20, self.vault.reads)
+        # Vault uses the pool configured by the test
+        self.assertEqual(1, self.pool.stats()["logins"])
+
+    def test_token_renewed_before_expiry(self):
+        self.vault.lease_duration = 2
+        self.new_vault().read("secretv2/app/registry")
+        time.sleep(1.1)
+        self.new_vault().read("secretv2/app/registry")
+
+        self.assertEqual(1, self.vault.logins)
+        self.assertEqual(1, self.vault.renewals)
+
+    def test_login_again_when_not_renewable_token_expires(self):
+        self.vault.lease_duration = 2
+        self.vault.renewable = False
+        self.new_vault().read("secretv2/app/registry")
+        time.sleep(1.1)
+        self.new_vault().read("secretv2/app/registry")
+
+        self.assertEqual(2, self.vault.logins)
+        self.assertEqual(0, self.vault.renewals)
+
+    def test_login_again_on_forbidden(self):
+        self.new_vault().read("secretv2/app/registry")
+        self.vault.revoke_all()
+
+        self.assertEqual({"user": "u"}, self.new_vault().read("secretv2/app/registry")["data"])
+        self.assertEqual(2, self.vault.logins)
+
+
+if __name__ == '__main__':
+    unittest.main()